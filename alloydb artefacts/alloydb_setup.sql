@@ -40,6 +40,9 @@ CREATE EXTENSION IF NOT EXISTS vector CASCADE;
 -- Enable AlloyDB ScaNN (High-performance vector indexing)
 CREATE EXTENSION IF NOT EXISTS alloydb_scann CASCADE;
 
+-- Enable trigram matching (Indexed substring search over prompt history)
+CREATE EXTENSION IF NOT EXISTS pg_trgm CASCADE;
+
 -- Enable Parameterized Views (Required for Toolbox)
 CREATE EXTENSION IF NOT EXISTS parameterized_views CASCADE;
 
@@ -81,20 +84,167 @@ SELECT google_ml.embedding(
 ) AS test_vector;
 
 
+-- 2b. QUERY EMBEDDING CACHE
+-- ===================================================================================
+-- Every embedding()/ai.text_embedding() call is a remote Vertex AI request. A search
+-- prompt used to be embedded several times (text + image similarity in the query
+-- templates, the semantic cache lookup, and again for user_prompt_history), and
+-- popular prompts were re-embedded on every search. cached_embedding() wraps the
+-- model calls with a table keyed on (model, sha256(content)), so a given text is
+-- embedded once per model. Hit/miss counters are sequences (no row locks on the
+-- hot path); see the embedding_cache_stats view.
+DROP TABLE IF EXISTS embedding_cache CASCADE;
+
+CREATE TABLE embedding_cache (
+    model_id text NOT NULL,
+    content_hash bytea NOT NULL,
+    content text NOT NULL,
+    -- Dimensions differ per model (3072 for Gemini text, 1408 for multimodal)
+    embedding public.vector NOT NULL,
+    created_at timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_used_at timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model_id, content_hash)
+);
+
+CREATE INDEX idx_embedding_cache_last_used ON embedding_cache (last_used_at);
+
+DROP SEQUENCE IF EXISTS embedding_cache_hits_seq;
+DROP SEQUENCE IF EXISTS embedding_cache_misses_seq;
+CREATE SEQUENCE embedding_cache_hits_seq;
+CREATE SEQUENCE embedding_cache_misses_seq;
+
+CREATE OR REPLACE FUNCTION cached_embedding(p_model_id text, p_content text)
+RETURNS public.vector AS $$
+DECLARE
+    v_hash bytea;
+    v_embedding public.vector;
+    -- GDA may run queries read-only; the cache is then used but not written
+    v_writable boolean := current_setting('transaction_read_only') = 'off';
+BEGIN
+    IF p_content IS NULL THEN
+        RETURN NULL;
+    END IF;
+    v_hash := sha256(convert_to(p_content, 'UTF8'));
+
+    SELECT embedding INTO v_embedding
+    FROM embedding_cache
+    WHERE model_id = p_model_id AND content_hash = v_hash;
+
+    IF FOUND THEN
+        IF v_writable THEN
+            PERFORM nextval('embedding_cache_hits_seq');
+            -- Coarse LRU timestamp: at most one write per entry and hour
+            UPDATE embedding_cache SET last_used_at = CURRENT_TIMESTAMP
+            WHERE model_id = p_model_id AND content_hash = v_hash
+              AND last_used_at < CURRENT_TIMESTAMP - interval '1 hour';
+        END IF;
+        RETURN v_embedding;
+    END IF;
+
+    IF p_model_id LIKE 'multimodalembedding%' THEN
+        v_embedding := ai.text_embedding(model_id => p_model_id, content => p_content)::public.vector;
+    ELSE
+        v_embedding := public.embedding(p_model_id, p_content)::public.vector;
+    END IF;
+
+    IF v_writable THEN
+        PERFORM nextval('embedding_cache_misses_seq');
+        INSERT INTO embedding_cache (model_id, content_hash, content, embedding)
+        VALUES (p_model_id, v_hash, p_content, v_embedding)
+        ON CONFLICT (model_id, content_hash) DO NOTHING;
+    END IF;
+    RETURN v_embedding;
+END;
+$$ LANGUAGE plpgsql VOLATILE SECURITY DEFINER SET search_path = public, pg_temp;
+
+-- Keeps the newest `max_entries` entries (by last use); returns the number removed.
+-- The search backend calls it hourly (EMBEDDING_CACHE_MAX_ENTRIES,
+-- EMBEDDING_CACHE_PRUNE_INTERVAL). To prune in the database instead, set
+-- EMBEDDING_CACHE_PRUNE_INTERVAL=0 and schedule it with pg_cron, e.g.:
+--   CREATE EXTENSION IF NOT EXISTS pg_cron;
+--   SELECT cron.schedule('prune-embedding-cache', '0 * * * *', 'SELECT prune_embedding_cache(100000)');
+CREATE OR REPLACE FUNCTION prune_embedding_cache(max_entries integer) RETURNS bigint AS $$
+    WITH doomed AS (
+        SELECT model_id, content_hash FROM embedding_cache
+        ORDER BY last_used_at DESC
+        OFFSET max_entries
+    ), deleted AS (
+        DELETE FROM embedding_cache e USING doomed d
+        WHERE e.model_id = d.model_id AND e.content_hash = d.content_hash
+        RETURNING 1
+    )
+    SELECT count(*) FROM deleted;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE VIEW embedding_cache_stats AS
+SELECT
+    (SELECT count(*) FROM embedding_cache) AS entries,
+    h.hits,
+    m.misses,
+    CASE WHEN h.hits + m.misses > 0 THEN round(h.hits::numeric / (h.hits + m.misses), 4) ELSE 0 END AS hit_ratio
+FROM (SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS hits FROM embedding_cache_hits_seq) h,
+     (SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS misses FROM embedding_cache_misses_seq) m;
+
+
 -- 3. TABLE CREATION
 -- ===================================================================================
 DROP TABLE IF EXISTS user_prompt_history CASCADE;
 
 CREATE TABLE public.user_prompt_history (
     id SERIAL PRIMARY KEY,
-    "timestamp" timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
+    "timestamp" timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
     user_prompt text,
-    prompt_embedded public.vector(3072) GENERATED ALWAYS AS (public.embedding('gemini-embedding-001'::text, user_prompt)) STORED,
+    -- Filled by trg_user_prompt_history_embedding through the embedding cache.
+    prompt_embedded public.vector(3072),
     query_template_used boolean,
     query_template_id integer,
-    query_explanation text
+    query_explanation text,
+    -- Semantic result cache: /api/search response for this prompt and the
+    -- property_listings version it was computed against (NULL = not cached).
+    search_response jsonb,
+    listings_version bigint,
+    -- Full-text document for history search (prompt + explanation).
+    prompt_tsv tsvector GENERATED ALWAYS AS (
+        to_tsvector('english', coalesce(user_prompt, '') || ' ' || coalesce(query_explanation, ''))
+    ) STORED
 );
 
+-- Prompts already embedded for a search (semantic cache, templates) are not re-embedded.
+CREATE OR REPLACE FUNCTION set_prompt_embedded() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.user_prompt IS DISTINCT FROM OLD.user_prompt THEN
+        NEW.prompt_embedded := cached_embedding('gemini-embedding-001', NEW.user_prompt);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_user_prompt_history_embedding
+BEFORE INSERT OR UPDATE OF user_prompt ON user_prompt_history
+FOR EACH ROW EXECUTE FUNCTION set_prompt_embedded();
+
+-- Only the (few) rows that carry a cached response are scanned by the cache.
+CREATE INDEX idx_user_prompt_history_cached ON user_prompt_history (id)
+WHERE search_response IS NOT NULL;
+
+-- Keyset pagination of /api/history: newest-first pages and "since" polls
+-- are index range scans on ("timestamp", id), however large the table grows.
+CREATE INDEX idx_user_prompt_history_ts_id ON user_prompt_history ("timestamp" DESC, id DESC);
+
+-- Same access path when the history is filtered by template.
+CREATE INDEX idx_user_prompt_history_template_ts_id
+ON user_prompt_history (query_template_id, "timestamp" DESC, id DESC);
+
+-- History search: ranked full-text search ("text" mode).
+CREATE INDEX idx_user_prompt_history_tsv ON user_prompt_history USING gin (prompt_tsv);
+
+-- History search and ILIKE filters: "contains" matching ("substring" mode).
+CREATE INDEX idx_user_prompt_history_prompt_trgm
+ON user_prompt_history USING gin (user_prompt gin_trgm_ops);
+CREATE INDEX idx_user_prompt_history_explanation_trgm
+ON user_prompt_history USING gin (query_explanation gin_trgm_ops);
+-- The ScaNN index for "similar prompts" is in create_indexes.sql.
+
 
 DROP TABLE IF EXISTS property_listings CASCADE;
 
@@ -109,16 +259,93 @@ CREATE TABLE property_listings (
     country VARCHAR(100) DEFAULT 'Switzerland',
     canton VARCHAR(100),
     -- COLUMN A: Text Embeddings (Managed by Database)
-    -- Automatically generates a 3072-dim vector when you insert text into 'description'.
-    description_embedding VECTOR(3072) GENERATED ALWAYS AS (
-      embedding('gemini-embedding-001', description)
-    ) STORED,
+    -- Automatically generates a 3072-dim vector when you insert text into 'description'
+    -- (trigger below). Bulk loads (scripts/load_listings.py) may supply precomputed
+    -- vectors, which the trigger keeps.
+    description_embedding VECTOR(3072),
     -- COLUMN B: Image Embeddings (Managed by Application)
     -- Populated by 'bootstrap_images.py' using the Multimodal model (3072 dims).
-    image_embedding VECTOR(1408) 
+    image_embedding VECTOR(1408),
+    -- "<model>:<dimension>:<object hash>" of the image the vector was computed from;
+    -- lets 'bootstrap_images.py --reembed' skip images that have not changed.
+    image_embedding_checksum TEXT
+);
+
+CREATE OR REPLACE FUNCTION set_description_embedding() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.description IS DISTINCT FROM OLD.description
+       AND NEW.description_embedding IS NOT DISTINCT FROM OLD.description_embedding THEN
+        -- Description changed without a new vector: the old one is stale
+        NEW.description_embedding := NULL;
+    END IF;
+    IF NEW.description_embedding IS NULL AND NEW.description IS NOT NULL THEN
+        NEW.description_embedding := embedding('gemini-embedding-001', NEW.description)::vector;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_property_listings_description_embedding
+BEFORE INSERT OR UPDATE OF description, description_embedding ON property_listings
+FOR EACH ROW EXECUTE FUNCTION set_description_embedding();
+
+-- Resume points of scripts/load_listings.py, committed together with each batch.
+DROP TABLE IF EXISTS listing_load_checkpoints CASCADE;
+
+CREATE TABLE listing_load_checkpoints (
+    source text PRIMARY KEY,
+    rows_loaded bigint NOT NULL DEFAULT 0,
+    updated_at timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 
+-- 3b. SEARCH CACHE INVALIDATION
+-- ===================================================================================
+-- Every write to property_listings bumps a version counter. The backend stores the
+-- version with each cached search response and only reuses responses whose version
+-- is still current, so cached results never outlive the data they were built from.
+DROP TABLE IF EXISTS search_cache_state CASCADE;
+
+CREATE TABLE search_cache_state (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    listings_version bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO search_cache_state (id, listings_version) VALUES (true, 0);
+
+CREATE OR REPLACE FUNCTION bump_listings_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE search_cache_state SET listings_version = listings_version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_property_listings_cache_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON property_listings
+FOR EACH STATEMENT EXECUTE FUNCTION bump_listings_version();
+
+
+-- 3c. AGENT SESSION SNAPSHOTS
+-- ===================================================================================
+-- Optional persistent backend of the agent's session store (AGENT_SESSION_STORE=alloydb).
+-- Sessions live in memory; snapshots are written here in the background so they
+-- survive restarts and can be picked up by other instances.
+DROP TABLE IF EXISTS agent_sessions CASCADE;
+
+CREATE TABLE agent_sessions (
+    app_name text NOT NULL,
+    user_id text NOT NULL,
+    session_id text NOT NULL,
+    snapshot jsonb NOT NULL,
+    updated_at timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (app_name, user_id, session_id)
+);
+
+-- Retention sweeps delete by age
+CREATE INDEX idx_agent_sessions_updated_at ON agent_sessions (updated_at);
+
+
 -- 4. SAMPLE DATA INSERTION
 -- ===================================================================================
 -- Embeddings for 'description' are generated automatically upon insertion. Use Gemini to customize the sample data to your cities and add more samples if you like.
@@ -1,5 +1,10 @@
 import os
+import io
+import time
+import asyncio
+import argparse
 import psycopg2
+from psycopg2.extras import execute_values
 import vertexai
 from vertexai.vision_models import ImageGenerationModel
 from vertexai.vision_models import MultiModalEmbeddingModel, Image as VertexImage
@@ -20,15 +25,36 @@ PROJECT_ID = os.getenv("GCP_PROJECT_ID") or os.environ.get("GOOGLE_CLOUD_PROJECT
 LOCATION = os.getenv("GCP_LOCATION", "europe-west1")
 BUCKET_NAME = f"property-images-{PROJECT_ID}" # Matches the bucket you just created
 
+# Pipeline defaults (override on the command line). Rates are requests per minute
+# and should stay below the project's Vertex AI quotas.
+IMAGEN_CONCURRENCY = int(os.getenv("BOOTSTRAP_IMAGEN_CONCURRENCY", "4"))
+IMAGEN_RPM = float(os.getenv("BOOTSTRAP_IMAGEN_RPM", "20"))
+EMBED_CONCURRENCY = int(os.getenv("BOOTSTRAP_EMBED_CONCURRENCY", "8"))
+EMBED_RPM = float(os.getenv("BOOTSTRAP_EMBED_RPM", "120"))
+UPLOAD_CONCURRENCY = int(os.getenv("BOOTSTRAP_UPLOAD_CONCURRENCY", "8"))
+DB_BATCH_SIZE = int(os.getenv("BOOTSTRAP_DB_BATCH_SIZE", "50"))
+DB_FLUSH_INTERVAL = 5.0
+QUEUE_SIZE = 32
+MAX_RETRIES = 4
+
+# Model and dimension of image_embedding. Both are part of the stored checksum, so
+# changing either makes the backfill mode (--reembed) recompute every vector.
+EMBED_MODEL_ID = "multimodalembedding"
+EMBED_DIMENSION = 1408
+IMAGE_PREFIX = "listings/"
+
 print(f"🚀 Starting Image Bootstrap for Project: {PROJECT_ID}")
 print(f"📂 Target Bucket: {BUCKET_NAME}")
 
 # --- INITIALIZE CLIENTS ---
 vertexai.init(project=PROJECT_ID, location=LOCATION)
 gen_model = ImageGenerationModel.from_pretrained("imagen-4.0-fast-generate-001")
-embed_model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding")
+embed_model = MultiModalEmbeddingModel.from_pretrained(EMBED_MODEL_ID)
 storage_client = storage.Client()
 
+# Queue sentinel that tells the next stage its upstream is finished
+_DONE = object()
+
 def get_db_connection():
     return psycopg2.connect(
         dbname=os.getenv("DB_NAME", "search"),
@@ -38,96 +64,394 @@ def get_db_connection():
         port="5432"
     )
 
-def generate_and_upload(listing_id, description):
-    try:
-        print(f"\n[ID: {listing_id}] Generating image for: {description[:50]}...")
-        
-        # 1. Generate Image with Imagen
-        prompt = f"A professional architectural photograph of {description}. High quality, realistic, 4k, sunny day."
-        response = gen_model.generate_images(prompt=prompt, number_of_images=1)
-        generated_image = response[0]
-        
-        # 2. Save locally temporarily
-        temp_png = f"temp_{listing_id}.png"
-        temp_jpg = f"temp_{listing_id}.jpg"
-        generated_image.save(temp_png)
-        
-        # 3. Compress to JPEG
-        with PilImage.open(temp_png) as img:
-            img = img.convert("RGB") # Ensure no alpha channel
-            img.save(temp_jpg, "JPEG", quality=85, optimize=True)
-        
-        # 4. Upload to GCS
-        destination_blob_name = f"listings/{listing_id}.jpg"
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(temp_jpg)
-        
-        # Public URL (if bucket is public) or gs:// URI
-        gcs_uri = f"gs://{BUCKET_NAME}/{destination_blob_name}"
-        public_url = f"https://storage.googleapis.com/{BUCKET_NAME}/{destination_blob_name}"
-        
-        # 4. Generate Multi-Modal Embedding (The "Visual Vector")
-        # We use the compressed JPEG for consistency
-        print(f"[ID: {listing_id}] Calculating visual embeddings...")
-        v_image = VertexImage.load_from_file(temp_jpg)
-        embeddings = embed_model.get_embeddings(image=v_image, dimension=1408)
-        vector_data = embeddings.image_embedding
-        
-        # Cleanup local files
-        if os.path.exists(temp_png): os.remove(temp_png)
-        if os.path.exists(temp_jpg): os.remove(temp_jpg)
-        
-        return public_url, vector_data
-
-    except Exception as e:
-        print(f"❌ Error processing ID {listing_id}: {e}")
-        if os.path.exists(f"temp_{listing_id}.png"): os.remove(f"temp_{listing_id}.png")
-        if os.path.exists(f"temp_{listing_id}.jpg"): os.remove(f"temp_{listing_id}.jpg")
-        return None, None
+
+class TokenBucket:
+    """
+    Async token bucket: `rate_per_minute` sustained, bursts up to `burst` requests.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class StageStats:
+    """
+    Per-stage counters: items done/failed and time spent working.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.done = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def summary(self, elapsed: float) -> str:
+        throughput = self.done / elapsed * 60 if elapsed else 0.0
+        avg = self.busy_seconds / self.done if self.done else 0.0
+        return (f"{self.name:<10} done={self.done:<6} failed={self.failed:<4} "
+                f"{throughput:7.1f}/min  avg {avg:6.2f}s per item")
+
+
+async def with_retries(stats: StageStats, listing_id, func, *args, limiter: TokenBucket = None):
+    """
+    Runs a blocking call in a worker thread, rate-limited and retried with backoff.
+    Returns None (and counts a failure) when all attempts fail.
+    """
+    for attempt in range(MAX_RETRIES):
+        if limiter:
+            await limiter.acquire()
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(func, *args)
+            stats.busy_seconds += time.perf_counter() - started
+            stats.done += 1
+            return result
+        except Exception as e:
+            stats.busy_seconds += time.perf_counter() - started
+            if attempt == MAX_RETRIES - 1:
+                stats.failed += 1
+                print(f"❌ [{stats.name}] Error processing ID {listing_id}: {e}")
+                return None
+            delay = 2 ** attempt
+            print(f"⚠️ [{stats.name}] ID {listing_id} failed ({e}); retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+
+# --- STAGE FUNCTIONS (blocking; run in worker threads) ---
+
+def generate_image(description):
+    # 1. Generate Image with Imagen
+    prompt = f"A professional architectural photograph of {description}. High quality, realistic, 4k, sunny day."
+    response = gen_model.generate_images(prompt=prompt, number_of_images=1)
+    return response[0]._image_bytes
+
+def compress_to_jpeg(image_bytes):
+    # 2. Compress to JPEG in memory (no temp files)
+    with PilImage.open(io.BytesIO(image_bytes)) as img:
+        img = img.convert("RGB") # Ensure no alpha channel
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=85, optimize=True)
+        return out.getvalue()
+
+def public_url(blob_name):
+    # Public URL (if bucket is public); the backend accepts both this and gs:// URIs
+    return f"https://storage.googleapis.com/{BUCKET_NAME}/{blob_name}"
+
+def embedding_checksum(content_hash):
+    # Identifies the exact image bytes *and* the embedding model that produced the vector
+    return f"{EMBED_MODEL_ID}:{EMBED_DIMENSION}:{content_hash}"
+
+def content_hash(blob):
+    # Composite objects have no MD5, only a CRC32C
+    return blob.md5_hash or blob.crc32c
+
+def upload_image(listing_id, jpeg_bytes):
+    # 3. Upload to GCS
+    destination_blob_name = f"{IMAGE_PREFIX}{listing_id}.jpg"
+    blob = storage_client.bucket(BUCKET_NAME).blob(destination_blob_name)
+    blob.upload_from_string(jpeg_bytes, content_type="image/jpeg")
+    return public_url(destination_blob_name), content_hash(blob)
+
+def download_image(blob):
+    # Backfill: read an existing image straight from GCS (in memory)
+    return blob.download_as_bytes()
+
+def embed_image(jpeg_bytes):
+    # 4. Generate Multi-Modal Embedding (The "Visual Vector")
+    # We use the compressed JPEG for consistency
+    embeddings = embed_model.get_embeddings(image=VertexImage(image_bytes=jpeg_bytes), dimension=EMBED_DIMENSION)
+    return embeddings.image_embedding
+
+def write_batch(conn, rows):
+    # 5. Update Database: one multi-row UPDATE per batch.
+    # An existing image_gcs_uri is kept, so backfills never rewrite image links.
+    with conn.cursor() as cursor:
+        execute_values(cursor, """
+            UPDATE property_listings AS p
+            SET image_gcs_uri = COALESCE(p.image_gcs_uri, v.image_gcs_uri),
+                image_embedding = v.image_embedding::vector,
+                image_embedding_checksum = v.checksum
+            FROM (VALUES %s) AS v(id, image_gcs_uri, image_embedding, checksum)
+            WHERE p.id = v.id
+        """, rows, template="(%s, %s, %s, %s)")
+    conn.commit()
+
+def ensure_checksum_column(conn):
+    # Databases created before the backfill mode lack the column
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE property_listings ADD COLUMN IF NOT EXISTS image_embedding_checksum TEXT")
+    conn.commit()
+
+def find_stale_images(conn, force=False):
+    """
+    Lists the objects under IMAGE_PREFIX and returns (listing_id, blob) pairs whose
+    stored checksum does not match the object's MD5 and the current model.
+    Only object metadata is listed here; image bytes are downloaded by the pipeline.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, image_embedding_checksum
+            FROM property_listings
+            WHERE image_embedding IS NOT NULL
+        """)
+        current = dict(cursor.fetchall())
+
+    stale, unchanged, skipped = [], 0, 0
+    for blob in storage_client.list_blobs(BUCKET_NAME, prefix=IMAGE_PREFIX):
+        stem = os.path.splitext(blob.name[len(IMAGE_PREFIX):])[0]
+        if not stem.isdigit():
+            skipped += 1
+            continue
+        listing_id = int(stem)
+        if not force and current.get(listing_id) == embedding_checksum(content_hash(blob)):
+            unchanged += 1
+            continue
+        stale.append((listing_id, blob))
+    stale.sort(key=lambda item: item[0])
+    print(f"🔎 {len(stale)} images to embed, {unchanged} unchanged, {skipped} objects not named <id>.jpg.")
+    return stale
+
+
+# --- PIPELINE ---
+
+class Pipeline:
+    """
+    generate -> compress -> upload -> embed -> db (or, for --reembed,
+    download -> embed -> db), connected by bounded queues. Each stage has its own
+    worker pool, so slow Imagen calls overlap with uploads, embeddings and DB
+    writes of earlier listings.
+    """
+
+    def __init__(self, conn, imagen_concurrency, imagen_rpm, embed_concurrency, embed_rpm,
+                 upload_concurrency, db_batch_size):
+        self.conn = conn
+        self.imagen_concurrency = imagen_concurrency
+        self.embed_concurrency = embed_concurrency
+        self.upload_concurrency = upload_concurrency
+        self.db_batch_size = db_batch_size
+        self.imagen_limiter = TokenBucket(imagen_rpm, burst=imagen_concurrency)
+        self.embed_limiter = TokenBucket(embed_rpm, burst=embed_concurrency)
+        self.stats = {}
+        self.started = time.monotonic()
+
+    async def _stage(self, name, inbox, outbox, workers, handle):
+        """
+        Runs `workers` consumers of `inbox`; `handle(item)` returns the item for
+        `outbox` or None to drop it. Forwards the end-of-input sentinel once all
+        workers have finished.
+        """
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # Let sibling workers see the sentinel too
+                    await inbox.put(_DONE)
+                    return
+                result = await handle(item)
+                if result is not None:
+                    await outbox.put(result)
+
+        self.stats.setdefault(name, StageStats(name))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        await outbox.put(_DONE)
+
+    async def _generate(self, item):
+        listing_id, description = item
+        image_bytes = await with_retries(self.stats["generate"], listing_id, generate_image, description,
+                                         limiter=self.imagen_limiter)
+        return (listing_id, image_bytes) if image_bytes else None
+
+    async def _compress(self, item):
+        listing_id, image_bytes = item
+        jpeg_bytes = await with_retries(self.stats["compress"], listing_id, compress_to_jpeg, image_bytes)
+        return (listing_id, jpeg_bytes) if jpeg_bytes else None
+
+    async def _upload(self, item):
+        listing_id, jpeg_bytes = item
+        uploaded = await with_retries(self.stats["upload"], listing_id, upload_image, listing_id, jpeg_bytes)
+        if not uploaded:
+            return None
+        url, md5_hash = uploaded
+        return (listing_id, url, md5_hash, jpeg_bytes)
+
+    async def _download(self, item):
+        listing_id, blob = item
+        image_bytes = await with_retries(self.stats["download"], listing_id, download_image, blob)
+        return (listing_id, public_url(blob.name), content_hash(blob), image_bytes) if image_bytes else None
+
+    async def _embed(self, item):
+        listing_id, url, md5_hash, jpeg_bytes = item
+        vector = await with_retries(self.stats["embed"], listing_id, embed_image, jpeg_bytes,
+                                    limiter=self.embed_limiter)
+        return (listing_id, url, str(vector), embedding_checksum(md5_hash)) if vector else None
+
+    async def _db_writer(self, inbox):
+        stats = self.stats.setdefault("db", StageStats("db"))
+        batch = []
+        last_flush = time.monotonic()
+
+        async def flush():
+            nonlocal batch, last_flush
+            if not batch:
+                return
+            rows, batch = batch, []
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(write_batch, self.conn, rows)
+                stats.done += len(rows)
+                print(f"✅ Database updated for {len(rows)} listings (IDs {rows[0][0]}..{rows[-1][0]}).")
+            except Exception as db_err:
+                stats.failed += len(rows)
+                print(f"❌ DB Write Error: {db_err}")
+                self.conn.rollback()
+            stats.busy_seconds += time.perf_counter() - started
+            last_flush = time.monotonic()
+
+        while True:
+            try:
+                item = await asyncio.wait_for(inbox.get(), timeout=DB_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                await flush()
+                continue
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= self.db_batch_size or time.monotonic() - last_flush >= DB_FLUSH_INTERVAL:
+                await flush()
+        await flush()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(30)
+            self.print_stats()
+
+    def print_stats(self):
+        elapsed = time.monotonic() - self.started
+        print(f"\n📊 Pipeline stats after {elapsed:.0f}s:")
+        for stats in self.stats.values():
+            print(f"   {stats.summary(elapsed)}")
+
+    async def _run(self, items, build_stages):
+        source = asyncio.Queue(maxsize=QUEUE_SIZE)
+        embedded = asyncio.Queue(maxsize=QUEUE_SIZE * 4)
+
+        async def feed():
+            for item in items:
+                await source.put(item)
+            await source.put(_DONE)
+
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(feed(), *build_stages(source, embedded), self._db_writer(embedded))
+        finally:
+            reporter.cancel()
+        self.print_stats()
+
+    async def run(self, rows):
+        """
+        Generates, uploads and embeds an image for each (id, description) row.
+        """
+        def stages(listings, embedded):
+            generated = asyncio.Queue(maxsize=QUEUE_SIZE)
+            compressed = asyncio.Queue(maxsize=QUEUE_SIZE)
+            uploaded = asyncio.Queue(maxsize=QUEUE_SIZE)
+            return [
+                self._stage("generate", listings, generated, self.imagen_concurrency, self._generate),
+                # JPEG encoding is CPU-bound and quick; two workers keep up with Imagen
+                self._stage("compress", generated, compressed, 2, self._compress),
+                self._stage("upload", compressed, uploaded, self.upload_concurrency, self._upload),
+                self._stage("embed", uploaded, embedded, self.embed_concurrency, self._embed),
+            ]
+
+        await self._run(rows, stages)
+
+    async def run_reembed(self, stale):
+        """
+        Backfill: downloads existing (listing_id, blob) images and only re-embeds them.
+        """
+        def stages(blobs, embedded):
+            downloaded = asyncio.Queue(maxsize=QUEUE_SIZE)
+            return [
+                self._stage("download", blobs, downloaded, self.upload_concurrency, self._download),
+                self._stage("embed", downloaded, embedded, self.embed_concurrency, self._embed),
+            ]
+
+        await self._run(stale, stages)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate listing images and visual embeddings.")
+    parser.add_argument("--limit", type=int, help="Process at most this many listings")
+    parser.add_argument("--imagen-concurrency", type=int, default=IMAGEN_CONCURRENCY)
+    parser.add_argument("--imagen-rpm", type=float, default=IMAGEN_RPM, help="Imagen requests per minute")
+    parser.add_argument("--embed-concurrency", type=int, default=EMBED_CONCURRENCY)
+    parser.add_argument("--embed-rpm", type=float, default=EMBED_RPM, help="Embedding requests per minute")
+    parser.add_argument("--upload-concurrency", type=int, default=UPLOAD_CONCURRENCY)
+    parser.add_argument("--db-batch-size", type=int, default=DB_BATCH_SIZE)
+    parser.add_argument("--reembed", action="store_true",
+                        help=f"Backfill: re-embed existing images under gs://{BUCKET_NAME}/{IMAGE_PREFIX} "
+                             "whose content or embedding model changed (no Imagen calls)")
+    parser.add_argument("--force", action="store_true", help="With --reembed: ignore stored checksums")
+    args = parser.parse_args()
+
     conn = get_db_connection()
+    ensure_checksum_column(conn)
+
+    pipeline = Pipeline(
+        conn,
+        imagen_concurrency=args.imagen_concurrency,
+        imagen_rpm=args.imagen_rpm,
+        embed_concurrency=args.embed_concurrency,
+        embed_rpm=args.embed_rpm,
+        upload_concurrency=args.upload_concurrency,
+        db_batch_size=args.db_batch_size,
+    )
+
+    if args.reembed:
+        print(f"🔍 Listing gs://{BUCKET_NAME}/{IMAGE_PREFIX} and comparing checksums...")
+        stale = find_stale_images(conn, force=args.force)
+        if args.limit:
+            stale = stale[:args.limit]
+        # Each committed batch stores its checksums, so an interrupted run resumes
+        # with exactly the images that are still missing or stale.
+        asyncio.run(pipeline.run_reembed(stale))
+        conn.close()
+        print("\n🎉 Re-embedding Complete!")
+        return
+
     cursor = conn.cursor()
-    
+
     # 1. Find listings that don't have an image yet
     print("🔍 Querying AlloyDB for listings without images...")
     cursor.execute("""
-        SELECT id, description 
-        FROM property_listings 
+        SELECT id, description
+        FROM property_listings
         WHERE image_gcs_uri IS NULL
         ORDER BY id ASC
-    """)
+    """ + (" LIMIT %d" % args.limit if args.limit else ""))
     rows = cursor.fetchall()
+    cursor.close()
     print(f"Found {len(rows)} listings to process.")
 
-    for row in rows:
-        listing_id, description = row
-        
-        # Generate Image & Vector
-        image_url, vector = generate_and_upload(listing_id, description)
-        
-        if image_url and vector:
-            # 2. Update Database
-            try:
-                cursor.execute("""
-                    UPDATE property_listings
-                    SET image_gcs_uri = %s,
-                        image_embedding = %s
-                    WHERE id = %s
-                """, (image_url, str(vector), listing_id))
-                conn.commit()
-                print(f"✅ [ID: {listing_id}] Database updated successfully.")
-            except Exception as db_err:
-                print(f"❌ DB Write Error: {db_err}")
-                conn.rollback()
-        else:
-            print(f"⚠️ Skipping DB update for ID {listing_id} due to generation failure.")
+    asyncio.run(pipeline.run(rows))
 
-    cursor.close()
     conn.close()
     print("\n🎉 Bootstrapping Complete!")
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
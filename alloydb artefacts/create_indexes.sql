@@ -1,9 +1,11 @@
 -- 5. INDEX CREATION (ScaNN)
 -- ===================================================================================
+-- These settings suit the small demo dataset. For real data volumes, size and
+-- benchmark the indexes with scripts/tune_scann_indexes.py (inspect / tune).
 -- Index 1: Text Description Index
--- Uses Cosine Distance for semantic similarity.
+-- Uses Cosine Distance for semantic similarity (serves `ORDER BY ... <=> ...`).
 CREATE INDEX idx_scann_property_desc ON property_listings
-USING scann (description_embedding)
+USING scann (description_embedding cosine)
 WITH (
     -- 'auto' mode requires ~10k rows. For this demo, we force MANUAL mode.
     mode = 'MANUAL',
@@ -13,9 +15,21 @@ WITH (
 
 -- Index 2: Visual Search Index
  CREATE INDEX idx_scann_image_search ON property_listings
- USING scann (image_embedding)
+ USING scann (image_embedding cosine)
  WITH (
     mode = 'MANUAL',
     num_leaves = 1,
     quantizer = 'SQ8'
 );
+
+-- Index 3: Prompt History Index
+-- Serves "similar past prompts" in /api/history/search and the semantic result cache.
+-- Prompt history grows continuously: once it holds ~10k rows, rebuild with
+-- mode = 'AUTO' (or num_leaves ~ sqrt(row count)) to keep lookups in milliseconds.
+CREATE INDEX idx_scann_prompt_history ON user_prompt_history
+USING scann (prompt_embedded cosine)
+WITH (
+    mode = 'MANUAL',
+    num_leaves = 1,
+    quantizer = 'SQ8'
+);
@@ -0,0 +1,96 @@
+/*
+===================================================================================
+ALLOYDB AI: HYBRID (TEXT + IMAGE) SEARCH FUNCTION
+===================================================================================
+
+A blended ORDER BY such as
+    0.6 * (1 - (description_embedding <=> q1)) + 0.4 * (1 - (image_embedding <=> q2))
+cannot be answered by either ScaNN index, so it computes exact distances for every
+row of property_listings. hybrid_search() instead runs two index-backed nearest
+neighbour scans (description and image embeddings), takes the top-K candidates of
+each, and re-ranks only the union of those candidates with the weighted score.
+The cost depends on K, not on the table size.
+
+Run after create_indexes.sql (the indexes must exist for the ANN scans to use them).
+The query embeddings come from cached_embedding() (alloydb_setup.sql, section 2b).
+
+Example:
+    SELECT * FROM hybrid_search('modern apartments with industrial look',
+                                p_city => 'Zurich', p_max_price => 6000, p_min_bedrooms => 2);
+===================================================================================
+*/
+
+CREATE OR REPLACE FUNCTION hybrid_search(
+    p_query text,
+    p_limit integer DEFAULT 25,
+    -- Candidates taken from each index before re-ranking (K)
+    p_candidates integer DEFAULT 100,
+    p_text_weight double precision DEFAULT 0.6,
+    p_image_weight double precision DEFAULT 0.4,
+    -- Optional filters, applied inside both candidate scans
+    p_city text DEFAULT NULL,
+    p_max_price numeric DEFAULT NULL,
+    p_min_bedrooms integer DEFAULT NULL
+)
+RETURNS TABLE (
+    image_gcs_uri text,
+    id integer,
+    title varchar,
+    description text,
+    bedrooms integer,
+    price numeric,
+    city varchar,
+    country varchar,
+    canton varchar,
+    text_similarity double precision,
+    image_similarity double precision,
+    score double precision
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_text_query public.vector := cached_embedding('gemini-embedding-001', p_query);
+    v_image_query public.vector := cached_embedding('multimodalembedding@001', p_query);
+    -- Never fewer candidates than results
+    v_candidates integer := GREATEST(p_candidates, p_limit);
+BEGIN
+    RETURN QUERY
+    WITH text_candidates AS (
+        SELECT l.id
+        FROM property_listings l
+        WHERE (p_city IS NULL OR LOWER(l.city) = LOWER(p_city))
+          AND (p_max_price IS NULL OR l.price <= p_max_price)
+          AND (p_min_bedrooms IS NULL OR l.bedrooms >= p_min_bedrooms)
+        ORDER BY l.description_embedding <=> v_text_query
+        LIMIT v_candidates
+    ),
+    image_candidates AS (
+        SELECT l.id
+        FROM property_listings l
+        WHERE l.image_embedding IS NOT NULL
+          AND (p_city IS NULL OR LOWER(l.city) = LOWER(p_city))
+          AND (p_max_price IS NULL OR l.price <= p_max_price)
+          AND (p_min_bedrooms IS NULL OR l.bedrooms >= p_min_bedrooms)
+        ORDER BY l.image_embedding <=> v_image_query
+        LIMIT v_candidates
+    ),
+    candidates AS (
+        SELECT c.id FROM text_candidates c
+        UNION
+        SELECT c.id FROM image_candidates c
+    ),
+    scored AS (
+        SELECT l.*,
+               (1 - (l.description_embedding <=> v_text_query))::double precision AS text_similarity,
+               -- Listings without an image embedding yet score 0 on the image side
+               COALESCE(1 - (l.image_embedding <=> v_image_query), 0)::double precision AS image_similarity
+        FROM candidates c
+        JOIN property_listings l ON l.id = c.id
+    )
+    SELECT s.image_gcs_uri, s.id, s.title, s.description, s.bedrooms, s.price,
+           s.city, s.country, s.canton, s.text_similarity, s.image_similarity,
+           p_text_weight * s.text_similarity + p_image_weight * s.image_similarity AS score
+    FROM scored s
+    ORDER BY score DESC NULLS LAST
+    LIMIT p_limit;
+END;
+$$ LANGUAGE plpgsql VOLATILE;
@@ -1,7 +1,9 @@
 import os
 from textwrap import dedent
 from google.adk.agents import Agent
-from toolbox_core import ToolboxSyncClient
+from google.adk.tools import ToolContext
+from toolbox_tools import LazyToolboxTool, ToolUnavailableError
+from result_store import RefinementError, SessionResultStore
 
 # Ensure Google Cloud environment variables are set for Vertex AI
 if not os.getenv("GOOGLE_CLOUD_PROJECT") and os.getenv("GCP_PROJECT_ID"):
@@ -11,19 +13,60 @@ if not os.getenv("GOOGLE_CLOUD_LOCATION"):
 if not os.getenv("GOOGLE_GENAI_USE_VERTEXAI"):
     os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "true"
 
-# Initialize Toolbox Client
-TOOLBOX_URL = os.getenv("TOOLBOX_URL", "http://127.0.0.1:5000")
-toolbox = ToolboxSyncClient(TOOLBOX_URL)
+# Toolbox tool, loaded in the background with retries (started by the service's
+# startup hook, or on first use) instead of over the network at import time
+gda_query_tool = LazyToolboxTool("cloud_gda_query_tool_alloydb")
 
-# Load tools from Toolbox
-# We load the 'search-properties' tool we defined in tools.yaml
-try:
- #   tool = toolbox.load_tool("search-properties")
-    tool = toolbox.load_tool("cloud_gda_query_tool_alloydb")
-    tools = [tool]
-except Exception as e:
-    print(f"Warning: Could not load tools from {TOOLBOX_URL}: {e}")
-    tools = []
+# Each session's last search result, for refinements without a new GDA round trip
+result_store = SessionResultStore()
+
+def _session_key(tool_context: ToolContext) -> str:
+    session = getattr(tool_context, "session", None) or tool_context._invocation_context.session
+    return f"{session.app_name}:{session.user_id}:{session.id}"
+
+async def cloud_gda_query_tool_alloydb(prompt: str, tool_context: ToolContext):
+    """
+    Use this tool to send natural language queries to the Gemini Data Analytics
+    API and receive SQL, natural language answers, and explanations.
+
+    Args:
+        prompt: The natural language question about the property listings.
+    """
+    key = _session_key(tool_context)
+    try:
+        response = await gda_query_tool(prompt=prompt)
+    except ToolUnavailableError as e:
+        result_store.discard(key)
+        # Let the model tell the user instead of failing the whole turn
+        return {"error": f"The property search is temporarily unavailable, please try again shortly. ({e})"}
+    except Exception:
+        result_store.discard(key)
+        raise
+    # Also drops the previous result if this response has none
+    result_store.put(key, response)
+    return response
+
+def refine_previous_results(tool_context: ToolContext, filters: str = "", sort_by: str = "",
+                            descending: bool = False, limit: int = 0) -> dict:
+    """
+    Filters, sorts or limits the properties found by the last search in this
+    conversation, without running a new search. Conditions always apply to the
+    last search's full result, so repeat earlier refinements that should still apply.
+
+    Args:
+        filters: Conditions separated by ";", each '<column> <op> <value>' with op one of
+            =, !=, <, <=, >, >=, contains. Example: "price <= 3000; bedrooms >= 2".
+        sort_by: Column to sort by, or empty to keep the order.
+        descending: Sort from highest to lowest.
+        limit: Keep only the first N properties (0 keeps all).
+    """
+    try:
+        return result_store.refine(_session_key(tool_context), filters=filters, sort_by=sort_by,
+                                   descending=descending, limit=limit)
+    except RefinementError as e:
+        return {"error": f"{e} Use a new search instead."}
+
+tools = [cloud_gda_query_tool_alloydb, refine_previous_results]
 
 # Define the professional system instruction
 
@@ -35,7 +78,8 @@ system_instruction = dedent("""
   - For the initial tool call parse the users NL query to the tool. Only rephrase the users NL query into a meaningful search string if initial tool response is empty.
 
 # OPERATIONAL CONSTRAINTS
-- TOOL LIMITATION: You only have access to the Query Data Tool. Do not claim to have capabilities beyond what this tool provides.
+- TOOL LIMITATION: You only have access to the Query Data Tool and the refinement tool. Do not claim to have capabilities beyond what these tools provide.
+- REFINEMENTS: If the user only narrows, sorts or shortens the previous results (e.g. "only the ones under 3000", "sort by price", "just the top 3"), use refine_previous_results with the result columns instead of a new search. Use the Query Data Tool for anything that needs properties outside the previous results, or if the refinement tool returns an error.
 - TRANSPARENCY POLICY: Maintain a seamless user experience. Never mention that you are using a tool, querying a database, or generating SQL. Frame all responses as your own direct assistance.
 - SCOPE MANAGEMENT: If a user asks for something beyond your capabilities, politely state that you cannot perform that specific task. Guide the user towards what you can help with.
 
@@ -44,61 +88,11 @@ system_instruction = dedent("""
 - Maintain a helpful, professional persona.
 
 # RESPONSE GUIDELINES (Conversational)
-- Summarize, Don't List:** Do NOT list property details in the text response. Instead, provide a high-level summary.
-- UI Handoff:** You must explicitly mention that you have updated the visual interface.
+- Summarize, Don't List:** Do NOT list property details in the text response. Instead, provide a high-level summary in two or three sentences.
+- UI Handoff:** The matching properties are shown in the visual interface automatically. Mention that you have updated it.
+- No Data Blocks:** Never repeat the tool results as JSON, tables or lists.
 - Iterate:** Always ask if the user wishes to refine the search by price, city, or amenities.
 - No Results:** If the tool returns empty results, politely inform the user and suggest broader criteria.
-
-# DATA FORMATTING (Technical Strictness)
-- If the tool returns results, you MUST append a JSON block to the very end of your response.
-- Content:** Include ALL results returned by the tool. Do not truncate the list.
-- Wrapper:** The block must be strictly wrapped in specific tags: ```json_properties ... ```
-- Schema:**
-      ```json_properties
-      [
-        {
-          "id": 1,
-          "title": "Property Title",
-          "price": 0,
-          "city": "City Name",
-          "bedrooms": 0,
-          "description": "Short description",
-          "image_gcs_uri": "gs://..."
-        }
-      ]
-      ```
-    - **CRITICAL:** Do NOT invent or hallucinate `image_gcs_uri`. If the tool does not return a URI, set it to `null`.
-    - **CRITICAL:** Do NOT use placeholder URIs like `gs://property-images-gcs/...`. Only use the exact URI returned by the tool.
-
-    ### FEW-SHOT EXAMPLES
-
-    **Scenario 1: Tool returns an image URI**
-    *Tool Output:* `[{"id": 1, "title": "Sunny Flat", "image_gcs_uri": "gs://my-bucket/img.jpg"}]`
-    *Your JSON Response:*
-    ```json_properties
-    [
-      {
-        "id": 1,
-        "title": "Sunny Flat",
-        ...
-        "image_gcs_uri": "gs://my-bucket/img.jpg"
-      }
-    ]
-    ```
-
-    **Scenario 2: Tool returns NO image URI**
-    *Tool Output:* `[{"id": 2, "title": "Cozy Cabin"}]` (or `image_gcs_uri` is null)
-    *Your JSON Response:*
-    ```json_properties
-    [
-      {
-        "id": 2,
-        "title": "Cozy Cabin",
-        ...
-        "image_gcs_uri": null
-      }
-    ]
-    ```
 """).strip()
 
 # Define the Agent
@@ -0,0 +1,201 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# SHARED ALLOYDB CONNECTION POOL
+# ==============================================================================
+# One lazily created, lock-protected SQLAlchemy async engine per service,
+# connecting through the AlloyDB Auth Proxy with asyncpg. The pool is sized and
+# recycled from the environment, stale connections are detected with a
+# pre-ping, prepared statements are cached per connection, and the pool can be
+# warmed at startup so the first requests after a cold start do not pay for
+# connecting. Checkout counts, waiters and wait times are tracked for metrics.
+#
+# This module is shared by the search backend and the agent service.
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle before the proxy or server closes idle connections
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+DB_POOL_WARMUP_CONNECTIONS = int(os.getenv("DB_POOL_WARMUP_CONNECTIONS", "2"))
+
+
+class PoolMetrics:
+    """
+    Counters for connection checkouts, updated by `InstrumentedQueuePool`.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def begin_wait(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        return time.perf_counter()
+
+    def end_wait(self, started: float, ok: bool):
+        self.waiting -= 1
+        waited = time.perf_counter() - started
+        if ok:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        else:
+            self.timeouts += 1
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that measures how long each checkout waits for a connection
+    (including establishing a new one).
+    """
+
+    metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        if self.metrics is None:
+            return super()._do_get()
+        started = self.metrics.begin_wait()
+        ok = False
+        try:
+            connection = super()._do_get()
+            ok = True
+            return connection
+        finally:
+            self.metrics.end_wait(started, ok)
+
+
+class DatabasePool:
+    """
+    Owns the service's async engine. `get_engine` is safe to call concurrently:
+    the first callers share one engine instead of each building their own.
+    """
+
+    def __init__(self, host: str, user: str, password: Optional[str], database: str,
+                 pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+                 pool_timeout: float = DB_POOL_TIMEOUT, pool_recycle: int = DB_POOL_RECYCLE,
+                 pre_ping: bool = DB_POOL_PRE_PING,
+                 statement_cache_size: int = DB_STATEMENT_CACHE_SIZE):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.pre_ping = pre_ping
+        self.statement_cache_size = statement_cache_size
+        self.metrics = PoolMetrics()
+        self.engine: Optional[AsyncEngine] = None
+        self._lock = asyncio.Lock()
+        self.warmed_connections = 0
+
+    async def get_engine(self) -> AsyncEngine:
+        if self.engine:
+            return self.engine
+
+        async with self._lock:
+            # Another caller may have created the engine while we waited
+            if self.engine:
+                return self.engine
+
+            if not self.host:
+                raise ValueError("DB_HOST environment variable is not set.")
+
+            logger.info(f"Connecting to AlloyDB via Auth Proxy at {self.host}...")
+            db_url = (
+                f"postgresql+asyncpg://{self.user}:{self.password}@{self.host}/{self.database}"
+                f"?prepared_statement_cache_size={self.statement_cache_size}"
+            )
+            engine = create_async_engine(
+                db_url,
+                poolclass=InstrumentedQueuePool,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+                pool_recycle=self.pool_recycle,
+                pool_pre_ping=self.pre_ping,
+                connect_args={"statement_cache_size": self.statement_cache_size},
+            )
+            engine.sync_engine.pool.metrics = self.metrics
+            self.engine = engine
+            return engine
+
+    async def warm_up(self, connections: int = DB_POOL_WARMUP_CONNECTIONS):
+        """
+        Opens `connections` pooled connections concurrently (bounded by the pool
+        size) and returns them to the pool. Failures are logged, not raised, so a
+        slow or unavailable database does not prevent the service from starting.
+        """
+        connections = min(connections, self.pool_size)
+        if connections <= 0:
+            return
+
+        started = time.perf_counter()
+        try:
+            engine = await self.get_engine()
+
+            async def open_one():
+                async with engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+
+            results = await asyncio.gather(*(open_one() for _ in range(connections)), return_exceptions=True)
+            failures = [r for r in results if isinstance(r, Exception)]
+            self.warmed_connections = connections - len(failures)
+            if failures:
+                logger.warning(f"DB pool warm-up: {len(failures)}/{connections} connections failed: {failures[0]}")
+            logger.info(
+                f"DB pool warmed with {self.warmed_connections} connections "
+                f"in {1000 * (time.perf_counter() - started):.0f} ms."
+            )
+        except Exception as e:
+            logger.warning(f"DB pool warm-up failed: {e}")
+
+    async def dispose(self):
+        if self.engine:
+            await self.engine.dispose()
+            self.engine = None
+            logger.info("Database engine disposed.")
+
+    def stats(self) -> dict:
+        stats = {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_recycle": self.pool_recycle,
+            "pre_ping": self.pre_ping,
+            "statement_cache_size": self.statement_cache_size,
+            "warmed_connections": self.warmed_connections,
+            "checkouts": self.metrics.checkouts,
+            "waiting": self.metrics.waiting,
+            "max_waiting": self.metrics.max_waiting,
+            "timeouts": self.metrics.timeouts,
+            "avg_wait_ms": round(1000 * self.metrics.wait_seconds_total / self.metrics.checkouts, 2)
+            if self.metrics.checkouts else 0.0,
+            "max_wait_ms": round(1000 * self.metrics.wait_seconds_max, 2),
+        }
+        if self.engine:
+            pool = self.engine.sync_engine.pool
+            stats.update({
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+            })
+        return stats
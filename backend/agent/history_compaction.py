@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import logging
+from typing import List, Optional
+
+from google.genai.types import Content, FunctionResponse, Part
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# TOOL OUTPUT COMPACTION FOR THE AGENT'S LLM REQUESTS
+# ==============================================================================
+# Every GDA tool response (all rows, SQL, explanation) stays in the session, and
+# ADK resends the whole history to the model on every turn. Before each model
+# call, tool responses older than the most recent turns are replaced by a short
+# summary (row count, columns, listing ids, key filters, explanation). Only the
+# request is rewritten; the session keeps the full responses. Recent turns and
+# the latest query result (whatever turn it came from) are sent in full, so the
+# model can still answer follow-ups about the results the user is looking at.
+
+AGENT_COMPACTION_ENABLED = os.getenv("AGENT_COMPACTION_ENABLED", "true").lower() == "true"
+# Tool responses from the last N user turns are sent unchanged
+AGENT_COMPACTION_KEEP_TURNS = int(os.getenv("AGENT_COMPACTION_KEEP_TURNS", "1"))
+# Responses smaller than this are not worth summarizing
+AGENT_COMPACTION_MIN_CHARS = int(os.getenv("AGENT_COMPACTION_MIN_CHARS", "1000"))
+COMPACT_MAX_IDS = 50
+COMPACT_MAX_TEXT = 300
+
+_WHERE_RE = re.compile(r"\bWHERE\b(.*?)(?:\bORDER\s+BY\b|\bGROUP\s+BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+
+
+def estimate_tokens(value) -> int:
+    """
+    Rough token count (about 4 characters per token) of a JSON-serializable value.
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, default=str)
+    return len(value) // 4
+
+
+def _truncate(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return value
+    value = " ".join(value.split())
+    return value if len(value) <= COMPACT_MAX_TEXT else value[:COMPACT_MAX_TEXT] + "..."
+
+
+def _decode(response):
+    payload = response.get("result", response) if isinstance(response, dict) else response
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _is_query_result(function_response) -> bool:
+    payload = _decode(function_response.response) if function_response.response is not None else None
+    return payload is not None and "queryResult" in payload
+
+
+def summarize_tool_response(response) -> Optional[dict]:
+    """
+    Compact stand-in for a GDA queryData tool response, or None if the
+    response is not one (other tools are left alone).
+    """
+    payload = _decode(response)
+    if payload is None or "queryResult" not in payload:
+        return None
+
+    query_result = payload.get("queryResult") or {}
+    col_names = [c.get("name") for c in query_result.get("columns") or []]
+    rows = query_result.get("rows") or []
+    ids = []
+    if "id" in col_names:
+        position = col_names.index("id")
+        for row in rows[:COMPACT_MAX_IDS]:
+            values = row.get("values", [])
+            if position < len(values):
+                value = values[position]
+                ids.append(value.get("value") if isinstance(value, dict) else value)
+
+    generated_query = payload.get("generatedQuery") or query_result.get("query") or ""
+    where = _WHERE_RE.search(generated_query)
+    return {
+        "compacted": True,
+        "note": "Earlier result, summarized. Listing details were shown to the user at the time.",
+        "row_count": query_result.get("totalRowCount", len(rows)),
+        "columns": col_names,
+        "listing_ids": ids,
+        "filters": _truncate(where.group(1)) if where else None,
+        "explanation": _truncate(payload.get("intentExplanation")),
+    }
+
+
+class ToolHistoryCompactor:
+    """
+    ADK `before_model_callback` that compacts old tool responses in the LLM
+    request. Keeps counters for /sessions/stats and reports estimated tokens
+    saved per model call to the service metrics.
+    """
+
+    def __init__(self, metrics=None, enabled: bool = AGENT_COMPACTION_ENABLED,
+                 keep_turns: int = AGENT_COMPACTION_KEEP_TURNS,
+                 min_chars: int = AGENT_COMPACTION_MIN_CHARS):
+        self.metrics = metrics
+        self.enabled = enabled
+        # The current turn's tool responses are always needed for its answer
+        self.keep_turns = max(1, keep_turns)
+        self.min_chars = min_chars
+        self.requests = 0
+        self.compacted_responses = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def _is_user_turn(content: Content) -> bool:
+        return content.role == "user" and any(part.text for part in content.parts or [])
+
+    @staticmethod
+    def _latest_query_result(contents: List[Content]) -> Optional[int]:
+        for index in range(len(contents) - 1, -1, -1):
+            for part in contents[index].parts or []:
+                if part.function_response and _is_query_result(part.function_response):
+                    return index
+        return None
+
+    def compact(self, contents: List[Content]) -> tuple:
+        """
+        Returns (contents, tokens_saved). Contents with compacted parts are new
+        objects; the session's events are never modified.
+        """
+        user_turns = [i for i, content in enumerate(contents) if self._is_user_turn(content)]
+        if len(user_turns) <= self.keep_turns:
+            return contents, 0
+        # Everything before the first kept user turn is eligible
+        boundary = user_turns[-self.keep_turns]
+        # ...except the latest query result, which the user is still looking at
+        latest = self._latest_query_result(contents)
+
+        saved = 0
+        compacted = []
+        for index, content in enumerate(contents):
+            if (index >= boundary or index == latest
+                    or not any(part.function_response for part in content.parts or [])):
+                compacted.append(content)
+                continue
+
+            parts = []
+            for part in content.parts:
+                function_response = part.function_response
+                summary = None
+                if function_response and function_response.response is not None:
+                    serialized = json.dumps(function_response.response, default=str)
+                    if len(serialized) >= self.min_chars:
+                        summary = summarize_tool_response(function_response.response)
+                if summary is None:
+                    parts.append(part)
+                    continue
+                parts.append(Part(function_response=FunctionResponse(
+                    id=function_response.id,
+                    name=function_response.name,
+                    response=summary,
+                )))
+                saved += estimate_tokens(serialized) - estimate_tokens(summary)
+                self.compacted_responses += 1
+            compacted.append(Content(role=content.role, parts=parts))
+        return compacted, saved
+
+    def __call__(self, callback_context, llm_request):
+        if not self.enabled or not llm_request.contents:
+            return None
+        self.requests += 1
+        try:
+            llm_request.contents, saved = self.compact(llm_request.contents)
+        except Exception as e:
+            # Never fail a model call because of compaction
+            logger.warning(f"Tool history compaction failed: {e}")
+            if self.metrics:
+                self.metrics.error("history_compaction", e)
+            return None
+
+        self.tokens_saved += saved
+        if self.metrics:
+            self.metrics.observe_tokens("saved_by_compaction", saved)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "keep_turns": self.keep_turns,
+            "requests": self.requests,
+            "compacted_responses": self.compacted_responses,
+            "estimated_tokens_saved": self.tokens_saved,
+        }
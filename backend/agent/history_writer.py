@@ -0,0 +1,212 @@
+import os
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# WRITE-BEHIND PERSISTENCE FOR user_prompt_history
+# ==============================================================================
+# Inserting into user_prompt_history can be slow because the trigger that fills
+# `prompt_embedded` calls the embedding model inside AlloyDB for prompts that
+# are not in the embedding cache yet. Requests therefore
+# only enqueue a record; a background task flushes records in multi-row
+# INSERTs. The queue is bounded: when it is full, new records are dropped and
+# counted rather than growing memory or blocking requests.
+#
+# This module is shared by the search backend and the agent service.
+
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_SHUTDOWN_TIMEOUT = float(os.getenv("HISTORY_SHUTDOWN_TIMEOUT", "20"))
+
+# Queue sentinel that tells the writer task to exit after flushing
+_STOP = object()
+
+HISTORY_COLUMNS = (
+    "user_prompt",
+    "query_template_used",
+    "query_template_id",
+    "query_explanation",
+    "search_response",
+    "listings_version",
+)
+
+
+def build_insert(batch: List[dict]) -> tuple:
+    """
+    Builds one multi-row INSERT statement and its parameters for a batch of records.
+    """
+    values = []
+    params = {}
+    for i, record in enumerate(batch):
+        placeholders = []
+        for column in HISTORY_COLUMNS:
+            name = f"{column}_{i}"
+            params[name] = record.get(column)
+            if column == "search_response":
+                placeholders.append(f"CAST(:{name} AS jsonb)")
+            else:
+                placeholders.append(f":{name}")
+        values.append(f"({', '.join(placeholders)})")
+
+    sql = (
+        f"INSERT INTO user_prompt_history ({', '.join(HISTORY_COLUMNS)}) "
+        f"VALUES {', '.join(values)}"
+    )
+    return sql, params
+
+
+class HistoryWriter:
+    """
+    Bounded write-behind queue for user_prompt_history records.
+
+    `submit` never blocks; `start` must be called from a running event loop
+    (startup hook) and `stop` flushes everything still queued (shutdown hook).
+    """
+
+    def __init__(self, get_engine: Callable[[], Awaitable[AsyncEngine]],
+                 max_queue: int = HISTORY_QUEUE_MAX,
+                 batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL,
+                 after_flush: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+                 metrics=None, metrics_stage: str = "history_insert"):
+        self._get_engine = get_engine
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._after_flush = after_flush
+        # Optional ServiceMetrics (metrics.py); each flush is timed as one stage
+        self._metrics = metrics
+        self._metrics_stage = metrics_stage
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.max_queue = max_queue
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped_overflow = 0
+        self.dropped_failed = 0
+        self.failed_batches = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="history-writer")
+
+    def submit(self, record: dict) -> bool:
+        """
+        Queues a record for insertion. Returns False if it was dropped.
+        """
+        if self._stopping:
+            self.dropped_overflow += 1
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped_overflow += 1
+            if self._metrics:
+                self._metrics.error(self._metrics_stage, "QueueFull")
+            if self.dropped_overflow == 1 or self.dropped_overflow % 1000 == 0:
+                logger.warning(f"History queue full; {self.dropped_overflow} records dropped so far.")
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _next_batch(self) -> tuple:
+        """
+        Waits for the first record, then collects more until the batch is full
+        or the flush interval has passed. Returns (batch, stop_requested).
+        """
+        first = await self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if record is _STOP:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    async def _flush(self, batch: List[dict]):
+        sql, params = build_insert(batch)
+        stage = self._metrics.stage(self._metrics_stage) if self._metrics else nullcontext()
+        try:
+            with stage:
+                db_engine = await self._get_engine()
+                async with db_engine.begin() as conn:
+                    await conn.execute(text(sql), params)
+        except Exception as e:
+            self.failed_batches += 1
+            self.dropped_failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} user prompt history records: {e}")
+            return
+
+        self.batches += 1
+        self.written += len(batch)
+        if self._after_flush:
+            try:
+                await self._after_flush(batch)
+            except Exception as e:
+                logger.warning(f"History after-flush hook failed: {e}")
+
+    async def _run(self):
+        while True:
+            batch, stop_requested = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if stop_requested or (self._stopping and self._queue.empty()):
+                return
+
+    async def stop(self, timeout: float = HISTORY_SHUTDOWN_TIMEOUT):
+        """
+        Stops accepting records and flushes whatever is still queued.
+        """
+        self._stopping = True
+        if self._task is None or self._task.done():
+            if self._queue.empty():
+                return
+            self._task = asyncio.create_task(self._run(), name="history-writer")
+
+        try:
+            self._queue.put_nowait(_STOP)
+        except asyncio.QueueFull:
+            # The writer exits by itself once the full queue has been drained
+            pass
+
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            lost = self._queue.qsize()
+            self.dropped_failed += lost
+            logger.error(f"History flush on shutdown timed out; {lost} records lost.")
+        self._task = None
+        logger.info(f"History writer stopped ({self.written} records written).")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dropped_overflow": self.dropped_overflow,
+            "dropped_failed": self.dropped_failed,
+        }
@@ -1,15 +1,28 @@
 import os
+import re
+import json
+import time
+import logging
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from agent import root_agent as agent
+from agent import root_agent as agent, gda_query_tool, result_store
 
 from google.adk import Runner
-from google.adk.sessions import InMemorySessionService
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.genai.types import Content, Part
 
 from fastapi.middleware.cors import CORSMiddleware
 import asyncpg
-from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import text
+from history_writer import HistoryWriter
+from db_pool import DatabasePool
+from history_compaction import ToolHistoryCompactor
+from session_store import AGENT_SESSION_STORE, BoundedSessionService, create_snapshot_store
+from metrics import ServiceMetrics
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
 app = FastAPI()
 
@@ -21,195 +34,378 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics on /metrics: per-stage latency, in-flight requests, errors
+metrics = ServiceMetrics("agent")
+metrics.install(app)
+
 # AlloyDB Configuration
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_USER = os.environ.get("DB_USER", "postgres")
 DB_PASSWORD = os.environ.get("DB_PASSWORD", "Welcome01")
 DB_NAME = os.environ.get("DB_NAME", "search")
 
-# Global DB Engine
-engine = None
-
-async def get_engine():
-    global engine
-    if engine:
-        return engine
+# Shared, tuned connection pool (engine creation is lock-protected)
+db_pool = DatabasePool(DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
+get_engine = db_pool.get_engine
+metrics.track_db_pool(db_pool)
 
-    if not DB_HOST:
-        raise ValueError("DB_HOST environment variable is not set.")
+# Write-behind queue that keeps history inserts (and their embedding calls) off the request path
+history_writer = HistoryWriter(get_engine, metrics=metrics, metrics_stage="db_write")
 
-    print(f"Connecting to AlloyDB via Auth Proxy at {DB_HOST}...")
-    db_url = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
-    engine = create_async_engine(db_url)
-    return engine
+@app.on_event("startup")
+async def startup_event():
+    history_writer.start()
+    session_service.start()
+    # Tools load in the background (with retries) so startup does not wait on the toolbox
+    gda_query_tool.start()
+    # Open pooled connections now rather than on the first requests after a cold start
+    await db_pool.warm_up()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global engine
-    if engine:
-        await engine.dispose()
-        print("Database engine disposed.")
+    # Flush queued history records before the engine goes away
+    await history_writer.stop()
+    # Write outstanding session snapshots before the engine goes away
+    await session_service.stop()
+    await gda_query_tool.close()
+    await db_pool.dispose()
+
+# LLM turn and toolbox tool call latency, measured with ADK callbacks.
+# Start times are keyed by invocation (model) and function call id (tools).
+_stage_started = {}
+# Entries of runs that failed before their "after" callback are discarded
+_STAGE_STARTED_MAX = 10000
+
+def _before_model(callback_context, llm_request):
+    if len(_stage_started) > _STAGE_STARTED_MAX:
+        _stage_started.clear()
+    _stage_started[("llm_turn", callback_context.invocation_id)] = time.perf_counter()
+    return None
+
+def _after_model(callback_context, llm_response):
+    started = _stage_started.pop(("llm_turn", callback_context.invocation_id), None)
+    if started is not None:
+        metrics.observe("llm_turn", time.perf_counter() - started)
+    if getattr(llm_response, "error_code", None):
+        metrics.error("llm_turn", str(llm_response.error_code))
+    usage = getattr(llm_response, "usage_metadata", None)
+    # Streaming partials carry no usage; the final response of a call does
+    if usage and not getattr(llm_response, "partial", False):
+        metrics.observe_tokens("prompt", usage.prompt_token_count or 0)
+        metrics.observe_tokens("output", usage.candidates_token_count or 0)
+    return None
+
+def _before_tool(tool, args, tool_context):
+    if len(_stage_started) > _STAGE_STARTED_MAX:
+        _stage_started.clear()
+    _stage_started[("tool_call", tool_context.function_call_id)] = time.perf_counter()
+    return None
+
+# Local refinements are timed separately from toolbox (GDA) calls
+TOOL_STAGES = {"refine_previous_results": "refine_tool"}
+
+def _after_tool(tool, args, tool_context, tool_response):
+    started = _stage_started.pop(("tool_call", tool_context.function_call_id), None)
+    if started is not None:
+        metrics.observe(TOOL_STAGES.get(tool.name, "tool_call"), time.perf_counter() - started)
+    return None
+
+# Old tool responses are summarized before each model call (history_compaction.py)
+compactor = ToolHistoryCompactor(metrics=metrics)
+
+# Compaction runs first, so llm_turn only measures the model call
+agent.before_model_callback = [compactor, _before_model]
+agent.after_model_callback = _after_model
+agent.before_tool_callback = _before_tool
+agent.after_tool_callback = _after_tool
+
+APP_NAME = "property_agent"
+USER_ID = "default_user"
 
 # Initialize Runner
-# We need a session service. InMemory is fine for this demo/stateless usage.
-session_service = InMemorySessionService()
-runner = Runner(agent=agent, app_name="property_agent", session_service=session_service)
+# Bounded in-memory sessions (TTL/LRU, event cap), optionally snapshotted to
+# AlloyDB or SQLite in the background (AGENT_SESSION_STORE)
+session_service = BoundedSessionService(snapshot_store=create_snapshot_store(AGENT_SESSION_STORE, get_engine))
+runner = Runner(agent=agent, app_name=APP_NAME, session_service=session_service)
 
 class ChatRequest(BaseModel):
     message: str
     session_id: str = "default_session"
 
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 class ChatResponse(BaseModel):
     response: str
+    # Listings built server-side from the tool's query result rows
+    listings: List[dict] = []
     tool_details: Optional[Any] = None
     used_prompt: Optional[str] = None
+    # Token usage of all model calls of this turn
+    usage: Optional[dict] = None
+
+# Large vector columns are never sent to the UI
+EXCLUDED_LISTING_COLUMNS = ("description_embedding", "image_embedding")
+# Listing blocks the model was formerly instructed to write; the UI renders `listings` instead
+_LISTING_BLOCK_RE = re.compile(r"```json_properties.*?```", re.DOTALL)
+# The UI only shows the first rows of the raw result next to the listings
+TOOL_DETAILS_PREVIEW_ROWS = 3
+
+def function_calls(event) -> list:
+    if hasattr(event, "get_function_calls"):
+        return event.get_function_calls() or []
+    # Older event shape
+    tool_call = getattr(event, "tool_call", None)
+    return list(getattr(tool_call, "function_calls", None) or [])
+
+def function_responses(event) -> list:
+    if hasattr(event, "get_function_responses"):
+        return event.get_function_responses() or []
+    tool_response = getattr(event, "tool_response", None)
+    return list(getattr(tool_response, "function_responses", None) or [])
+
+def parse_tool_response(response_payload):
+    """
+    Decodes a GDA tool response. The tool returns the queryData response as a
+    JSON string, which ADK wraps as {"result": ...}.
+    """
+    tool_details = response_payload
+    if isinstance(tool_details, dict) and 'result' in tool_details:
+        tool_details = tool_details['result']
+    if isinstance(tool_details, str):
+        try:
+            tool_details = json.loads(tool_details)
+        except Exception:
+            pass # Keep as string if parsing fails
+    return tool_details
+
+def build_listings(tool_details) -> List[dict]:
+    """
+    Flattens the tool's query result rows into listing dicts for the UI, so the
+    model no longer has to repeat them as output tokens.
+    GDA returns values as {"value": "actual_value"}, we extract "actual_value".
+    """
+    if not isinstance(tool_details, dict):
+        return []
+    query_result = tool_details.get("queryResult") or {}
+    col_names = [c.get("name") for c in query_result.get("columns") or []]
+    listings = []
+    for row in query_result.get("rows") or []:
+        values = row.get("values", [])
+        listings.append({
+            k: (v["value"] if isinstance(v, dict) and "value" in v else v)
+            for k, v in zip(col_names, values)
+            if k not in EXCLUDED_LISTING_COLUMNS
+        })
+    return listings
+
+def preview_tool_details(tool_details):
+    """
+    Returns the tool output with the result rows cut to a preview; the full rows
+    are already sent as `listings`.
+    """
+    if not isinstance(tool_details, dict) or not isinstance(tool_details.get("queryResult"), dict):
+        return tool_details
+    query_result = dict(tool_details["queryResult"])
+    query_result["rows"] = (query_result.get("rows") or [])[:TOOL_DETAILS_PREVIEW_ROWS]
+    return {**tool_details, "queryResult": query_result}
+
+async def ensure_session(session_id: str):
+    session = await session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    if not session:
+        await session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+
+class ChatTurn:
+    """
+    Collects one agent turn from Runner events. `handle` returns the UI events
+    for each Runner event (used as-is by /chat/stream); /chat only reads the
+    accumulated state at the end.
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        self.response_text = ""
+        self.tool_details = None
+        self.used_prompt = None
+        self.listings: List[dict] = []
+        # Text already sent as partial (streamed) chunks since the last complete event
+        self._streamed_text = ""
+        self.usage = {"model_calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+
+    def handle(self, event) -> List[dict]:
+        logger.debug(f"Received event type: {type(event)}")
+        out = []
+
+        usage = getattr(event, "usage_metadata", None)
+        if usage and not getattr(event, "partial", False):
+            self.usage["model_calls"] += 1
+            self.usage["prompt_tokens"] += usage.prompt_token_count or 0
+            self.usage["output_tokens"] += usage.candidates_token_count or 0
+
+        # Capture Tool Call (the prompt sent to the tool)
+        for fc in function_calls(event):
+            if fc.args and 'prompt' in fc.args:
+                self.used_prompt = fc.args['prompt']
+                logger.debug(f"Captured tool prompt: {self.used_prompt}")
+            out.append({"event": "tool_start", "name": fc.name, "prompt": (fc.args or {}).get("prompt")})
+
+        # Capture Tool Response (the output from the tool)
+        for fr in function_responses(event):
+            try:
+                logger.debug(f"Processing function response: {fr.name}")
+                self.tool_details = parse_tool_response(fr.response)
+                logger.debug(f"Captured tool details keys: {self.tool_details.keys() if isinstance(self.tool_details, dict) else 'Not a dict'}")
+            except Exception as e:
+                logger.warning(f"Failed to parse tool response: {e}")
+                metrics.error("tool_response_parse", e)
+            if isinstance(self.tool_details, dict) and "queryResult" not in self.tool_details:
+                # Tool errors (e.g. a refinement without a previous result) keep the shown listings
+                out.append({"event": "tool_end", "name": fr.name, "row_count": 0})
+                continue
+            with metrics.stage("listing_build"):
+                self.listings = build_listings(self.tool_details)
+            out.append({"event": "tool_end", "name": fr.name, "row_count": len(self.listings)})
+            # Listings go to the UI as soon as the tool returns, before the model's summary
+            out.append({
+                "event": "listings",
+                "listings": self.listings,
+                "tool_details": preview_tool_details(self.tool_details),
+                "used_prompt": self.used_prompt,
+            })
+
+        # Extract text response. With SSE streaming, partial events carry the
+        # text chunks and the following complete event repeats all of them.
+        text = ""
+        if getattr(event, 'content', None):
+            text = "".join(part.text for part in event.content.parts or [] if part.text)
+        elif getattr(event, 'text', None):
+            text = event.text
+        if getattr(event, 'partial', False):
+            if text:
+                self._streamed_text += text
+                out.append({"event": "text", "delta": text})
+        elif text:
+            self.response_text += text
+            if text != self._streamed_text:
+                out.append({"event": "text", "delta": text})
+            self._streamed_text = ""
+        return out
+
+    @property
+    def final_text(self) -> str:
+        return _LISTING_BLOCK_RE.sub("", self.response_text).strip()
+
+    def save_history(self):
+        # Log to Database (write-behind, off the response path)
+        # Only save if a tool was used (used_prompt is set)
+        if not self.used_prompt:
+            return
+
+        # If tool_details has explanation, use it
+        query_explanation = None
+        if self.tool_details and isinstance(self.tool_details, dict):
+            query_explanation = self.tool_details.get('intentExplanation') or self.tool_details.get('explanation')
+
+        if history_writer.submit({
+            "user_prompt": self.message,
+            "query_template_used": False,
+            "query_template_id": None,
+            "query_explanation": query_explanation
+        }):
+            logger.debug("User prompt history queued (Agent).")
+        else:
+            logger.warning("User prompt history dropped (Agent): queue full.")
+
+async def run_turn(request: ChatRequest, turn: ChatTurn, run_config: Optional[RunConfig] = None):
+    """
+    Runs the agent for one message and yields the UI events of every Runner event.
+    """
+    await ensure_session(request.session_id)
+    message = Content(role="user", parts=[Part(text=request.message)])
+    async for event in runner.run_async(
+        user_id=USER_ID,
+        session_id=request.session_id,
+        new_message=message,
+        run_config=run_config or RunConfig(),
+    ):
+        for ui_event in turn.handle(event):
+            yield ui_event
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     try:
-        # Use Runner to execute the agent
-        user_id = "default_user"
-        session_id = request.session_id
-        app_name = "property_agent"
-        
-        # Ensure session exists
-        session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-        if not session:
-
-            await session_service.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
-        
-        response_text = ""
-        tool_details = None
-        used_prompt = None
-        
-        # Runner.run_async returns AsyncGenerator[Event, None]
-        # We need to pass new_message as google.genai.types.Content
-        
-        from google.genai.types import Content, Part
-        import json
-        
-        message = Content(role="user", parts=[Part(text=request.message)])
-        
-        async for event in runner.run_async(
-            user_id=user_id,
-            session_id=session_id,
-            new_message=message
-        ):
-            # DEBUG: Print event type and attributes
-            print(f"DEBUG: Received event type: {type(event)}")
-            # print(f"DEBUG: Event attributes: {dir(event)}")
-            
-            # Capture Tool Call (the prompt sent to the tool)
-            if hasattr(event, 'tool_call') and event.tool_call:
-                print(f"DEBUG: Found tool_call in event")
-                # Assuming single tool call for now
-                # event.tool_call might be a ToolCall object with 'function_calls'
-                if hasattr(event.tool_call, 'function_calls'):
-                    for fc in event.tool_call.function_calls:
-                        if 'prompt' in fc.args:
-                            used_prompt = fc.args['prompt']
-                            print(f"DEBUG: Captured tool prompt: {used_prompt}")
-
-            # Capture Tool Response (the output from the tool)
-            if hasattr(event, 'tool_response') and event.tool_response:
-                 print(f"DEBUG: Found tool_response in event")
-                 if hasattr(event.tool_response, 'function_responses'):
-                    for fr in event.tool_response.function_responses:
-                        # The tool returns a JSON string in 'response' field (usually)
-                        # We need to parse it.
-                        try:
-                            print(f"DEBUG: Processing function response: {fr.name}")
-                            # The response content is likely in fr.response
-                            # But structure depends on ADK/GenAI types.
-                            # Let's inspect what we can.
-                            # For GDA tool, it returns a dict which is then JSON serialized.
-                            
-                            response_payload = fr.response
-                            print(f"DEBUG: Raw response payload type: {type(response_payload)}")
-                            
-                            # If fr.response is a dict:
-                            if isinstance(response_payload, dict):
-                                if 'result' in response_payload:
-                                     tool_details = response_payload['result']
-                                else:
-                                     tool_details = response_payload
-                                
-                                # If tool_details is a string (e.g. nested JSON), try to parse it
-                                if isinstance(tool_details, str):
-                                    try:
-                                        tool_details = json.loads(tool_details)
-                                    except Exception:
-                                        pass # Keep as string if parsing fails
-
-                            # If it's a string, try to parse
-                            elif isinstance(response_payload, str):
-                                try:
-                                    tool_details = json.loads(response_payload)
-                                except Exception:
-                                    tool_details = response_payload # Keep as string
-                                
-                            print(f"DEBUG: Captured tool details keys: {tool_details.keys() if isinstance(tool_details, dict) else 'Not a dict'}")
-                        except Exception as e:
-                            print(f"DEBUG: Failed to parse tool response: {e}")
-
-            
-            # Extract text response
-            if hasattr(event, 'content') and event.content:
-                for part in event.content.parts or []:
-                    if part.text:
-                        response_text += part.text
-            elif hasattr(event, 'text') and event.text:
-                response_text += event.text
-            
-        # Log to Database
-        try:
-            db_engine = await get_engine()
-            # Only save if a tool was used (used_prompt is set)
-            if used_prompt:
-                async with db_engine.begin() as conn:
-                    # Determine template usage (basic logic for now, can be improved if tool details has it)
-                    query_template_used = False
-                    query_template_id = None
-                    query_explanation = None
-                    
-                    # If tool_details has explanation, use it
-                    if tool_details and isinstance(tool_details, dict):
-                        query_explanation = tool_details.get('intentExplanation') or tool_details.get('explanation')
-                    
-                    await conn.execute(
-                        text("""
-                        INSERT INTO user_prompt_history 
-                        (user_prompt, query_template_used, query_template_id, query_explanation)
-                        VALUES (:prompt, :used, :id, :explanation)
-                        """),
-                        {
-                            "prompt": request.message, 
-                            "used": query_template_used, 
-                            "id": query_template_id,
-                            "explanation": query_explanation
-                        }
-                    )
-            print("User prompt history saved (Agent).")
-        except Exception as db_err:
-            print(f"Failed to save user prompt history (Agent): {db_err}")
-
-        print(f"DEBUG: Final response text: {response_text}")
+        turn = ChatTurn(request.message)
+        async for _ in run_turn(request, turn):
+            pass
+        turn.save_history()
+
+        logger.debug(f"Final response text: {turn.final_text}")
         return ChatResponse(
-            response=response_text or "Agent executed (no text response)",
-            tool_details=tool_details,
-            used_prompt=used_prompt
+            response=turn.final_text or "Agent executed (no text response)",
+            listings=turn.listings,
+            tool_details=preview_tool_details(turn.tool_details),
+            used_prompt=turn.used_prompt,
+            usage=turn.usage
         )
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Chat request failed")
+        metrics.error("chat", e)
         return ChatResponse(response=f"I encountered an issue processing your request: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat as Server-Sent Events:
+
+    - `text`        partial model text ({"delta": ...}) as it is generated,
+    - `tool_start`  / `tool_end` around each tool call,
+    - `listings`    the listing payload as soon as the tool has returned,
+    - `done`        the complete response text, or `error` ({"message": ...}).
+    """
+    def sse(payload: dict) -> str:
+        name = payload.pop("event")
+        return f"event: {name}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+    async def stream():
+        turn = ChatTurn(request.message)
+        try:
+            async for ui_event in run_turn(request, turn, RunConfig(streaming_mode=StreamingMode.SSE)):
+                yield sse(ui_event)
+            turn.save_history()
+            yield sse({"event": "done", "response": turn.final_text, "used_prompt": turn.used_prompt,
+                       "usage": turn.usage})
+        except Exception as e:
+            logger.exception("Streaming chat request failed")
+            metrics.error("chat_stream", e)
+            yield sse({"event": "error", "message": f"I encountered an issue processing your request: {str(e)}"})
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    """
+    Readiness: 200 once the toolbox tool is loaded, 503 while it is still
+    loading or the toolbox is unreachable. /health stays a pure liveness check.
+    """
+    status = gda_query_tool.stats()
+    return JSONResponse(status_code=200 if status["ready"] else 503,
+                        content={"status": "ready" if status["ready"] else "loading", "tools": [status]})
+
+@app.get("/sessions/stats")
+def session_stats():
+    return {**session_service.stats(), "compaction": compactor.stats(), "result_store": result_store.stats()}
+
+@app.get("/db/stats")
+def db_stats():
+    return db_pool.stats()
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8080))
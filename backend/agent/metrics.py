@@ -0,0 +1,199 @@
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from starlette.routing import Match
+
+# ==============================================================================
+# PROMETHEUS METRICS
+# ==============================================================================
+# Per-stage latency histograms (GDA call, row flattening, LLM turn, tool call,
+# DB write, ...), in-flight request gauges, request latency per route and error
+# counters by exception type, exposed in the Prometheus text format on /metrics.
+# Every series carries a `service` label, so both services can be scraped into
+# one dashboard and compared stage by stage.
+#
+# This module is shared by the search backend and the agent service.
+
+# From a few ms (flattening, signing cache hits) up to the GDA/LLM deadlines
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0)
+
+STAGE_LATENCY = Histogram(
+    "app_stage_duration_seconds",
+    "Duration of one processing stage.",
+    ["service", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "app_stage_errors_total",
+    "Errors raised by a processing stage, by exception type.",
+    ["service", "stage", "error_type"],
+)
+REQUEST_LATENCY = Histogram(
+    "app_request_duration_seconds",
+    "HTTP request duration until the last body chunk was sent.",
+    ["service", "method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "app_requests_in_flight",
+    "HTTP requests currently being processed.",
+    ["service", "route"],
+)
+
+LLM_TOKENS = Histogram(
+    "app_llm_tokens",
+    "Tokens per model call: prompt, output, and (estimated) saved by history compaction.",
+    ["service", "kind"],
+    buckets=(0, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000),
+)
+
+# Not worth instrumenting: scrapes and health checks
+UNTRACKED_ROUTES = {"/metrics", "/health", "/ready"}
+
+
+def error_type(error) -> str:
+    return error if isinstance(error, str) else type(error).__name__
+
+
+class DatabasePoolCollector:
+    """
+    Exposes `DatabasePool.stats()` as gauges, read at scrape time.
+    """
+
+    FIELDS = ("checked_out", "idle", "overflow", "waiting", "max_waiting", "checkouts", "timeouts")
+
+    def __init__(self, service: str, db_pool):
+        self.service = service
+        self.db_pool = db_pool
+
+    def collect(self):
+        stats = self.db_pool.stats()
+        for field in self.FIELDS:
+            if field not in stats:
+                continue
+            family = GaugeMetricFamily(f"app_db_pool_{field}", f"Database pool: {field}.", labels=["service"])
+            family.add_metric([self.service], stats[field])
+            yield family
+
+
+class ServiceMetrics:
+    """
+    Metrics facade for one service: `stage()` times a block, `error()` counts a
+    handled failure and `install()` adds the request middleware and /metrics route.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the enclosed block (sync or async code) as stage `name`.
+        Exceptions are counted by type and re-raised.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(name, e)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, stage: str, seconds: float):
+        STAGE_LATENCY.labels(self.service, stage).observe(seconds)
+
+    def observe_tokens(self, kind: str, tokens: int):
+        LLM_TOKENS.labels(self.service, kind).observe(tokens)
+
+    def error(self, stage: str, error):
+        """
+        Counts an error of `stage`; `error` is an exception or a type name.
+        """
+        STAGE_ERRORS.labels(self.service, stage, error_type(error)).inc()
+
+    async def track_stream(self, stage: str, chunks: AsyncIterator, started: Optional[float] = None):
+        """
+        Wraps a response body iterator so the stage covers the whole transfer,
+        not just building the response.
+        """
+        started = time.perf_counter() if started is None else started
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            self.error(stage, e)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def track_db_pool(self, db_pool):
+        REGISTRY.register(DatabasePoolCollector(self.service, db_pool))
+
+    def install(self, app: FastAPI):
+        app.add_middleware(MetricsMiddleware, metrics=self)
+
+        @app.get("/metrics", include_in_schema=False)
+        def metrics_endpoint():
+            return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+def route_template(scope) -> str:
+    """
+    Returns the matched route path (e.g. "/api/image"), never the raw URL,
+    to keep label cardinality bounded.
+    """
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording in-flight requests and request latency. Being pure
+    ASGI, streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app, metrics: ServiceMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_template(scope)
+        if route in UNTRACKED_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        service = self.metrics.service
+        in_flight = REQUESTS_IN_FLIGHT.labels(service, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            self.metrics.error("request", e)
+            raise
+        finally:
+            in_flight.dec()
+            REQUEST_LATENCY.labels(service, scope["method"], route, str(status["code"])).observe(
+                time.perf_counter() - started
+            )
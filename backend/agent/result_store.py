@@ -0,0 +1,246 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# ==============================================================================
+# LAST RESULT SET PER SESSION, REFINED LOCALLY
+# ==============================================================================
+# Most follow-up messages only narrow or reorder the previous search ("only the
+# ones under 3000", "sort by price"). The rows of each session's last GDA result
+# are kept here column by column (numeric columns pre-parsed), so the agent's
+# refine tool can filter, sort and cut them in-process instead of sending the
+# refinement through toolbox -> GDA -> AlloyDB again.
+
+AGENT_RESULT_STORE_MAX_SESSIONS = int(os.getenv("AGENT_RESULT_STORE_MAX_SESSIONS", "1000"))
+AGENT_RESULT_STORE_TTL_SECONDS = float(os.getenv(
+    "AGENT_RESULT_STORE_TTL_SECONDS", os.getenv("AGENT_SESSION_TTL_SECONDS", "3600")))
+# Vectors are never refined on and would dominate the memory footprint
+RESULT_STORE_EXCLUDED_COLUMNS = ("description_embedding", "image_embedding")
+
+# Only ";" separates conditions; values may contain "and" ("Lake and Mountain view")
+_CONDITION_SPLIT_RE = re.compile(r"\s*;\s*")
+_CONDITION_RE = re.compile(r"^\s*([\w.]+)\s*(<=|>=|!=|=|<|>|\bcontains\b)\s*(.+?)\s*$", re.IGNORECASE)
+
+
+class RefinementError(ValueError):
+    pass
+
+
+def _unwrap(value):
+    # GDA returns values as {"value": "actual_value"}
+    return value["value"] if isinstance(value, dict) and "value" in value else value
+
+
+def _as_number(value) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace("'", "").replace(",", ""))
+    except ValueError:
+        return None
+
+
+class ResultSet:
+    """
+    One query result in columnar form. Numeric columns (every non-empty value
+    parses as a number) also keep their parsed values for comparisons and sorting.
+    """
+
+    def __init__(self, columns: Dict[str, list], row_count: int, source: dict):
+        self.columns = columns
+        self.row_count = row_count
+        self.source = source
+        self.numeric: Dict[str, List[Optional[float]]] = {}
+        for name, values in columns.items():
+            parsed = [_as_number(v) for v in values]
+            if any(p is not None for p in parsed) and all(
+                    p is not None or v in (None, "") for p, v in zip(parsed, values)):
+                self.numeric[name] = parsed
+        self.stored_at = time.monotonic()
+
+    @classmethod
+    def from_tool_response(cls, response) -> Optional["ResultSet"]:
+        """
+        Builds a result set from a GDA queryData tool response, or returns None
+        if the response has no query result.
+        """
+        payload = response.get("result", response) if isinstance(response, dict) else response
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                return None
+        if not isinstance(payload, dict) or not isinstance(payload.get("queryResult"), dict):
+            return None
+
+        query_result = payload["queryResult"]
+        names = [c.get("name") for c in query_result.get("columns") or []]
+        kept = [(i, name) for i, name in enumerate(names) if name not in RESULT_STORE_EXCLUDED_COLUMNS]
+        columns = {name: [] for _, name in kept}
+        rows = query_result.get("rows") or []
+        for row in rows:
+            values = row.get("values", [])
+            for i, name in kept:
+                columns[name].append(_unwrap(values[i]) if i < len(values) else None)
+        source = {
+            "generatedQuery": payload.get("generatedQuery") or query_result.get("query"),
+            "intentExplanation": payload.get("intentExplanation"),
+        }
+        return cls(columns, len(rows), source)
+
+    def _resolve(self, column: str) -> str:
+        if column in self.columns:
+            return column
+        for name in self.columns:
+            if name.lower() == column.lower():
+                return name
+        raise RefinementError(f"Unknown column '{column}'. Available columns: {', '.join(self.columns)}")
+
+    def _matcher(self, condition: str):
+        match = _CONDITION_RE.match(condition)
+        if not match:
+            raise RefinementError(
+                f"Cannot parse condition '{condition}'. Use '<column> <op> <value>' with op one of "
+                "=, !=, <, <=, >, >=, contains."
+            )
+        column, op, raw = self._resolve(match.group(1)), match.group(2).lower(), match.group(3).strip("'\"")
+
+        if op == "contains":
+            needle = raw.lower()
+            values = self.columns[column]
+            return lambda i: values[i] is not None and needle in str(values[i]).lower()
+
+        number = _as_number(raw)
+        if column in self.numeric and number is not None:
+            values, target = self.numeric[column], number
+        else:
+            if op not in ("=", "!="):
+                raise RefinementError(f"Column '{column}' is not numeric; use =, != or contains.")
+            values = [None if v is None else str(v).lower() for v in self.columns[column]]
+            target = raw.lower()
+
+        compare = {
+            "=": lambda a: a == target,
+            "!=": lambda a: a != target,
+            "<": lambda a: a < target,
+            "<=": lambda a: a <= target,
+            ">": lambda a: a > target,
+            ">=": lambda a: a >= target,
+        }[op]
+        return lambda i: values[i] is not None and compare(values[i])
+
+    def refine(self, filters: str = "", sort_by: str = "", descending: bool = False, limit: int = 0) -> dict:
+        """
+        Filters, sorts and cuts the rows, and returns them in the shape of a GDA
+        queryData response so they are rendered like a new search result.
+        """
+        conditions = [c for c in _CONDITION_SPLIT_RE.split(filters or "") if c.strip()]
+        matchers = [self._matcher(c) for c in conditions]
+        indices = [i for i in range(self.row_count) if all(m(i) for m in matchers)]
+
+        if sort_by:
+            column = self._resolve(sort_by)
+            values = self.numeric.get(column) or [
+                None if v is None else str(v).lower() for v in self.columns[column]]
+            present = [i for i in indices if values[i] is not None]
+            missing = [i for i in indices if values[i] is None]
+            # Rows without a value go last in either direction
+            indices = sorted(present, key=lambda i: values[i], reverse=descending) + missing
+        if limit and limit > 0:
+            indices = indices[:limit]
+
+        names = list(self.columns)
+        steps = conditions + ([f"sorted by {sort_by}{' descending' if descending else ''}"] if sort_by else [])
+        steps += [f"top {limit}"] if limit and limit > 0 else []
+        return {
+            "queryResult": {
+                "columns": [{"name": name} for name in names],
+                "rows": [{"values": [{"value": self.columns[name][i]} for name in names]} for i in indices],
+                "totalRowCount": len(indices),
+            },
+            "generatedQuery": self.source.get("generatedQuery"),
+            "intentExplanation": (
+                f"Refined the previous {self.row_count} results ({'; '.join(steps) or 'unchanged'}) "
+                f"to {len(indices)}."
+            ),
+            "refined": True,
+        }
+
+
+class SessionResultStore:
+    """
+    Last result set per session, bounded by count (LRU) and age.
+    Tools run on the event loop, but the lock keeps `stats` safe from any thread.
+    """
+
+    def __init__(self, max_sessions: int = AGENT_RESULT_STORE_MAX_SESSIONS,
+                 ttl_seconds: float = AGENT_RESULT_STORE_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._results: "OrderedDict[str, ResultSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.refinements = 0
+        self.misses = 0
+        self.refine_seconds = 0.0
+
+    def put(self, key: str, response) -> bool:
+        """
+        Stores the response as the session's last result. A response without a
+        query result (an error or a plain answer) drops the previous one, so a
+        refinement never works on an older, unrelated search.
+        """
+        result_set = ResultSet.from_tool_response(response)
+        if result_set is None:
+            self.discard(key)
+            return False
+        with self._lock:
+            self._results[key] = result_set
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_sessions:
+                self._results.popitem(last=False)
+            self.stored += 1
+        return True
+
+    def discard(self, key: str):
+        with self._lock:
+            self._results.pop(key, None)
+
+    def get(self, key: str) -> Optional[ResultSet]:
+        with self._lock:
+            result_set = self._results.get(key)
+            if result_set is not None and time.monotonic() - result_set.stored_at > self.ttl_seconds:
+                del self._results[key]
+                result_set = None
+            if result_set is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            return result_set
+
+    def refine(self, key: str, **kwargs) -> dict:
+        result_set = self.get(key)
+        if result_set is None:
+            raise RefinementError("There is no previous search result in this conversation to refine.")
+        started = time.perf_counter()
+        refined = result_set.refine(**kwargs)
+        self.refinements += 1
+        self.refine_seconds += time.perf_counter() - started
+        return refined
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._results),
+                "max_sessions": self.max_sessions,
+                "stored": self.stored,
+                "refinements": self.refinements,
+                "misses": self.misses,
+                "avg_refine_ms": round(self.refine_seconds / self.refinements * 1000, 3) if self.refinements else None,
+            }
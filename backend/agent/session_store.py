@@ -0,0 +1,447 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# BOUNDED AGENT SESSION STORE
+# ==============================================================================
+# The ADK InMemorySessionService keeps every session forever. This subclass
+# bounds it: idle sessions expire after a TTL, the least recently used ones are
+# evicted beyond a session count or an (estimated) memory budget, and each
+# session keeps only its most recent events.
+#
+# Optionally, sessions are snapshotted to AlloyDB (`agent_sessions` table) or a
+# local SQLite file. Snapshots are written by a background task, coalesced per
+# session, so requests never wait for them; a session that is not in memory
+# (evicted, restarted or served by another instance) is restored on access.
+
+AGENT_SESSION_TTL_SECONDS = int(os.getenv("AGENT_SESSION_TTL_SECONDS", "3600"))
+AGENT_SESSION_MAX_SESSIONS = int(os.getenv("AGENT_SESSION_MAX_SESSIONS", "1000"))
+AGENT_SESSION_MAX_EVENTS = int(os.getenv("AGENT_SESSION_MAX_EVENTS", "100"))
+AGENT_SESSION_MAX_BYTES = int(os.getenv("AGENT_SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+# "", "alloydb" or "sqlite"
+AGENT_SESSION_STORE = os.getenv("AGENT_SESSION_STORE", "").lower()
+AGENT_SESSION_SQLITE_PATH = os.getenv("AGENT_SESSION_SQLITE_PATH", "/tmp/agent_sessions.db")
+AGENT_SESSION_SNAPSHOT_INTERVAL = float(os.getenv("AGENT_SESSION_SNAPSHOT_INTERVAL", "2.0"))
+AGENT_SESSION_STORE_TTL_SECONDS = int(os.getenv("AGENT_SESSION_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+SessionKey = Tuple[str, str, str]
+
+
+def estimate_size(obj) -> int:
+    """
+    Approximate memory footprint of a session or event: its JSON size.
+    """
+    try:
+        return len(obj.model_dump_json())
+    except Exception:
+        return 0
+
+
+class AlloyDBSnapshotStore:
+    """
+    Session snapshots in the `agent_sessions` table (alloydb_setup.sql, section 3c),
+    using the service's shared engine.
+    """
+
+    def __init__(self, get_engine: Callable[[], Awaitable[AsyncEngine]]):
+        self._get_engine = get_engine
+
+    async def save_many(self, snapshots: Dict[SessionKey, str]):
+        params = [
+            {"app_name": app, "user_id": user, "session_id": sid, "snapshot": snapshot}
+            for (app, user, sid), snapshot in snapshots.items()
+        ]
+        engine = await self._get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(text("""
+                INSERT INTO agent_sessions (app_name, user_id, session_id, snapshot, updated_at)
+                VALUES (:app_name, :user_id, :session_id, CAST(:snapshot AS jsonb), CURRENT_TIMESTAMP)
+                ON CONFLICT (app_name, user_id, session_id)
+                DO UPDATE SET snapshot = EXCLUDED.snapshot, updated_at = EXCLUDED.updated_at
+            """), params)
+
+    async def load(self, key: SessionKey) -> Optional[str]:
+        engine = await self._get_engine()
+        async with engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT snapshot::text FROM agent_sessions
+                WHERE app_name = :app_name AND user_id = :user_id AND session_id = :session_id
+            """), {"app_name": key[0], "user_id": key[1], "session_id": key[2]})
+            return result.scalar()
+
+    async def delete_many(self, keys: Set[SessionKey]):
+        engine = await self._get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(text("""
+                DELETE FROM agent_sessions
+                WHERE app_name = :app_name AND user_id = :user_id AND session_id = :session_id
+            """), [{"app_name": app, "user_id": user, "session_id": sid} for app, user, sid in keys])
+
+    async def delete_older_than(self, seconds: int):
+        engine = await self._get_engine()
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "DELETE FROM agent_sessions WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => :seconds)"
+            ), {"seconds": float(seconds)})
+
+
+class SQLiteSnapshotStore:
+    """
+    Local stand-in for AlloyDB (development, single instance). sqlite3 calls run
+    in worker threads.
+    """
+
+    def __init__(self, path: str = AGENT_SESSION_SQLITE_PATH):
+        self.path = path
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS agent_sessions (
+                    app_name TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    snapshot TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (app_name, user_id, session_id)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call (sqlite3 connections are not thread-safe)
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _save_many(self, snapshots: Dict[SessionKey, str]):
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO agent_sessions VALUES (?, ?, ?, ?, ?)",
+                [(app, user, sid, snapshot, now) for (app, user, sid), snapshot in snapshots.items()],
+            )
+
+    def _load(self, key: SessionKey) -> Optional[str]:
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT snapshot FROM agent_sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def _delete_many(self, keys: Set[SessionKey]):
+        with self._connect() as db:
+            db.executemany(
+                "DELETE FROM agent_sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", list(keys)
+            )
+
+    def _delete_older_than(self, seconds: int):
+        with self._connect() as db:
+            db.execute("DELETE FROM agent_sessions WHERE updated_at < ?", (time.time() - seconds,))
+
+    async def save_many(self, snapshots: Dict[SessionKey, str]):
+        await asyncio.to_thread(self._save_many, snapshots)
+
+    async def load(self, key: SessionKey) -> Optional[str]:
+        return await asyncio.to_thread(self._load, key)
+
+    async def delete_many(self, keys: Set[SessionKey]):
+        await asyncio.to_thread(self._delete_many, keys)
+
+    async def delete_older_than(self, seconds: int):
+        await asyncio.to_thread(self._delete_older_than, seconds)
+
+
+def create_snapshot_store(kind: str, get_engine: Callable[[], Awaitable[AsyncEngine]]):
+    if not kind:
+        return None
+    if kind == "alloydb":
+        return AlloyDBSnapshotStore(get_engine)
+    if kind == "sqlite":
+        return SQLiteSnapshotStore()
+    raise ValueError(f"Unknown AGENT_SESSION_STORE '{kind}'. Use 'alloydb', 'sqlite' or leave it empty.")
+
+
+class BoundedSessionService(InMemorySessionService):
+    """
+    InMemorySessionService with TTL/LRU eviction, a per-session event cap,
+    memory accounting and optional background snapshots.
+
+    `start` must be called from a running event loop (startup hook) and `stop`
+    writes outstanding snapshots (shutdown hook).
+
+    Eviction and trimming work on InMemorySessionService's internal
+    `sessions[app_name][user_id][session_id]` dict, so google-adk is pinned in
+    requirements.txt; the layout is checked at construction time.
+    """
+
+    def __init__(self, ttl_seconds: int = AGENT_SESSION_TTL_SECONDS,
+                 max_sessions: int = AGENT_SESSION_MAX_SESSIONS,
+                 max_events: int = AGENT_SESSION_MAX_EVENTS,
+                 max_bytes: int = AGENT_SESSION_MAX_BYTES,
+                 snapshot_store=None,
+                 snapshot_interval: float = AGENT_SESSION_SNAPSHOT_INTERVAL,
+                 store_ttl_seconds: int = AGENT_SESSION_STORE_TTL_SECONDS):
+        super().__init__()
+        # Fail at startup rather than silently not evicting if a new ADK release changes the layout
+        if not isinstance(getattr(self, "sessions", None), dict):
+            raise RuntimeError("Unsupported google-adk version: InMemorySessionService.sessions is not a dict.")
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.snapshot_store = snapshot_store
+        self.snapshot_interval = snapshot_interval
+        self.store_ttl_seconds = store_ttl_seconds
+        # LRU order of sessions held in memory: key -> last access (monotonic)
+        self._last_access: "OrderedDict[SessionKey, float]" = OrderedDict()
+        self._sizes: Dict[SessionKey, int] = {}
+        self.total_bytes = 0
+        # Background snapshot work, coalesced per session
+        self._dirty: Set[SessionKey] = set()
+        self._pending: Dict[SessionKey, str] = {}
+        self._deleted: Set[SessionKey] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+        self.trimmed_events = 0
+        self.restored = 0
+        self.snapshots_written = 0
+        self.snapshot_failures = 0
+
+    # --- Bookkeeping -------------------------------------------------------
+
+    def _stored(self, key: SessionKey) -> Optional[Session]:
+        app, user, sid = key
+        return self.sessions.get(app, {}).get(user, {}).get(sid)
+
+    def _touch(self, key: SessionKey):
+        self._last_access[key] = time.monotonic()
+        self._last_access.move_to_end(key)
+
+    def _set_size(self, key: SessionKey, size: int):
+        self.total_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _forget(self, key: SessionKey):
+        self._last_access.pop(key, None)
+        self.total_bytes -= self._sizes.pop(key, 0)
+
+    def _expired(self, key: SessionKey) -> bool:
+        last = self._last_access.get(key)
+        return last is not None and time.monotonic() - last > self.ttl_seconds
+
+    def _evict(self, key: SessionKey):
+        """
+        Drops a session from memory. Unsaved changes are snapshotted first, so
+        with a persistent store the session can be restored later.
+        """
+        if self.snapshot_store and key in self._dirty:
+            session = self._stored(key)
+            if session is not None:
+                self._pending[key] = session.model_dump_json()
+            self._dirty.discard(key)
+        app, user, sid = key
+        self.sessions.get(app, {}).get(user, {}).pop(sid, None)
+        self._forget(key)
+
+    def _enforce_limits(self, keep: Optional[SessionKey] = None):
+        # Oldest first; the session being served is never evicted
+        while self._last_access:
+            key, last = next(iter(self._last_access.items()))
+            if key == keep:
+                break
+            if time.monotonic() - last > self.ttl_seconds:
+                self.evicted_ttl += 1
+            elif len(self._last_access) > self.max_sessions or self.total_bytes > self.max_bytes:
+                self.evicted_lru += 1
+            else:
+                break
+            self._evict(key)
+
+    def _trim_events(self, session: Session) -> int:
+        """
+        Keeps at most `max_events` events. The kept history never starts with a
+        function response whose call was cut off. Returns the number removed.
+        """
+        excess = len(session.events) - self.max_events
+        if excess <= 0:
+            return 0
+        start = excess
+        while start < len(session.events) and session.events[start].get_function_responses():
+            start += 1
+        del session.events[:start]
+        return start
+
+    # --- InMemorySessionService overrides ------------------------------------
+
+    async def create_session(self, *, app_name: str, user_id: str, state=None, session_id=None) -> Session:
+        session = await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+        key = (app_name, user_id, session.id)
+        self._touch(key)
+        self._set_size(key, estimate_size(session))
+        self._mark_dirty(key)
+        self._enforce_limits(keep=key)
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config=None) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        if self._expired(key):
+            self.evicted_ttl += 1
+            self._evict(key)
+        if self._stored(key) is None and not await self._restore(key):
+            return None
+        self._touch(key)
+        return await super().get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        self._forget(key)
+        self._dirty.discard(key)
+        self._pending.pop(key, None)
+        if self.snapshot_store:
+            self._deleted.add(key)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session=session, event=event)
+        key = (session.app_name, session.user_id, session.id)
+        stored = self._stored(key)
+        if stored is None:
+            return event
+
+        # The Runner keeps using its own copy of the session within this turn
+        removed = self._trim_events(stored)
+        if removed:
+            self.trimmed_events += removed
+            self._set_size(key, estimate_size(stored))
+        else:
+            self._set_size(key, self._sizes.get(key, 0) + estimate_size(event))
+        self._touch(key)
+        self._mark_dirty(key)
+        self._enforce_limits(keep=key)
+        return event
+
+    # --- Persistence -------------------------------------------------------
+
+    def _mark_dirty(self, key: SessionKey):
+        if self.snapshot_store:
+            self._dirty.add(key)
+            self._deleted.discard(key)
+
+    async def _restore(self, key: SessionKey) -> bool:
+        if not self.snapshot_store:
+            return False
+        snapshot = self._pending.get(key)
+        if snapshot is None:
+            try:
+                snapshot = await self.snapshot_store.load(key)
+            except Exception as e:
+                logger.warning(f"Could not load session snapshot {key[2]}: {e}")
+                return False
+        if snapshot is None:
+            return False
+
+        session = Session.model_validate_json(snapshot)
+        app, user, sid = key
+        self.sessions.setdefault(app, {}).setdefault(user, {})[sid] = session
+        self.restored += 1
+        self._touch(key)
+        self._set_size(key, len(snapshot))
+        self._enforce_limits(keep=key)
+        return True
+
+    async def flush(self):
+        """
+        Writes snapshots of all changed sessions and applies pending deletions.
+        """
+        snapshots, self._pending = self._pending, {}
+        for key in list(self._dirty):
+            session = self._stored(key)
+            if session is not None:
+                snapshots[key] = session.model_dump_json()
+        self._dirty.clear()
+        deleted, self._deleted = self._deleted, set()
+
+        try:
+            if snapshots:
+                await self.snapshot_store.save_many(snapshots)
+                self.snapshots_written += len(snapshots)
+            if deleted:
+                await self.snapshot_store.delete_many(deleted)
+        except asyncio.CancelledError:
+            self._requeue(snapshots, deleted)
+            raise
+        except Exception as e:
+            self.snapshot_failures += 1
+            logger.error(f"Failed to write {len(snapshots)} session snapshots: {e}")
+            self._requeue(snapshots, deleted)
+
+    def _requeue(self, snapshots: Dict[SessionKey, str], deleted: Set[SessionKey]):
+        # Retried with the next flush unless newer changes superseded them
+        for key, snapshot in snapshots.items():
+            if key not in self._dirty:
+                self._pending.setdefault(key, snapshot)
+        self._deleted |= deleted
+
+    async def _run(self):
+        last_retention_sweep = 0.0
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            self._enforce_limits()
+            if not self.snapshot_store:
+                continue
+            await self.flush()
+            if time.monotonic() - last_retention_sweep > 3600:
+                last_retention_sweep = time.monotonic()
+                try:
+                    await self.snapshot_store.delete_older_than(self.store_ttl_seconds)
+                except Exception as e:
+                    logger.warning(f"Session snapshot retention sweep failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="session-store")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.snapshot_store:
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._last_access),
+            "max_sessions": self.max_sessions,
+            "estimated_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "max_events": self.max_events,
+            "ttl_seconds": self.ttl_seconds,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_lru": self.evicted_lru,
+            "trimmed_events": self.trimmed_events,
+            "store": type(self.snapshot_store).__name__ if self.snapshot_store else None,
+            "restored": self.restored,
+            "dirty": len(self._dirty) + len(self._pending),
+            "snapshots_written": self.snapshots_written,
+            "snapshot_failures": self.snapshot_failures,
+        }
@@ -0,0 +1,153 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Optional
+
+import aiohttp
+from toolbox_core import ToolboxClient
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# LAZY, ASYNC TOOLBOX TOOLS
+# ==============================================================================
+# Tools are loaded from the MCP Toolbox in a background task with retry and
+# exponential backoff instead of over the network at import time, so the
+# container starts immediately and a briefly unreachable toolbox no longer
+# leaves the agent without tools until the next deploy. Invocations use the
+# async client on the service's event loop and one pooled aiohttp session
+# (keep-alive connections) instead of a sync client running its own loop.
+
+TOOLBOX_URL = os.getenv("TOOLBOX_URL", "http://127.0.0.1:5000")
+TOOLBOX_MAX_CONNECTIONS = int(os.getenv("TOOLBOX_MAX_CONNECTIONS", "20"))
+TOOLBOX_KEEPALIVE_SECONDS = float(os.getenv("TOOLBOX_KEEPALIVE_SECONDS", "60"))
+TOOLBOX_LOAD_BACKOFF_MAX = float(os.getenv("TOOLBOX_LOAD_BACKOFF_MAX", "60"))
+# How long a tool call waits for a load that is still in progress
+TOOLBOX_LOAD_WAIT_SECONDS = float(os.getenv("TOOLBOX_LOAD_WAIT_SECONDS", "10"))
+# Retries of a tool call that could not reach the toolbox at all
+TOOLBOX_CALL_RETRIES = int(os.getenv("TOOLBOX_CALL_RETRIES", "2"))
+
+
+class ToolUnavailableError(Exception):
+    pass
+
+
+class LazyToolboxTool:
+    """
+    One toolbox tool, loaded in the background and invoked asynchronously.
+
+    `start` (startup hook) begins loading; calls made before the tool is
+    loaded wait up to TOOLBOX_LOAD_WAIT_SECONDS and then fail with
+    ToolUnavailableError. `close` (shutdown hook) releases the connections.
+    """
+
+    def __init__(self, tool_name: str, url: str = TOOLBOX_URL):
+        self.tool_name = tool_name
+        self.url = url
+        self._client: Optional[ToolboxClient] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tool = None
+        self._loaded: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.load_attempts = 0
+        self.load_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.calls = 0
+        self.call_retries = 0
+        self.call_failures = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._tool is not None
+
+    def start(self):
+        if self.ready:
+            return
+        if self._task is None or self._task.done():
+            self._loaded = self._loaded or asyncio.Event()
+            self._task = asyncio.create_task(self._load(), name=f"toolbox-load-{self.tool_name}")
+
+    def _get_client(self) -> ToolboxClient:
+        if self._client is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=TOOLBOX_MAX_CONNECTIONS,
+                keepalive_timeout=TOOLBOX_KEEPALIVE_SECONDS,
+            ))
+            self._client = ToolboxClient(self.url, session=self._session)
+        return self._client
+
+    async def _load(self):
+        started = time.perf_counter()
+        while True:
+            self.load_attempts += 1
+            try:
+                self._tool = await self._get_client().load_tool(self.tool_name)
+            except Exception as e:
+                self.last_error = str(e)
+                # Exponential backoff with jitter, capped
+                delay = min(TOOLBOX_LOAD_BACKOFF_MAX, 2 ** min(self.load_attempts, 6)) * (0.5 + random.random() / 2)
+                logger.warning(
+                    f"Could not load tool '{self.tool_name}' from {self.url} "
+                    f"(attempt {self.load_attempts}): {e}; retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.load_seconds = time.perf_counter() - started
+            self.last_error = None
+            self._loaded.set()
+            logger.info(f"Loaded tool '{self.tool_name}' in {self.load_seconds:.2f}s ({self.load_attempts} attempts).")
+            return
+
+    async def get(self):
+        if self.ready:
+            return self._tool
+        self.start()
+        try:
+            await asyncio.wait_for(self._loaded.wait(), timeout=TOOLBOX_LOAD_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise ToolUnavailableError(f"Tool '{self.tool_name}' is not available yet: {self.last_error or 'loading'}")
+        return self._tool
+
+    async def __call__(self, **kwargs):
+        tool = await self.get()
+        self.calls += 1
+        for attempt in range(TOOLBOX_CALL_RETRIES + 1):
+            try:
+                return await tool(**kwargs)
+            except aiohttp.ClientConnectionError as e:
+                # The request never reached the toolbox, so it is safe to repeat
+                if attempt == TOOLBOX_CALL_RETRIES:
+                    self.call_failures += 1
+                    raise
+                self.call_retries += 1
+                logger.warning(f"Tool '{self.tool_name}' connection failed ({e}); retrying.")
+                await asyncio.sleep(0.2 * 2 ** attempt)
+            except Exception:
+                self.call_failures += 1
+                raise
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if self._client is not None:
+            await self._client.close()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._client = None
+        self._session = None
+
+    def stats(self) -> dict:
+        return {
+            "tool": self.tool_name,
+            "url": self.url,
+            "ready": self.ready,
+            "load_attempts": self.load_attempts,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "last_error": self.last_error,
+            "calls": self.calls,
+            "call_retries": self.call_retries,
+            "call_failures": self.call_failures,
+        }
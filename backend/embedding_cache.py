@@ -0,0 +1,85 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# PERIODIC PRUNING OF THE IN-DATABASE QUERY EMBEDDING CACHE
+# ==============================================================================
+# `embedding_cache` (see alloydb_setup.sql) gains a row per distinct prompt and
+# model. A background task calls prune_embedding_cache() on an interval so only
+# the most recently used entries are kept. Pruning is idempotent, so several
+# backend instances running it at the same time is harmless.
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# Seconds between prunes; 0 disables pruning (e.g. when a pg_cron job does it)
+EMBEDDING_CACHE_PRUNE_INTERVAL = float(os.getenv("EMBEDDING_CACHE_PRUNE_INTERVAL", "3600"))
+
+
+class EmbeddingCachePruner:
+    """
+    Calls prune_embedding_cache(max_entries) every `interval` seconds.
+    `start` must be called from a running event loop (startup hook).
+    """
+
+    def __init__(self, get_engine: Callable[[], Awaitable[AsyncEngine]],
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 interval: float = EMBEDDING_CACHE_PRUNE_INTERVAL):
+        self._get_engine = get_engine
+        self.max_entries = max_entries
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.pruned = 0
+        self.failures = 0
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="embedding-cache-pruner")
+
+    async def prune(self) -> int:
+        db_engine = await self._get_engine()
+        async with db_engine.begin() as conn:
+            result = await conn.execute(text("SELECT prune_embedding_cache(:max_entries)"),
+                                        {"max_entries": self.max_entries})
+            removed = result.scalar() or 0
+        self.runs += 1
+        self.pruned += removed
+        if removed:
+            logger.info(f"Pruned {removed} embedding cache entries (keeping {self.max_entries}).")
+        return removed
+
+    async def _run(self):
+        while True:
+            # The first prune waits one interval, so it never competes with a cold start
+            await asyncio.sleep(self.interval)
+            try:
+                await self.prune()
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Embedding cache pruning failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "max_entries": self.max_entries,
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "pruned": self.pruned,
+            "failures": self.failures,
+        }
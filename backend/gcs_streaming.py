@@ -0,0 +1,145 @@
+import os
+import re
+import asyncio
+import logging
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Mapping, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# GCS STREAMING FALLBACK
+# ==============================================================================
+# Used by /api/image when URL signing is unavailable. Object bytes are read in
+# ranged chunks in worker threads, so the event loop never blocks on GCS.
+# Responses carry ETag/Last-Modified validators, conditional requests are
+# answered with 304 and single byte ranges with 206.
+
+GCS_STREAM_CHUNK_BYTES = int(os.getenv("GCS_STREAM_CHUNK_BYTES", str(1024 * 1024)))
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag_matches(header_value: str, etag: str) -> bool:
+    if header_value.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in header_value.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def _not_modified_since(header_value: str, last_modified) -> bool:
+    try:
+        since = parsedate_to_datetime(header_value)
+    except (TypeError, ValueError):
+        return False
+    if since is None or last_modified is None:
+        return False
+    # HTTP dates have second precision
+    return last_modified.replace(microsecond=0) <= since
+
+
+def parse_range(header_value: Optional[str], size: int) -> Optional[tuple]:
+    """
+    Parses a single-range `Range` header into inclusive (start, end).
+    Returns None to serve the full object (no/unsupported header) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header_value:
+        return None
+    match = _RANGE_RE.match(header_value.strip())
+    if not match:
+        # Multiple ranges or other units: serving the full body is allowed
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range.")
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable.")
+    return start, min(end, size - 1)
+
+
+async def stream_gcs_object(storage_client, bucket_name: str, blob_name: str,
+                            request_headers: Mapping[str, str],
+                            default_media_type: str = "image/jpeg") -> Response:
+    """
+    Builds a conditional, range-aware streaming response for a GCS object.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    blob = await asyncio.to_thread(bucket.get_blob, blob_name)
+    if blob is None:
+        raise HTTPException(404, "Image not found or inaccessible.")
+
+    size = blob.size or 0
+    etag = f'"{blob.etag}"' if blob.etag and not blob.etag.startswith('"') else blob.etag
+    last_modified = blob.updated
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+    }
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    # Conditional GET: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif request_headers.get("if-modified-since"):
+        if _not_modified_since(request_headers["if-modified-since"], last_modified):
+            return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    # A stale If-Range validator means "send the whole (new) object"
+    if range_header and (not if_range or if_range.strip() in (etag, headers.get("Last-Modified"))):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", **headers})
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    status_code = 206 if byte_range else 200
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(0, end - start + 1))
+
+    async def body():
+        offset = start
+        while offset <= end:
+            chunk_end = min(offset + GCS_STREAM_CHUNK_BYTES, end + 1) - 1
+            # Pin the generation so a concurrent overwrite cannot mix two versions
+            chunk = await asyncio.to_thread(
+                blob.download_as_bytes,
+                start=offset,
+                end=chunk_end,
+                if_generation_match=blob.generation,
+            )
+            if not chunk:
+                break
+            yield chunk
+            offset += len(chunk)
+
+    return StreamingResponse(
+        body(),
+        status_code=status_code,
+        media_type=blob.content_type or default_media_type,
+        headers=headers,
+    )
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# GEMINI DATA AGENT (GDA) HTTP CLIENT
+# ==============================================================================
+# A single pooled async client is shared by all requests so that:
+#   - GDA round trips never block the event loop,
+#   - TLS handshakes are paid once per connection instead of once per search,
+#   - HTTP/2 multiplexes many concurrent searches over few connections.
+
+GDA_BASE_URL = "https://geminidataanalytics.googleapis.com/v1beta"
+
+GDA_CONNECT_TIMEOUT = float(os.getenv("GDA_CONNECT_TIMEOUT", "5"))
+GDA_READ_TIMEOUT = float(os.getenv("GDA_READ_TIMEOUT", "60"))
+GDA_TOTAL_TIMEOUT = float(os.getenv("GDA_TOTAL_TIMEOUT", "90"))
+GDA_MAX_CONNECTIONS = int(os.getenv("GDA_MAX_CONNECTIONS", "100"))
+GDA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GDA_MAX_KEEPALIVE_CONNECTIONS", "20"))
+GDA_KEEPALIVE_EXPIRY = float(os.getenv("GDA_KEEPALIVE_EXPIRY", "120"))
+
+
+class GDAClient:
+    """
+    Lazily created, process-wide async HTTP client for the GDA API.
+
+    Each call gets its own connect/read deadlines plus an overall deadline,
+    and is cancelled cleanly if the awaiting task is cancelled.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=GDA_BASE_URL,
+                http2=True,
+                timeout=httpx.Timeout(
+                    connect=GDA_CONNECT_TIMEOUT,
+                    read=GDA_READ_TIMEOUT,
+                    write=GDA_CONNECT_TIMEOUT,
+                    pool=GDA_CONNECT_TIMEOUT,
+                ),
+                limits=httpx.Limits(
+                    max_connections=GDA_MAX_CONNECTIONS,
+                    max_keepalive_connections=GDA_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=GDA_KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._client
+
+    async def query_data(self, path: str, token: str, payload: dict,
+                         read_timeout: Optional[float] = None,
+                         total_timeout: Optional[float] = None) -> dict:
+        """
+        POSTs a queryData payload and returns the decoded JSON response.
+
+        Raises httpx.HTTPStatusError on non-2xx responses and
+        asyncio.TimeoutError when the overall deadline or a per-phase
+        (connect, read, write, pool) timeout is exceeded.
+        """
+        client = self._get_client()
+        timeout = httpx.Timeout(
+            connect=GDA_CONNECT_TIMEOUT,
+            read=read_timeout or GDA_READ_TIMEOUT,
+            write=GDA_CONNECT_TIMEOUT,
+            pool=GDA_CONNECT_TIMEOUT,
+        )
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+
+        try:
+            resp = await asyncio.wait_for(
+                client.post(path, headers=headers, json=payload, timeout=timeout),
+                timeout=total_timeout or GDA_TOTAL_TIMEOUT,
+            )
+        except httpx.TimeoutException as e:
+            # Same outcome for callers as the overall deadline: the request timed out
+            raise asyncio.TimeoutError(f"GDA request timed out ({type(e).__name__})") from e
+        resp.raise_for_status()
+        return resp.json()
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("GDA HTTP client closed.")
+        self._client = None
+
+
+gda_client = GDAClient()
@@ -0,0 +1,87 @@
+from typing import List
+
+from sqlalchemy import text
+
+# ==============================================================================
+# PROMPT HISTORY SEARCH
+# ==============================================================================
+# Index-backed lookups over `user_prompt_history` for the history widget:
+#   - "text":      ranked full-text search on the `prompt_tsv` GIN index,
+#   - "substring": case-insensitive "contains" on the pg_trgm GIN indexes,
+#   - "semantic":  nearest past prompts by `prompt_embedded` on the ScaNN index.
+# Each mode is a bounded index scan, so its cost does not grow with the table.
+
+HISTORY_SEARCH_MODES = ("text", "substring", "semantic")
+HISTORY_SEARCH_MAX_LIMIT = 200
+# Trigram indexes cannot narrow down patterns shorter than one trigram
+MIN_SUBSTRING_LENGTH = 3
+
+_COLUMNS = 'h.id, h."timestamp", h.user_prompt, h.query_template_used, h.query_template_id, h.query_explanation'
+
+TEXT_SEARCH_SQL = f"""
+    SELECT {_COLUMNS}, ts_rank_cd(h.prompt_tsv, q) AS score
+    FROM user_prompt_history h, websearch_to_tsquery('english', :query) q
+    WHERE h.prompt_tsv @@ q
+    ORDER BY score DESC, h."timestamp" DESC, h.id DESC
+    LIMIT :limit
+"""
+
+SUBSTRING_SEARCH_SQL = f"""
+    SELECT {_COLUMNS}, NULL::real AS score
+    FROM user_prompt_history h
+    WHERE h.user_prompt ILIKE :pattern OR h.query_explanation ILIKE :pattern
+    ORDER BY h."timestamp" DESC, h.id DESC
+    LIMIT :limit
+"""
+
+# The query embedding is computed once in a scalar subquery, so the ORDER BY is
+# "column <=> constant" and can be served by the ScaNN index.
+SEMANTIC_SEARCH_SQL = f"""
+    WITH q AS (
+        SELECT cached_embedding('gemini-embedding-001', :query) AS v
+    )
+    SELECT {_COLUMNS}, 1 - (h.prompt_embedded <=> (SELECT v FROM q)) AS score
+    FROM user_prompt_history h
+    WHERE h.prompt_embedded IS NOT NULL
+    ORDER BY h.prompt_embedded <=> (SELECT v FROM q)
+    LIMIT :limit
+"""
+
+
+def escape_like(value: str) -> str:
+    """
+    Escapes LIKE wildcards so user input is matched literally.
+    """
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_history(conn, query: str, mode: str = "text", limit: int = 50) -> List[dict]:
+    """
+    Runs one history search mode and returns the rows, best match first.
+    Raises ValueError for an unknown mode or an unusable query.
+    """
+    query = (query or "").strip()
+    if mode not in HISTORY_SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}'. Use one of: {', '.join(HISTORY_SEARCH_MODES)}.")
+    if not query:
+        raise ValueError("Search query must not be empty.")
+    limit = max(1, min(limit, HISTORY_SEARCH_MAX_LIMIT))
+
+    if mode == "text":
+        result = await conn.execute(text(TEXT_SEARCH_SQL), {"query": query, "limit": limit})
+    elif mode == "substring":
+        if len(query) < MIN_SUBSTRING_LENGTH:
+            raise ValueError(f"Substring search needs at least {MIN_SUBSTRING_LENGTH} characters.")
+        result = await conn.execute(
+            text(SUBSTRING_SEARCH_SQL), {"pattern": f"%{escape_like(query)}%", "limit": limit}
+        )
+    else:
+        result = await conn.execute(text(SEMANTIC_SEARCH_SQL), {"query": query, "limit": limit})
+
+    rows = []
+    for row in result.mappings():
+        row = dict(row)
+        if row.get("score") is not None:
+            row["score"] = round(float(row["score"]), 4)
+        rows.append(row)
+    return rows
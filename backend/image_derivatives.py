@@ -0,0 +1,277 @@
+import os
+import io
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# RESIZED IMAGE DERIVATIVES WITH AN ON-DISK LRU CACHE
+# ==============================================================================
+# Listing images are full Imagen resolution, but the UI shows them as small
+# cards. /api/image can therefore return a resized WebP/AVIF/JPEG derivative.
+# Each derivative is generated once (resizing runs in a process pool so it
+# never blocks request handling) and kept in a size-bounded on-disk LRU cache.
+
+# When enabled, listing cards load derivatives through /api/image and search
+# responses carry no pre-signed `image_url`; when disabled, cards use signed originals
+IMAGE_DERIVATIVES_ENABLED = os.getenv("IMAGE_DERIVATIVES_ENABLED", "true").lower() == "true"
+# On Cloud Run /tmp is an in-memory filesystem: cached derivatives count against
+# the container memory limit together with the Python process and the resize
+# workers. Keep IMAGE_CACHE_MAX_BYTES well below that limit (see service.yaml).
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/tmp/image-derivatives")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(96 * 1024 * 1024)))
+IMAGE_RESIZE_WORKERS = int(os.getenv("IMAGE_RESIZE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "80"))
+# Originals can be overwritten in place (bootstrap_images.py), so derivatives are
+# keyed by the blob generation, which is looked up at most once per this interval
+IMAGE_GENERATION_TTL_SECONDS = float(os.getenv("IMAGE_GENERATION_TTL_SECONDS", "60"))
+# Browsers revalidate derivatives (ETag) after this; a replaced original shows up within it
+IMAGE_DERIVATIVE_MAX_AGE = int(os.getenv("IMAGE_DERIVATIVE_MAX_AGE", "300"))
+_GENERATIONS_MAX = 10000
+
+# Widths are snapped to a small set so the cache cannot be flooded with variants
+ALLOWED_WIDTHS = sorted(
+    int(w) for w in os.getenv("IMAGE_DERIVATIVE_WIDTHS", "160,320,480,640,960,1280").split(",") if w.strip()
+)
+
+MEDIA_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg"}
+PIL_FORMATS = {"webp": "WEBP", "avif": "AVIF", "jpeg": "JPEG"}
+
+
+def supported_formats() -> set:
+    formats = {"webp", "jpeg"}
+    # AVIF needs a Pillow build with AVIF support (Pillow >= 11.2 or the avif plugin)
+    if ".avif" in Image.registered_extensions():
+        formats.add("avif")
+    return formats
+
+
+def resize_image(image_bytes: bytes, width: int, fmt: str, quality: int) -> bytes:
+    """
+    Resizes an image to `width` (keeping aspect ratio, never upscaling) and encodes it.
+    Runs in a worker process.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = img.convert("RGB")
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        save_kwargs = {"quality": quality}
+        if fmt == "jpeg":
+            save_kwargs.update(optimize=True, progressive=True)
+        elif fmt == "webp":
+            save_kwargs.update(method=4)
+        img.save(out, PIL_FORMATS[fmt], **save_kwargs)
+        return out.getvalue()
+
+
+class DiskLRUCache:
+    """
+    Size-bounded LRU cache of files in a directory. The index lives in memory
+    and is rebuilt from the directory (oldest access first) on startup.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[str]:
+        if key not in self._index:
+            return None
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            self.total_bytes -= self._index.pop(key)
+            return None
+        self._index.move_to_end(key)
+        return path
+
+    def write(self, key: str, data: bytes) -> str:
+        """
+        Writes a file atomically (blocking; call from a worker thread).
+        The entry becomes visible once `register` is called on the event loop.
+        """
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def register(self, key: str, size: int):
+        if key in self._index:
+            self.total_bytes -= self._index.pop(key)
+        self._index[key] = size
+        self.total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ImageDerivativeService:
+    """
+    Produces cached image derivatives; identical concurrent requests share one generation.
+    """
+
+    def __init__(self, storage_client, cache: Optional[DiskLRUCache] = None):
+        self._storage_client = storage_client
+        self._cache = cache
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # gcs_uri -> (generation, expires_at)
+        self._generations: Dict[str, tuple] = {}
+        self.generation_lookups = 0
+        self.formats = supported_formats()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.generated_bytes = 0
+        self.generation_seconds = 0.0
+
+    @property
+    def cache(self) -> DiskLRUCache:
+        if self._cache is None:
+            self._cache = DiskLRUCache()
+        return self._cache
+
+    def normalize(self, width: Optional[int], fmt: Optional[str]) -> tuple:
+        """
+        Snaps the requested width to an allowed size and picks a supported format.
+        """
+        fmt = (fmt or "webp").lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in self.formats:
+            fmt = "webp"
+        if not width:
+            width = ALLOWED_WIDTHS[-1]
+        width = next((w for w in ALLOWED_WIDTHS if w >= width), ALLOWED_WIDTHS[-1])
+        return width, fmt
+
+    async def generation(self, gcs_uri: str, bucket_name: str, blob_name: str) -> int:
+        """
+        Current generation of the original (one metadata read, memoized briefly).
+        Raises FileNotFoundError if the object does not exist.
+        """
+        now = time.monotonic()
+        cached = self._generations.get(gcs_uri)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        self.generation_lookups += 1
+        blob = await asyncio.to_thread(self._storage_client.bucket(bucket_name).get_blob, blob_name)
+        if blob is None:
+            raise FileNotFoundError(gcs_uri)
+        if len(self._generations) >= _GENERATIONS_MAX:
+            self._generations.clear()
+        self._generations[gcs_uri] = (blob.generation, now + IMAGE_GENERATION_TTL_SECONDS)
+        return blob.generation
+
+    @staticmethod
+    def cache_key(gcs_uri: str, generation: int, width: int, fmt: str) -> str:
+        digest = hashlib.sha256(f"{gcs_uri}|{generation}|{width}".encode()).hexdigest()[:32]
+        return f"{digest}-w{width}.{fmt}"
+
+    async def get(self, gcs_uri: str, bucket_name: str, blob_name: str, generation: int,
+                  width: int, fmt: str) -> str:
+        """
+        Returns the path of the cached derivative, generating it if needed.
+        """
+        key = self.cache_key(gcs_uri, generation, width, fmt)
+        path = self.cache.get(key)
+        if path is not None:
+            self.hits += 1
+            return path
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._generate(key, bucket_name, blob_name, generation, width, fmt))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _generate(self, key: str, bucket_name: str, blob_name: str, generation: int,
+                        width: int, fmt: str) -> str:
+        try:
+            started = time.perf_counter()
+            # Pinned to the generation the key was built from
+            blob = self._storage_client.bucket(bucket_name).blob(blob_name, generation=generation)
+            original = await asyncio.to_thread(blob.download_as_bytes)
+
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=IMAGE_RESIZE_WORKERS)
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(
+                self._pool, resize_image, original, width, fmt, IMAGE_DERIVATIVE_QUALITY
+            )
+
+            path = await asyncio.to_thread(self.cache.write, key, data)
+            self.cache.register(key, len(data))
+            self.generated_bytes += len(data)
+            self.generation_seconds += time.perf_counter() - started
+            return path
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        generated = self.misses - self.errors
+        return {
+            "formats": sorted(self.formats),
+            "widths": ALLOWED_WIDTHS,
+            "entries": len(self.cache),
+            "bytes": self.cache.total_bytes,
+            "max_bytes": self.cache.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "evictions": self.cache.evictions,
+            "generation_lookups": self.generation_lookups,
+            "generated_bytes": self.generated_bytes,
+            "avg_generation_ms": round(1000 * self.generation_seconds / generated, 1) if generated > 0 else 0.0,
+        }
@@ -1,21 +1,38 @@
 import os
 import json
-import requests
+import time
+import asyncio
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, RedirectResponse
+from fastapi.responses import StreamingResponse, RedirectResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import google.auth
+import google.auth.transport.requests
 from google.cloud import storage
 import asyncpg
-from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import text
 import logging
 import sys
 import re
+from decimal import Decimal
+from datetime import datetime
 from typing import List, Optional, Any
 from sqlalchemy import text, bindparam
+from gda_client import gda_client
+from semantic_cache import SemanticCache
+from response_cache import ResponseCache
+from embedding_cache import EmbeddingCachePruner
+from template_matcher import TemplateMatcher
+from signed_urls import SignedUrlCache, parse_gcs_uri
+from gcs_streaming import stream_gcs_object
+from image_derivatives import (
+    IMAGE_DERIVATIVE_MAX_AGE, IMAGE_DERIVATIVES_ENABLED, ImageDerivativeService, MEDIA_TYPES,
+)
+from history_search import search_history
+from agent.history_writer import HistoryWriter
+from agent.db_pool import DatabasePool
+from agent.metrics import ServiceMetrics
 
 # ==============================================================================
 # LOGGING CONFIGURATION
@@ -51,6 +68,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics on /metrics: per-stage latency, in-flight requests, errors
+metrics = ServiceMetrics("search-backend")
+metrics.install(app)
+
 # Initialize Google Cloud Clients
 storage_client = None
 PROJECT_ID = os.getenv("GCP_PROJECT_ID") or os.environ.get("GOOGLE_CLOUD_PROJECT")
@@ -69,7 +90,12 @@ try:
 except Exception as e:
     print(f"Warning: Google Cloud initialization failed. Image serving may not work.\nError: {e}")
 
-# AlloyDB Configuration
+# Signed URL cache for /api/image and batch signing of result images
+signed_url_cache = SignedUrlCache(storage_client)
+
+# Resized WebP/AVIF derivatives for listing cards, cached on local disk
+image_derivatives = ImageDerivativeService(storage_client)
+
 # AlloyDB Configuration
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_USER = os.environ.get("DB_USER", "postgres")
@@ -79,28 +105,43 @@ DB_NAME = os.environ.get("DB_NAME", "search")
 if not DB_PASSWORD:
     logger.warning("DB_PASSWORD environment variable is not set. Database connection may fail if password is required.")
 
-# Global DB Engine
-engine = None
+# Shared, tuned connection pool (engine creation is lock-protected)
+db_pool = DatabasePool(DB_HOST, DB_USER, DB_PASSWORD, DB_NAME)
+get_engine = db_pool.get_engine
+metrics.track_db_pool(db_pool)
+
+# Semantic result cache for /api/search (backed by user_prompt_history)
+semantic_cache = SemanticCache(get_engine)
 
-async def get_engine():
-    global engine
-    if engine:
-        return engine
+# Exact-match response cache with single-flight coalescing for /api/search
+response_cache = ResponseCache()
 
-    if not DB_HOST:
-        raise ValueError("DB_HOST environment variable is not set.")
+# Local fast path for prompts that match a context-file query template
+template_matcher = TemplateMatcher()
+template_matcher.load()
 
-    logger.info(f"Connecting to AlloyDB via Auth Proxy at {DB_HOST}...")
-    db_url = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
-    engine = create_async_engine(db_url)
-    return engine
+# Write-behind queue that keeps history inserts (and their embedding calls) off the request path
+history_writer = HistoryWriter(get_engine, after_flush=lambda batch: on_history_flushed(batch),
+                               metrics=metrics, metrics_stage="history_insert")
+
+# Keeps the in-database query embedding cache bounded (prune_embedding_cache)
+embedding_cache_pruner = EmbeddingCachePruner(get_engine)
+
+@app.on_event("startup")
+async def startup_event():
+    history_writer.start()
+    embedding_cache_pruner.start()
+    # Open pooled connections now rather than on the first requests after a cold start
+    await db_pool.warm_up()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global engine
-    if engine:
-        await engine.dispose()
-        logger.info("Database engine disposed.")
+    # Flush queued history records before the engine goes away
+    await history_writer.stop()
+    await embedding_cache_pruner.stop()
+    await db_pool.dispose()
+    await gda_client.aclose()
+    image_derivatives.shutdown()
 
 # ==============================================================================
 # DATA MODELS
@@ -115,10 +156,24 @@ class FilterCondition(BaseModel):
     value: Any
     logic: str = "AND"
 
+class HistorySearchRequest(BaseModel):
+    query: str
+    # "text" (full-text), "substring" (contains) or "semantic" (similar prompts)
+    mode: str = "text"
+    limit: int = 50
+
+class ImageSignRequest(BaseModel):
+    gcs_uris: List[str]
+
 class HistoryRequest(BaseModel):
     # Deprecated: where_clause (unsafe), prefer filters
     where_clause: Optional[str] = None
     filters: List[FilterCondition] = []
+    # Keyset pagination on ("timestamp", id): `cursor` pages to older rows,
+    # `since` returns only rows newer than a previously returned cursor.
+    limit: int = 100
+    cursor: Optional[str] = None
+    since: Optional[str] = None
 
 # ==============================================================================
 # HELPER FUNCTIONS
@@ -143,27 +198,51 @@ def get_gda_credentials():
 
     return _gda_credentials
 
-def query_gda(prompt: str) -> dict:
+async def get_gda_token() -> str:
+    """
+    Returns a valid access token for GDA without blocking the event loop.
+    The (rare) credential refresh is a blocking HTTP call, so it runs in a worker thread.
+    """
+    creds = _gda_credentials
+    if creds is None or not creds.valid:
+        creds = await asyncio.to_thread(get_gda_credentials)
+    return creds.token
+
+# Generation options for a full answer (rows, NL answer, explanation)
+FULL_GENERATION_OPTIONS = {
+    "generate_query_result": True,
+    "generate_natural_language_answer": True,
+    "generate_explanation": True
+}
+
+# Generation options for the fast, rows-only call used by the streaming search
+LISTINGS_ONLY_GENERATION_OPTIONS = {
+    "generate_query_result": True,
+    "generate_natural_language_answer": False,
+    "generate_explanation": False
+}
+# The rows-only call is a second GDA call per streamed cache miss (extra quota/cost);
+# set to false to stream listings only once the full answer is there
+SEARCH_STREAM_FAST_LISTINGS = os.getenv("SEARCH_STREAM_FAST_LISTINGS", "true").lower() == "true"
+
+async def query_gda(prompt: str, generation_options: Optional[dict] = None) -> dict:
     """
     Queries the Gemini Data Agent (GDA) API to get property listings and natural language answers.
     
     This function sends the user's prompt to the GDA API, which translates it into a SQL query,
     executes it against the AlloyDB database, and returns the results along with a natural language summary.
+    The call goes through the shared pooled async client, so it never blocks the event loop
+    and is cancelled if the awaiting request task is cancelled.
     """
     if not AGENT_CONTEXT_SET_ID:
         raise HTTPException(500, "AGENT_CONTEXT_SET_ID is not configured.")
     
-    # GDA API Endpoint
+    # GDA API Endpoint (relative to the client's base URL)
     gda_location = os.getenv("GCP_LOCATION", "europe-west1")
-    url = f"https://geminidataanalytics.googleapis.com/v1beta/projects/{PROJECT_ID}/locations/{gda_location}:queryData"
+    path = f"/projects/{PROJECT_ID}/locations/{gda_location}:queryData"
     
     # Obtain credentials for the API request
-    creds = get_gda_credentials()
-    
-    headers = {
-        "Authorization": f"Bearer {creds.token}",
-        "Content-Type": "application/json"
-    }
+    token = await get_gda_token()
     
     # Construct the GDA API payload
     payload = {
@@ -185,83 +264,360 @@ def query_gda(prompt: str) -> dict:
                 }
             }
         },
-        "generation_options": {
-            "generate_query_result": True,
-            "generate_natural_language_answer": True,
-            "generate_explanation": True
-        }
+        "generation_options": generation_options or FULL_GENERATION_OPTIONS
     }
     
     try:
-        logger.info(f"Sending request to GDA API: {url}")
-        resp = requests.post(url, headers=headers, data=json.dumps(payload))
-        resp.raise_for_status()
-        return resp.json()
+        logger.info(f"Sending request to GDA API: {path}")
+        with metrics.stage("gda_call"):
+            return await gda_client.query_data(path, token, payload)
+    except asyncio.TimeoutError as e:
+        # Overall deadline, or an httpx connect/read/write/pool timeout
+        logger.error(f"GDA API Request timed out: {e}")
+        raise HTTPException(504, "Gemini Data Agent request timed out.")
     except Exception as e:
         logger.error(f"GDA API Request Failed: {e}")
-        if hasattr(e, 'response') and e.response:
+        if getattr(e, 'response', None) is not None:
              logger.error(f"GDA Error Response: {e.response.text}")
         raise HTTPException(500, f"Failed to query Gemini Data Agent: {e}")
 
+def build_search_response(gda_resp: dict) -> dict:
+    """
+    Converts a raw GDA queryData response into the /api/search response shape.
+    """
+    # Extract components from the response
+    nl_answer = gda_resp.get("naturalLanguageAnswer", "")
+    query_result = gda_resp.get("queryResult", {})
+    rows = query_result.get("rows", [])
+    cols = query_result.get("columns", [])
+    
+    # Process rows into a list of dictionaries
+    results = []
+    with metrics.stage("row_flattening"):
+        if rows and cols:
+            col_names = [c["name"] for c in cols]
+            for row in rows:
+                values = row.get("values", [])
+
+                # Flatten the response structure:
+                # GDA returns values as {"value": "actual_value"}, we extract "actual_value".
+                # We also filter out large embedding fields to reduce payload size.
+                item = {
+                    k: (v["value"] if isinstance(v, dict) and "value" in v else v)
+                    for k, v in zip(col_names, values)
+                    if k not in ("description_embedding", "image_embedding")
+                }
+
+                # Update image URIs to use the local proxy endpoint
+                # This prevents mixed content warnings and handles auth
+                if item.get("image_gcs_uri"):
+                    item["image_gcs_uri"] = f"/api/image?gcs_uri={item['image_gcs_uri']}"
+
+                results.append(item)
+    
+    # Construct the System Output for the UI
+    generated_sql = gda_resp.get("generatedQuery") or query_result.get("query", "SQL not returned by GDA")
+    explanation = gda_resp.get('intentExplanation', '')
+    total_row_count = query_result.get("totalRowCount", "0")
+    
+    # Create a preview of the raw query results (first 3 rows)
+    query_result_preview = {
+        "columns": cols,
+        "rows": rows[:3] if rows else []
+    }
+    
+    display_sql = f"// GEMINI DATA AGENT CALL\n// Generated SQL: {generated_sql}\n// Answer: {nl_answer}"
+    if explanation:
+        display_sql += f"\n// Explanation: {explanation}"
+
+    return {
+        "listings": results, 
+        "sql": display_sql, 
+        "nl_answer": nl_answer,
+        "details": {
+            "generated_query": generated_sql,
+            "intent_explanation": explanation,
+            "total_row_count": total_row_count,
+            "query_result_preview": query_result_preview
+        }
+    }
+
+IMAGE_PROXY_PREFIX = "/api/image?gcs_uri="
+
+# Upper bound for one batch signing request
+MAX_SIGN_BATCH = 100
+
+async def with_signed_urls(listings: List[dict]) -> List[dict]:
+    """
+    Returns copies of the listings with a ready-to-use `image_url` (signed GCS URL).
+    `image_gcs_uri` keeps pointing at the /api/image proxy as a fallback.
+    Signing happens per response, after caching, so cached responses never hold expired URLs.
+    Skipped when cards load resized derivatives through the proxy instead.
+    """
+    def source_uri(item):
+        uri = item.get("image_gcs_uri") or ""
+        return uri[len(IMAGE_PROXY_PREFIX):] if uri.startswith(IMAGE_PROXY_PREFIX) else uri
+
+    if IMAGE_DERIVATIVES_ENABLED or not storage_client or not listings:
+        return listings
+
+    with metrics.stage("image_signing"):
+        urls = await signed_url_cache.sign_many(source_uri(item) for item in listings)
+    signed = []
+    for item in listings:
+        item = dict(item)
+        url = urls.get(source_uri(item))
+        if url:
+            item["image_url"] = url
+        signed.append(item)
+    return signed
+
+def build_template_response(template, params: dict, rows: List[dict]) -> dict:
+    """
+    Builds the /api/search response shape for a locally executed query template.
+    """
+    results = []
+    with metrics.stage("row_flattening"):
+        for row in rows:
+            item = {
+                k: (float(v) if isinstance(v, Decimal) else v)
+                for k, v in row.items()
+                if k not in ("description_embedding", "image_embedding")
+            }
+            if item.get("image_gcs_uri"):
+                item["image_gcs_uri"] = f"/api/image?gcs_uri={item['image_gcs_uri']}"
+            results.append(item)
+
+    generated_sql = template.display_sql(params)
+    explanation = f"Matched Template {template.template_id} locally: {template.intent}"
+    nl_answer = f"Found {len(results)} properties matching your request."
+    cols = [{"name": name} for name in (rows[0].keys() if rows else [])]
+
+    # Same preview format as GDA: first 3 rows as {"values": [{"value": ...}]}
+    query_result_preview = {
+        "columns": cols,
+        "rows": [
+            {"values": [{"value": None if v is None else str(v)} for v in row.values()]}
+            for row in rows[:3]
+        ]
+    }
+
+    display_sql = f"// LOCAL TEMPLATE MATCH (Template {template.template_id})\n// Generated SQL: {generated_sql}\n// Answer: {nl_answer}"
+    display_sql += f"\n// Explanation: {explanation}"
+
+    return {
+        "listings": results,
+        "sql": display_sql,
+        "nl_answer": nl_answer,
+        "details": {
+            "generated_query": generated_sql,
+            "intent_explanation": explanation,
+            "total_row_count": str(len(results)),
+            "query_result_preview": query_result_preview,
+            "query_template_used": True,
+            "query_template_id": template.template_id
+        }
+    }
+
+async def run_template_search(query: str) -> Optional[dict]:
+    """
+    Answers a prompt by executing a matching context-file template directly.
+    Returns None when no template matches confidently, execution fails or the
+    template finds nothing, in which case the caller falls back to GDA.
+    """
+    matched = template_matcher.match(query)
+    if matched is None:
+        return None
+
+    template, params = matched
+    try:
+        db_engine = await get_engine()
+        # Committed, so that newly computed query embeddings stay in the embedding cache
+        async with db_engine.begin() as conn:
+            result = await conn.execute(text(template.sql), params)
+            rows = [dict(row) for row in result.mappings()]
+    except Exception as e:
+        template_matcher.errors += 1
+        metrics.error("template_query", e)
+        logger.warning(f"Template {template.template_id} execution failed, falling back to GDA: {e}")
+        return None
+
+    if not rows:
+        # Usually a parameter the template misread; GDA gets a chance at the prompt
+        template_matcher.empty_results += 1
+        logger.info(f"Template {template.template_id} returned no rows, falling back to GDA.")
+        return None
+
+    logger.info(f"Answered locally with Template {template.template_id} ({len(rows)} rows).")
+    return build_template_response(template, params, rows)
+
+async def run_search(query: str) -> tuple:
+    """
+    Computes a search response. Returns (response, listings_version, fresh), where
+    `fresh` is True when the response came from GDA rather than a template or the semantic cache.
+    """
+    # Prompts matching a context-file template are answered without GDA
+    response = await run_template_search(query)
+    if response is not None:
+        return response, None, False
+
+    # Try to answer from a previous, semantically equivalent prompt
+    response, listings_version = await semantic_cache.lookup(query)
+    if response is not None:
+        return response, listings_version, False
+
+    # Query the Gemini Data Agent
+    gda_resp = await query_gda(query)
+    return build_search_response(gda_resp), listings_version, True
+
+def save_search_history(prompt: str, response: dict, cache_response: bool = False,
+                        listings_version: Optional[int] = None):
+    """
+    Queues a `user_prompt_history` record for the write-behind history writer.
+    When `cache_response` is set, the response is stored with the row so that
+    the semantic cache can serve it to later, similar prompts.
+    """
+    explanation = response.get("details", {}).get("intent_explanation", "")
+    store_response = cache_response and semantic_cache.enabled and listings_version is not None
+
+    # Determine template usage
+    query_template_used = False
+    query_template_id = None
+    
+    if explanation:
+        # Look for "Template X" pattern in the explanation
+        match = re.search(r"Template\s+(\d+)", explanation, re.IGNORECASE)
+        if match:
+            query_template_used = True
+            query_template_id = int(match.group(1))
+
+    history_writer.submit({
+        "user_prompt": prompt,
+        "query_template_used": query_template_used,
+        "query_template_id": query_template_id,
+        "query_explanation": explanation,
+        "search_response": json.dumps(response) if store_response else None,
+        "listings_version": listings_version if store_response else None
+    })
+
+HISTORY_MAX_PAGE_SIZE = 500
+
+def encode_history_cursor(row: dict) -> str:
+    """
+    Encodes the ("timestamp", id) keyset position of a history row as an opaque cursor.
+    """
+    return f"{row['timestamp'].isoformat()}|{row['id']}"
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """
+    Decodes a cursor produced by `encode_history_cursor`. Raises ValueError if malformed.
+    """
+    timestamp, _, row_id = cursor.rpartition("|")
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+async def on_history_flushed(batch: List[dict]):
+    """
+    Lets the semantic cache trim its entries once new cached responses are persisted.
+    """
+    stored = sum(1 for record in batch if record.get("search_response") is not None)
+    if stored:
+        await semantic_cache.after_store(stored)
+
 # ==============================================================================
 # API ENDPOINTS
 # ==============================================================================
 
 @app.get("/api/image")
-async def get_image(gcs_uri: str):
+async def get_image(gcs_uri: str, request: Request, w: Optional[int] = None, fmt: Optional[str] = None):
     """
     Serves images from Google Cloud Storage (GCS).
     
     This endpoint acts as a secure proxy, allowing the frontend to display images
     from a private GCS bucket without exposing the bucket publicly.
-    It attempts to generate a signed URL for direct access (efficient) or streams
-    the file content if signing fails.
+    It redirects to a (cached) signed URL for direct access (efficient) or streams
+    the file content if signing fails. The streaming fallback honours Range and
+    conditional (If-None-Match / If-Modified-Since) requests.
+
+    With `w` (width) and/or `fmt` (webp, avif, jpeg) it serves a resized derivative
+    from the local disk cache instead, generating it on first use.
     """
     if not storage_client:
         raise HTTPException(500, "Storage client is not initialized.")
 
+    # Parse the GCS URI to extract bucket and blob names
     try:
-        # Parse the GCS URI to extract bucket and blob names
-        if gcs_uri.startswith("gs://"):
-            path = gcs_uri[5:]
-        elif gcs_uri.startswith("https://storage.googleapis.com/"):
-            path = gcs_uri[31:]
-        else:
-            raise HTTPException(400, "Invalid GCS URI format.")
-            
-        if "/" not in path:
-             raise HTTPException(400, "Invalid GCS URI: Missing object path.")
+        bucket_name, blob_name = parse_gcs_uri(gcs_uri)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
-        bucket_name, blob_name = path.split("/", 1)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        
-        # Method 1: Generate a Signed URL (Preferred for performance)
+    if w is not None or fmt is not None:
+        width, image_format = image_derivatives.normalize(w, fmt)
         try:
-            signed_url = blob.generate_signed_url(
-                version="v4",
-                expiration=3600, # URL valid for 1 hour
-                method="GET"
-            )
+            generation = await image_derivatives.generation(gcs_uri, bucket_name, blob_name)
+        except Exception as e:
+            logger.error(f"Error reading image metadata: {e}")
+            raise HTTPException(404, "Image not found or inaccessible.")
+        # The ETag changes when the original is replaced, so revalidation picks up new images
+        etag = f'"{image_derivatives.cache_key(gcs_uri, generation, width, image_format)}"'
+        headers = {"Cache-Control": f"public, max-age={IMAGE_DERIVATIVE_MAX_AGE}", "ETag": etag}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        try:
+            path = await image_derivatives.get(gcs_uri, bucket_name, blob_name, generation, width, image_format)
+        except Exception as e:
+            logger.error(f"Error generating image derivative: {e}")
+            raise HTTPException(404, "Image not found or inaccessible.")
+        return FileResponse(path, media_type=MEDIA_TYPES[image_format], headers=headers)
+
+    try:
+        # Method 1: Redirect to a Signed URL (Preferred for performance)
+        try:
+            with metrics.stage("image_signing"):
+                signed_url, expires_in = await signed_url_cache.sign(gcs_uri)
+            # Browsers may reuse the redirect while the signed URL remains valid
+            max_age = max(0, expires_in - signed_url_cache.refresh_margin)
             return RedirectResponse(
                 url=signed_url, 
                 status_code=307,
-                headers={"Cache-Control": "public, max-age=300"}
+                headers={"Cache-Control": f"public, max-age={max_age}"}
             )
         except Exception as sign_err:
             # Method 2: Stream content (Fallback)
             logger.warning(f"Signed URL generation failed, falling back to streaming: {sign_err}")
-            file_obj = blob.open("rb")
-            return StreamingResponse(
-                file_obj, 
-                media_type="image/jpeg", 
-                headers={"Cache-Control": "public, max-age=86400"}
-            )
-
+            # Chunked reads off the event loop, with Range and ETag/304 support
+            started = time.perf_counter()
+            try:
+                response = await stream_gcs_object(storage_client, bucket_name, blob_name, request.headers)
+            except Exception as stream_err:
+                metrics.error("gcs_streaming", stream_err)
+                raise
+            if isinstance(response, StreamingResponse):
+                # Timed until the last chunk has been read from GCS
+                response.body_iterator = metrics.track_stream("gcs_streaming", response.body_iterator, started)
+            else:
+                metrics.observe("gcs_streaming", time.perf_counter() - started)
+            return response
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error serving image: {e}")
         raise HTTPException(404, "Image not found or inaccessible.")
 
+@app.post("/api/image/sign")
+async def sign_images(request: ImageSignRequest):
+    """
+    Signs all image URIs of a result set in one call.
+    Returns {"urls": {gcs_uri: signed_url or null}}; null means the client should
+    fall back to the /api/image proxy for that image.
+    """
+    if not storage_client:
+        raise HTTPException(500, "Storage client is not initialized.")
+
+    with metrics.stage("image_signing"):
+        urls = await signed_url_cache.sign_many(request.gcs_uris[:MAX_SIGN_BATCH])
+    return {"urls": urls, "expires_in": signed_url_cache.ttl_seconds}
+
 @app.post("/api/search")
 async def search_properties(request: SearchRequest):
     """
@@ -272,125 +628,230 @@ async def search_properties(request: SearchRequest):
     2. The generated SQL query.
     3. A natural language answer.
     4. An explanation of the reasoning (if available).
+
+    Repeated prompts are answered from the exact-match response cache, and
+    semantically equivalent prompts seen recently from the semantic cache.
     """
     logger.info(f"Processing search query: '{request.query}'")
     
     try:
-        # Query the Gemini Data Agent
-        gda_resp = query_gda(request.query)
-        
-        # Extract components from the response
-        nl_answer = gda_resp.get("naturalLanguageAnswer", "")
-        query_result = gda_resp.get("queryResult", {})
-        rows = query_result.get("rows", [])
-        cols = query_result.get("columns", [])
-        
-        # Process rows into a list of dictionaries
-        results = []
-        if rows and cols:
-            col_names = [c["name"] for c in cols]
-            for row in rows:
-                values = row.get("values", [])
-                
-                # Flatten the response structure:
-                # GDA returns values as {"value": "actual_value"}, we extract "actual_value".
-                # We also filter out large embedding fields to reduce payload size.
-                item = {
-                    k: (v["value"] if isinstance(v, dict) and "value" in v else v)
-                    for k, v in zip(col_names, values)
-                    if k not in ("description_embedding", "image_embedding")
-                }
-                
-                # Update image URIs to use the local proxy endpoint
-                # This prevents mixed content warnings and handles auth
-                if item.get("image_gcs_uri"):
-                    item["image_gcs_uri"] = f"/api/image?gcs_uri={item['image_gcs_uri']}"
-                
-                results.append(item)
-        
-        # Construct the System Output for the UI
-        generated_sql = gda_resp.get("generatedQuery") or gda_resp.get("queryResult", {}).get("query", "SQL not returned by GDA")
-        explanation = gda_resp.get('intentExplanation', '')
-        total_row_count = gda_resp.get("queryResult", {}).get("totalRowCount", "0")
-        
-        # Create a preview of the raw query results (first 3 rows)
-        query_result_preview = {
-            "columns": cols,
-            "rows": rows[:3] if rows else []
-        }
-        
-        display_sql = f"// GEMINI DATA AGENT CALL\n// Generated SQL: {generated_sql}\n// Answer: {nl_answer}"
-        if explanation:
-            display_sql += f"\n// Explanation: {explanation}"
-        
-        # Log to Database
-        try:
-            db_engine = await get_engine()
-            async with db_engine.begin() as conn:
-                # Determine template usage
-                query_template_used = False
-                query_template_id = None
-                
-                if explanation:
-                    # Look for "Template X" pattern in the explanation
-                    match = re.search(r"Template\s+(\d+)", explanation, re.IGNORECASE)
-                    if match:
-                        query_template_used = True
-                        query_template_id = int(match.group(1))
-                
-                await conn.execute(
-                    text("""
-                    INSERT INTO user_prompt_history 
-                    (user_prompt, query_template_used, query_template_id, query_explanation)
-                    VALUES (:prompt, :used, :id, :explanation)
-                    """),
-                    {
-                        "prompt": request.query, 
-                        "used": query_template_used, 
-                        "id": query_template_id,
-                        "explanation": explanation
-                    }
-                )
-
-            logger.info("User prompt history saved (Search).")
-        except Exception as db_err:
-            logger.error(f"Failed to save user prompt history (Search): {db_err}")
-
-        return {
-            "listings": results, 
-            "sql": display_sql, 
-            "nl_answer": nl_answer,
-            "details": {
-                "generated_query": generated_sql,
-                "intent_explanation": explanation,
-                "total_row_count": total_row_count,
-                "query_result_preview": query_result_preview
-            }
-        }
-
+        # Identical concurrent queries share one computation; repeats hit the exact cache
+        (response, listings_version, fresh), source = await response_cache.get_or_compute(
+            request.query, lambda: run_search(request.query)
+        )
+        if source != "miss":
+            logger.info(f"Search served from response cache ({source}).")
+
+        # Only fresh GDA responses become new semantic cache entries
+        save_search_history(
+            request.query,
+            response,
+            cache_response=fresh and source == "miss",
+            listings_version=listings_version
+        )
+
+        response["listings"] = await with_signed_urls(response.get("listings", []))
+        return response
+
+    except HTTPException as e:
+        # GDA timeouts (504) and failures keep their status code
+        logger.error(f"Search failed: {e.detail}")
+        metrics.error("search", e)
+        raise
     except Exception as e:
         logger.error(f"Search failed: {e}")
+        metrics.error("search", e)
         return {
             "listings": [], 
             "sql": f"An error occurred during search: {str(e)}",
             "nl_answer": "I encountered an error while processing your request."
         }
 
+@app.post("/api/search/stream")
+async def search_properties_stream(request: SearchRequest):
+    """
+    Streaming variant of /api/search that emits newline-delimited JSON events:
+
+    1. {"event": "listings", ...}  as soon as rows are available,
+    2. {"event": "answer", ...}    the full response incl. NL answer and explanation,
+    3. {"event": "done"}           or {"event": "error", "status": ..., "message": ...}
+                                   (status 504 when the GDA request timed out).
+
+    On a cache miss the full GDA call joins the same single flight as /api/search.
+    The request that starts the flight also runs a rows-only call next to it
+    (SEARCH_STREAM_FAST_LISTINGS), which usually returns first; requests that
+    join an existing flight just wait for its result.
+    """
+    logger.info(f"Processing streaming search query: '{request.query}'")
+
+    def event(payload: dict) -> str:
+        return json.dumps(payload) + "\n"
+
+    async def full_response_events(response: dict):
+        listings = await with_signed_urls(response.get("listings", []))
+        yield event({"event": "listings", "listings": listings})
+        yield event({"event": "answer", **response, "listings": listings})
+        yield event({"event": "done"})
+
+    async def stream():
+        # Cached responses (exact, then semantic) are sent in one go
+        cached = response_cache.peek(request.query)
+        if cached is not None:
+            response, _, _ = cached
+            save_search_history(request.query, response)
+            async for chunk in full_response_events(response):
+                yield chunk
+            return
+
+        fast_task = None
+        full_task = None
+        try:
+            response = await run_template_search(request.query)
+            if response is not None:
+                response_cache.put(request.query, (response, None, False))
+                save_search_history(request.query, response)
+                async for chunk in full_response_events(response):
+                    yield chunk
+                return
+
+            response, listings_version = await semantic_cache.lookup(request.query)
+            if response is not None:
+                response_cache.put(request.query, (response, listings_version, False))
+                save_search_history(request.query, response)
+                async for chunk in full_response_events(response):
+                    yield chunk
+                return
+
+            async def run_gda_search():
+                gda_resp = await query_gda(request.query, FULL_GENERATION_OPTIONS)
+                return build_search_response(gda_resp), listings_version, True
+
+            # Only the request that starts the flight pays for the extra rows-only call
+            leader = not response_cache.is_inflight(request.query)
+            full_task = asyncio.create_task(response_cache.get_or_compute(request.query, run_gda_search))
+            if leader and SEARCH_STREAM_FAST_LISTINGS:
+                fast_task = asyncio.create_task(query_gda(request.query, LISTINGS_ONLY_GENERATION_OPTIONS))
+
+            # Whichever call finishes first provides the listings
+            pending = {task for task in (fast_task, full_task) if task is not None}
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if full_task not in done:
+                try:
+                    fast_response = build_search_response(fast_task.result())
+                    yield event({
+                        "event": "listings",
+                        "listings": await with_signed_urls(fast_response["listings"]),
+                        "details": {
+                            "generated_query": fast_response["details"]["generated_query"],
+                            "total_row_count": fast_response["details"]["total_row_count"]
+                        }
+                    })
+                except Exception as fast_err:
+                    # The full call still provides the listings
+                    logger.warning(f"Fast GDA call failed, waiting for full response: {fast_err}")
+            elif fast_task is not None:
+                fast_task.cancel()
+
+            (response, listings_version, fresh), source = await full_task
+            if source != "miss":
+                logger.info(f"Streaming search joined response cache ({source}).")
+            # Only the request that ran the GDA call creates the semantic cache entry
+            save_search_history(request.query, response, cache_response=fresh and source == "miss",
+                                listings_version=listings_version)
+
+            listings = await with_signed_urls(response["listings"])
+            if full_task in done:
+                yield event({"event": "listings", "listings": listings})
+            yield event({"event": "answer", **response, "listings": listings})
+            yield event({"event": "done"})
+
+        except Exception as e:
+            logger.error(f"Streaming search failed: {e}")
+            metrics.error("search_stream", e)
+            # The 200 status line is already sent, so the error status travels in the event
+            status = e.status_code if isinstance(e, HTTPException) else 500
+            message = e.detail if isinstance(e, HTTPException) else str(e)
+            yield event({
+                "event": "error",
+                "status": status,
+                "message": message,
+                "sql": f"An error occurred during search: {str(e)}",
+                "nl_answer": "I encountered an error while processing your request."
+            })
+        finally:
+            # Client disconnects close the generator; don't leave GDA calls running.
+            # The shared full computation is shielded and still completes for other waiters.
+            for task in (fast_task, full_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def get_embedding_cache_stats() -> dict:
+    """
+    Reads the in-database query embedding cache counters (`embedding_cache_stats` view).
+    """
+    try:
+        db_engine = await get_engine()
+        async with db_engine.connect() as conn:
+            result = await conn.execute(text("SELECT entries, hits, misses, hit_ratio FROM embedding_cache_stats"))
+            row = result.mappings().first()
+        return {key: float(value) if isinstance(value, Decimal) else value for key, value in dict(row or {}).items()}
+    except Exception as e:
+        logger.warning(f"Embedding cache stats unavailable: {e}")
+        return {"error": str(e)}
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """
+    Returns hit/miss counters of the search result caches and history writer counters.
+    """
+    return {
+        "exact": response_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "templates": template_matcher.stats(),
+        "signed_urls": signed_url_cache.stats(),
+        "image_derivatives": image_derivatives.stats(),
+        "history_writer": history_writer.stats(),
+        "embeddings": {**await get_embedding_cache_stats(), "pruning": embedding_cache_pruner.stats()}
+    }
+
+@app.get("/api/db/stats")
+async def get_db_stats():
+    """
+    Returns connection pool settings and usage (checked out, waiters, wait times).
+    """
+    return db_pool.stats()
+
 @app.post("/api/history")
 async def get_history(request: HistoryRequest):
     """
-    Retrieves user prompt history using direct DB connection.
+    Retrieves user prompt history using direct DB connection, newest first.
     Supports structured filtering to prevent SQL injection.
+    Pages are keyset-paginated on ("timestamp", id), so every page is a
+    short index range scan regardless of how large the table grows.
     """
+    if request.cursor and request.since:
+        raise HTTPException(400, "'cursor' and 'since' cannot be combined.")
+    try:
+        cursor = decode_history_cursor(request.cursor) if request.cursor else None
+        since = decode_history_cursor(request.since) if request.since else None
+    except ValueError:
+        raise HTTPException(400, "Invalid history cursor.")
+    limit = max(1, min(request.limit, HISTORY_MAX_PAGE_SIZE))
+
     try:
         db_engine = await get_engine()
         async with db_engine.connect() as conn:
             base_query = """
-                SELECT user_prompt, query_template_used, query_template_id, query_explanation 
+                SELECT id, "timestamp", user_prompt, query_template_used, query_template_id, query_explanation 
                 FROM "public"."user_prompt_history"
             """
             
-            conditions = []
             params = {}
             
             # Handle legacy where_clause (only if simple/safe or warn)
@@ -409,8 +870,7 @@ async def get_history(request: HistoryRequest):
             ALLOWED_COLUMNS = {"user_prompt", "query_template_used", "query_template_id", "query_explanation"}
             ALLOWED_OPERATORS = {"=", "!=", "LIKE", "ILIKE", ">", "<", ">=", "<="}
             
-            query_str = base_query
-            first_condition = True
+            filter_str = ""
 
             if request.filters:
                 for idx, f in enumerate(request.filters):
@@ -423,28 +883,91 @@ async def get_history(request: HistoryRequest):
                     
                     # Handle type casting for integer/boolean columns when using string operators
                     column_expr = f.column
-                    if f.column in ("query_template_id", "query_template_used") and f.operator.upper() in ("LIKE", "ILIKE"):
-                        column_expr = f"CAST({f.column} AS TEXT)"
+                    operator = f.operator
+                    value = f.value
+                    if f.column in ("query_template_id", "query_template_used") and operator.upper() in ("LIKE", "ILIKE"):
+                        if f.column == "query_template_id" and str(value).strip().isdigit():
+                            # Without wildcards this is plain equality, which can use the template index
+                            operator, value = "=", int(str(value).strip())
+                        else:
+                            column_expr = f"CAST({f.column} AS TEXT)"
                         
-                    clause = f"{column_expr} {f.operator} :{param_name}"
-                    params[param_name] = f.value
+                    clause = f"{column_expr} {operator} :{param_name}"
+                    params[param_name] = value
                     
-                    if first_condition:
-                        query_str += f" WHERE {clause}"
-                        first_condition = False
+                    if not filter_str:
+                        filter_str = clause
                     else:
                         logic_op = f.logic.upper()
                         if logic_op not in ("AND", "OR"):
                             logic_op = "AND"
-                        query_str += f" {logic_op} {clause}"
+                        filter_str += f" {logic_op} {clause}"
+
+            conditions = []
+            if filter_str:
+                # Parenthesized so that OR filters cannot escape the keyset condition
+                conditions.append(f"({filter_str})")
+            if cursor:
+                conditions.append('("timestamp", id) < (:cursor_ts, :cursor_id)')
+                params["cursor_ts"], params["cursor_id"] = cursor
+            if since:
+                conditions.append('("timestamp", id) > (:since_ts, :since_id)')
+                params["since_ts"], params["since_id"] = since
 
-            query_str += " LIMIT 1000"
+            query_str = base_query
+            if conditions:
+                query_str += " WHERE " + " AND ".join(conditions)
+
+            # New rows are read oldest-first from the cursor so a burst larger than
+            # one page is never skipped; everything else is newest-first.
+            direction = "ASC" if since else "DESC"
+            query_str += f' ORDER BY "timestamp" {direction}, id {direction} LIMIT :limit'
+            # One extra row tells whether another page exists
+            params["limit"] = limit + 1
             
             result = await conn.execute(text(query_str), params)
             rows = [dict(row) for row in result.mappings()]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if since:
+            rows.reverse()
+
+        if since:
+            # Newest row returned so far; the client polls again from here
+            latest_cursor = encode_history_cursor(rows[0]) if rows else request.since
+            next_cursor = None
+        else:
+            # Only the first page knows the newest row
+            latest_cursor = encode_history_cursor(rows[0]) if rows and not cursor else None
+            next_cursor = encode_history_cursor(rows[-1]) if rows and has_more else None
             
-        return {"rows": rows}
+        return {
+            "rows": rows,
+            "next_cursor": next_cursor,
+            "latest_cursor": latest_cursor,
+            "has_more": has_more
+        }
         
     except Exception as e:
         logger.error(f"History fetch failed: {e}")
+        metrics.error("history_fetch", e)
         raise HTTPException(500, f"Failed to fetch history: {e}")
+
+@app.post("/api/history/search")
+async def search_history_endpoint(request: HistorySearchRequest):
+    """
+    Searches the prompt history by full text, substring or semantic similarity.
+    Every mode is served by an index (GIN tsvector, pg_trgm or ScaNN).
+    """
+    try:
+        db_engine = await get_engine()
+        async with db_engine.begin() as conn:
+            rows = await search_history(conn, request.query, request.mode, request.limit)
+        return {"rows": rows, "mode": request.mode}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        logger.error(f"History search failed: {e}")
+        metrics.error("history_search", e)
+        raise HTTPException(500, f"Failed to search history: {e}")
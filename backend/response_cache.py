@@ -0,0 +1,157 @@
+import os
+import re
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# EXACT-MATCH RESPONSE CACHE WITH SINGLE-FLIGHT COALESCING
+# ==============================================================================
+# In-process LRU + TTL cache keyed on the normalized query text. While a result
+# for a key is being computed, concurrent requests for the same key await that
+# one computation instead of starting their own (single flight).
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s?.!]+$")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Case-folds, collapses whitespace and drops trailing punctuation, so that
+    "Cheapest studios in Geneva" and "cheapest  studios in geneva?" share a key.
+    """
+    collapsed = " ".join((query or "").casefold().split())
+    return _TRAILING_PUNCTUATION_RE.sub("", collapsed)
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache with single-flight computation per key.
+
+    `get_or_compute` returns (value, source) where source is one of:
+      - "hit":       served from the cache,
+      - "coalesced": awaited a computation started by another request,
+      - "miss":      this request ran the computation.
+    Failed computations are not cached; their exception is raised to every waiter.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.evictions = 0
+
+    def _get_fresh(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, query: str) -> Any:
+        """
+        Returns a copy of the cached value for a query, or None. Never computes.
+        """
+        value = self._get_fresh(normalize_query(query))
+        if value is None:
+            return None
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def is_inflight(self, query: str) -> bool:
+        """
+        True while a computation for the query is running.
+        """
+        return normalize_query(query) in self._inflight
+
+    def put(self, query: str, value: Any):
+        """
+        Stores a value computed outside of `get_or_compute` (e.g. by the streaming search).
+        """
+        if self.max_entries > 0:
+            self._put(normalize_query(query), value)
+
+    async def get_or_compute(self, query: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        key = normalize_query(query)
+
+        if self.max_entries <= 0:
+            self.misses += 1
+            return await compute(), "miss"
+
+        value = self._get_fresh(key)
+        if value is not None:
+            self.hits += 1
+            return copy.deepcopy(value), "hit"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            source = "coalesced"
+        else:
+            self.misses += 1
+            source = "miss"
+            # The computation runs in its own task so that a cancelled leader
+            # request does not cancel the result its followers are waiting for.
+            task = asyncio.create_task(self._compute(key, compute))
+            self._inflight[key] = task
+
+        value = await asyncio.shield(task)
+        return copy.deepcopy(value), source
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            self._put(key, value)
+            return value
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses + self.coalesced
+        executions = self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / requests, 4) if requests else 0.0,
+            # Share of non-cached requests that piggybacked on an in-flight computation
+            "coalescing_ratio": round(self.coalesced / executions, 4) if executions else 0.0,
+            "computations_saved": self.hits + self.coalesced,
+        }
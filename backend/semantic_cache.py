@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import logging
+from typing import Optional, Callable, Awaitable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# SEMANTIC RESULT CACHE
+# ==============================================================================
+# Answers a new /api/search prompt with the stored response of a previous,
+# semantically equivalent prompt. Candidates come from `user_prompt_history`,
+# which already holds an embedding (`prompt_embedded`) for every prompt; the
+# cached response lives next to it in `search_response`. The lookup embeds the
+# prompt through `cached_embedding`, so the history insert that follows a miss
+# does not call the embedding model again.
+#
+# Entries are only reused while:
+#   - they are younger than the TTL,
+#   - they were computed against the current `property_listings` version
+#     (bumped by a statement-level trigger on every write to that table),
+#   - they are within the newest `max_entries` cached rows.
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_CANDIDATES = 5
+
+_NUMBER_RE = re.compile(r"(\d+(?:[.,']\d+)*)\s*(k\b)?", re.IGNORECASE)
+
+LOOKUP_SQL = """
+    WITH q AS (
+        SELECT cached_embedding('gemini-embedding-001', :prompt) AS v
+    ),
+    s AS (
+        SELECT listings_version FROM search_cache_state
+    )
+    SELECT s.listings_version AS current_version,
+           c.user_prompt, c.search_response, c.similarity
+    FROM s
+    LEFT JOIN LATERAL (
+        SELECT h.user_prompt, h.search_response,
+               1 - (h.prompt_embedded <=> q.v) AS similarity
+        FROM user_prompt_history h, q
+        WHERE h.search_response IS NOT NULL
+          AND h.listings_version = s.listings_version
+          AND h."timestamp" > LOCALTIMESTAMP - make_interval(secs => :ttl)
+        ORDER BY h.prompt_embedded <=> q.v
+        LIMIT :candidates
+    ) c ON true
+"""
+
+EVICT_SQL = """
+    UPDATE user_prompt_history
+    SET search_response = NULL
+    WHERE search_response IS NOT NULL
+      AND (
+          "timestamp" <= LOCALTIMESTAMP - make_interval(secs => :ttl)
+          OR listings_version IS DISTINCT FROM (SELECT listings_version FROM search_cache_state)
+          OR id <= (
+              SELECT id FROM user_prompt_history
+              WHERE search_response IS NOT NULL
+              ORDER BY id DESC
+              OFFSET :max_entries LIMIT 1
+          )
+      )
+"""
+
+
+def numeric_signature(prompt: str) -> list:
+    """
+    Extracts the numbers of a prompt ("3k" -> 3000, "3'000" -> 3000) as a sorted list.
+    Two prompts may only share a cached result if their numbers agree; embeddings
+    alone rate "2 bedrooms under 3k" and "3 bedrooms under 3k" as near-identical.
+    """
+    values = []
+    for number, k_suffix in _NUMBER_RE.findall(prompt or ""):
+        try:
+            value = float(number.replace("'", "").replace(",", ""))
+        except ValueError:
+            continue
+        if k_suffix:
+            value *= 1000
+        values.append(value)
+    return sorted(values)
+
+
+class SemanticCache:
+    """
+    Similarity-based /api/search response cache on top of `user_prompt_history`.
+    All failures degrade to a cache miss; the search path never depends on the cache.
+    """
+
+    def __init__(self, get_engine: Callable[[], Awaitable[AsyncEngine]],
+                 enabled: bool = SEMANTIC_CACHE_ENABLED,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self._get_engine = get_engine
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Evict roughly every 10% of capacity worth of stores
+        self._evict_every = max(1, max_entries // 10)
+        self._stores_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.errors = 0
+        self.stores = 0
+        self.evictions = 0
+
+    async def lookup(self, prompt: str) -> tuple:
+        """
+        Returns (response, listings_version). `response` is None on a miss.
+        `listings_version` must be stored with any response computed for this prompt.
+        """
+        if not self.enabled:
+            return None, None
+
+        try:
+            db_engine = await self._get_engine()
+            # A transaction that commits, so the prompt embedding is kept in the
+            # embedding cache and reused when the history row is written
+            async with db_engine.begin() as conn:
+                result = await conn.execute(
+                    text(LOOKUP_SQL),
+                    {"prompt": prompt, "ttl": self.ttl_seconds, "candidates": SEMANTIC_CACHE_CANDIDATES}
+                )
+                rows = result.mappings().all()
+        except Exception as e:
+            self.errors += 1
+            self.misses += 1
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None, None
+
+        version = rows[0]["current_version"] if rows else None
+        signature = numeric_signature(prompt)
+
+        for row in rows:
+            if row["search_response"] is None or row["similarity"] is None:
+                continue
+            if row["similarity"] < self.threshold:
+                break
+            if numeric_signature(row["user_prompt"]) != signature:
+                self.rejected += 1
+                continue
+
+            response = row["search_response"]
+            if isinstance(response, str):
+                response = json.loads(response)
+            response.setdefault("details", {})["cache"] = {
+                "type": "semantic",
+                "similarity": round(float(row["similarity"]), 4),
+                "matched_prompt": row["user_prompt"],
+            }
+            self.hits += 1
+            logger.info(f"Semantic cache hit (similarity={row['similarity']:.4f}) for '{prompt}'")
+            return response, version
+
+        self.misses += 1
+        return None, version
+
+    async def after_store(self, count: int = 1):
+        """
+        Called after `count` responses have been stored with history rows.
+        Periodically trims expired, invalidated and over-capacity entries.
+        """
+        if not self.enabled:
+            return
+
+        self.stores += count
+        self._stores_since_evict += count
+        if self._stores_since_evict < self._evict_every:
+            return
+        self._stores_since_evict = 0
+
+        try:
+            db_engine = await self._get_engine()
+            async with db_engine.begin() as conn:
+                result = await conn.execute(
+                    text(EVICT_SQL),
+                    {"ttl": self.ttl_seconds, "max_entries": self.max_entries}
+                )
+                self.evictions += result.rowcount or 0
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Semantic cache eviction failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected_numeric_mismatch": self.rejected,
+            "errors": self.errors,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from google.api_core.exceptions import GoogleAPIError
+from google.auth.exceptions import GoogleAuthError
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# SIGNED URL CACHE
+# ==============================================================================
+# Signing a GCS URL is an RSA operation (or an IAM signBlob round trip on
+# Cloud Run), so each signed URL is reused until shortly before it expires.
+# Signing runs in worker threads, concurrent requests for the same object
+# share one signing call, and a failing signer is not retried on every request.
+
+SIGNED_URL_TTL_SECONDS = int(os.getenv("SIGNED_URL_TTL_SECONDS", "3600"))
+SIGNED_URL_REFRESH_MARGIN = int(os.getenv("SIGNED_URL_REFRESH_MARGIN", "300"))
+SIGNED_URL_CACHE_MAX_ENTRIES = int(os.getenv("SIGNED_URL_CACHE_MAX_ENTRIES", "10000"))
+SIGNING_FAILURE_BACKOFF_SECONDS = 60
+# Failures of the signer itself (credentials, IAM signBlob). Credentials without
+# a private key or signing support raise AttributeError in google-cloud-storage.
+# Anything else (e.g. a bad URI) only fails that one URL.
+SIGNER_ERRORS = (GoogleAuthError, GoogleAPIError, AttributeError)
+
+
+def parse_gcs_uri(gcs_uri: str) -> tuple:
+    """
+    Splits a gs:// or https://storage.googleapis.com/ URI into (bucket, blob).
+    Raises ValueError for anything else.
+    """
+    if gcs_uri.startswith("gs://"):
+        path = gcs_uri[5:]
+    elif gcs_uri.startswith("https://storage.googleapis.com/"):
+        path = gcs_uri[31:]
+    else:
+        raise ValueError("Invalid GCS URI format.")
+
+    if "/" not in path:
+        raise ValueError("Invalid GCS URI: Missing object path.")
+
+    bucket_name, blob_name = path.split("/", 1)
+    return bucket_name, blob_name
+
+
+class SignedUrlCache:
+    """
+    LRU cache of V4 signed GET URLs keyed by GCS URI.
+    """
+
+    def __init__(self, storage_client, ttl_seconds: int = SIGNED_URL_TTL_SECONDS,
+                 refresh_margin: int = SIGNED_URL_REFRESH_MARGIN,
+                 max_entries: int = SIGNED_URL_CACHE_MAX_ENTRIES):
+        self._storage_client = storage_client
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._signing_disabled_until = 0.0
+        self.hits = 0
+        self.signed = 0
+        self.failures = 0
+
+    def get_cached(self, gcs_uri: str) -> Optional[tuple]:
+        """
+        Returns (url, seconds_until_expiry) if a URL is cached and not about to expire.
+        """
+        entry = self._entries.get(gcs_uri)
+        if entry is None:
+            return None
+        url, expires_at = entry
+        remaining = expires_at - time.time()
+        if remaining <= self.refresh_margin:
+            del self._entries[gcs_uri]
+            return None
+        self._entries.move_to_end(gcs_uri)
+        return url, int(remaining)
+
+    def _sign_blocking(self, gcs_uri: str) -> str:
+        bucket_name, blob_name = parse_gcs_uri(gcs_uri)
+        blob = self._storage_client.bucket(bucket_name).blob(blob_name)
+        return blob.generate_signed_url(
+            version="v4",
+            expiration=self.ttl_seconds,
+            method="GET"
+        )
+
+    async def _sign(self, gcs_uri: str) -> str:
+        try:
+            issued_at = time.time()
+            url = await asyncio.to_thread(self._sign_blocking, gcs_uri)
+        except SIGNER_ERRORS:
+            self.failures += 1
+            self._signing_disabled_until = time.time() + SIGNING_FAILURE_BACKOFF_SECONDS
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self._inflight.pop(gcs_uri, None)
+
+        self.signed += 1
+        self._entries[gcs_uri] = (url, issued_at + self.ttl_seconds)
+        self._entries.move_to_end(gcs_uri)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return url
+
+    async def sign(self, gcs_uri: str) -> tuple:
+        """
+        Returns (signed_url, seconds_until_expiry). Raises if signing fails,
+        and ValueError for a malformed URI.
+        """
+        # Client-supplied URIs are validated before any signing work is started
+        parse_gcs_uri(gcs_uri)
+
+        cached = self.get_cached(gcs_uri)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        if not self._storage_client:
+            raise RuntimeError("Storage client is not initialized.")
+        if time.time() < self._signing_disabled_until:
+            raise RuntimeError("URL signing recently failed; not retrying yet.")
+
+        task = self._inflight.get(gcs_uri)
+        if task is None:
+            task = asyncio.create_task(self._sign(gcs_uri))
+            self._inflight[gcs_uri] = task
+        url = await asyncio.shield(task)
+        return url, self.ttl_seconds
+
+    async def sign_many(self, gcs_uris: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Signs a set of URIs concurrently. Failed or invalid URIs map to None.
+        """
+        unique = list(dict.fromkeys(u for u in gcs_uris if u))
+
+        async def sign_one(uri):
+            try:
+                url, _ = await self.sign(uri)
+                return url
+            except Exception as e:
+                logger.debug(f"Could not sign {uri}: {e}")
+                return None
+
+        urls = await asyncio.gather(*(sign_one(uri) for uri in unique))
+        return dict(zip(unique, urls))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "signed": self.signed,
+            "failures": self.failures,
+            "signing_available": time.time() >= self._signing_disabled_until,
+        }
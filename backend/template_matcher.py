@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import logging
+from decimal import Decimal
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# LOCAL QUERY TEMPLATE MATCHER
+# ==============================================================================
+# The GDA context file (`data_agent_context_file.json`) defines parameterized
+# intents such as "Show me apartments in $1 up to $2 with min $3 rooms" with
+# matching parameterized SQL. Prompts that fit one of these patterns can be
+# answered by running the SQL directly instead of a remote GDA NL2SQL call.
+#
+# Matching is deliberately conservative: the whole prompt must fit the intent,
+# numeric parameters must parse, and free-text parameters must not contain
+# anything that looks like an additional filter. Everything else goes to GDA.
+
+TEMPLATE_FAST_PATH_ENABLED = os.getenv("TEMPLATE_FAST_PATH_ENABLED", "true").lower() == "true"
+# Templates with fewer literal words (e.g. "Show me $1") match almost any prompt
+# and are never used as a confident match
+TEMPLATE_MIN_LITERAL_WORDS = int(os.getenv("TEMPLATE_MIN_LITERAL_WORDS", "4"))
+
+_backend_dir = os.path.dirname(os.path.abspath(__file__))
+CONTEXT_FILE_CANDIDATES = [
+    os.getenv("DATA_AGENT_CONTEXT_FILE", ""),
+    os.path.join(_backend_dir, "data_agent_context_file.json"),
+    os.path.join(os.path.dirname(_backend_dir), "alloydb artefacts", "data_agent_context_file.json"),
+]
+
+_PLACEHOLDER_RE = re.compile(r"\$(\d+)")
+_NUMERIC_COMPARISON_RE = r"(\w+)\s*(?:<=|>=|<>|!=|=|<|>)\s*\$%s\b"
+# Named function arguments such as `hybrid_search(..., p_max_price => $3)`
+_NAMED_ARGUMENT_RE = r"(\w+)\s*=>\s*\$%s\b"
+_ARGUMENT_PREFIX_RE = re.compile(r"^p_(?:(?:min|max)_)?")
+_INTEGER_COLUMNS = {"bedrooms", "id"}
+_AMOUNT_COLUMNS = {"price"}
+_NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+_AMOUNT_RE = re.compile(r"^(?:chf\s*)?(\d+(?:[.,']\d{3})*(?:\.\d+)?)\s*(k)?(?:\s*chf)?$", re.IGNORECASE)
+
+# Words in a free-text parameter that indicate a filter the template cannot express
+_FILTER_WORDS = {
+    "in", "under", "below", "over", "above", "max", "min", "maximum", "minimum",
+    "up", "to", "with", "less", "more", "than", "cheaper", "cheapest", "chf",
+    "bedroom", "bedrooms", "room", "rooms", "price", "budget", "between", "sort", "order",
+}
+
+# Words that make a free-text parameter a combination, negation, count, aggregate
+# or superlative, which a single literal value in the template SQL cannot express
+_NON_LITERAL_WORDS = {
+    "or", "and", "not", "no", "non", "without", "except", "excluding", "nor", "but",
+    "how", "many", "much", "count", "number", "total", "sum", "average", "avg", "mean", "median",
+    "per", "each", "every", "all",
+    "most", "least", "best", "worst", "top", "highest", "lowest", "largest", "smallest",
+    "biggest", "newest", "oldest", "first", "last",
+}
+
+
+def parse_amount(value: str) -> Optional[Decimal]:
+    """
+    Parses "6k", "3000", "3'000", "3,000 CHF" into a Decimal; returns None otherwise.
+    """
+    match = _AMOUNT_RE.match(value.strip())
+    if not match:
+        return None
+    number, k_suffix = match.groups()
+    amount = Decimal(number.replace("'", "").replace(",", ""))
+    if k_suffix:
+        amount *= 1000
+    return amount
+
+
+def parse_count(value: str) -> Optional[int]:
+    value = value.strip().lower()
+    if value.isdigit():
+        return int(value)
+    return _NUMBER_WORDS.get(value)
+
+
+class QueryTemplate:
+    """
+    One parameterized template from the context file.
+    """
+
+    def __init__(self, template_id: int, intent: str, parameterized_intent: str,
+                 parameterized_sql: str, filter_words: set):
+        self.template_id = template_id
+        self.intent = intent
+        self.parameterized_intent = parameterized_intent
+        self.parameterized_sql = parameterized_sql.strip().rstrip(";")
+        self.filter_words = filter_words
+
+        # Intent pattern: literal text must match (case/whitespace-insensitive),
+        # placeholders capture non-empty text.
+        parts = _PLACEHOLDER_RE.split(parameterized_intent.strip())
+        pattern = ""
+        self.literal_words = 0
+        for i, part in enumerate(parts):
+            if i % 2:
+                pattern += f"(?P<p{part}>.+?)"
+                continue
+            words = part.split()
+            self.literal_words += len(words)
+            if part[:1].isspace():
+                pattern += r"\s+"
+            pattern += r"\s+".join(re.escape(w) for w in words)
+            if part[-1:].isspace() and words:
+                pattern += r"\s+"
+        self.regex = re.compile(rf"^\s*{pattern}\s*[.!?]*\s*$", re.IGNORECASE)
+
+        # Parameter types are inferred from how the SQL uses each placeholder
+        self.param_types = {}
+        for number in sorted(set(_PLACEHOLDER_RE.findall(self.parameterized_sql))):
+            comparison = re.search(_NUMERIC_COMPARISON_RE % number, self.parameterized_sql, re.IGNORECASE)
+            argument = re.search(_NAMED_ARGUMENT_RE % number, self.parameterized_sql, re.IGNORECASE)
+            if comparison:
+                column = comparison.group(1).lower()
+                self.param_types[number] = "count" if column in _INTEGER_COLUMNS else "amount"
+            elif argument:
+                column = _ARGUMENT_PREFIX_RE.sub("", argument.group(1).lower())
+                if column in _INTEGER_COLUMNS:
+                    self.param_types[number] = "count"
+                elif column in _AMOUNT_COLUMNS:
+                    self.param_types[number] = "amount"
+                else:
+                    self.param_types[number] = "text"
+            else:
+                self.param_types[number] = "text"
+
+        # Positional $N placeholders become named SQLAlchemy bind parameters
+        self.sql = _PLACEHOLDER_RE.sub(lambda m: f":p{m.group(1)}", self.parameterized_sql)
+
+    def match(self, prompt: str) -> Optional[dict]:
+        """
+        Returns the bind parameters if the prompt confidently matches, else None.
+        """
+        if self.literal_words < TEMPLATE_MIN_LITERAL_WORDS:
+            return None
+        match = self.regex.match(prompt)
+        if not match:
+            return None
+
+        params = {}
+        for number, kind in self.param_types.items():
+            raw = (match.group(f"p{number}") or "").strip()
+            if not raw:
+                return None
+            if kind == "amount":
+                value = parse_amount(raw)
+            elif kind == "count":
+                value = parse_count(raw)
+            else:
+                value = raw if self._is_plain_text(raw) else None
+            if value is None:
+                return None
+            params[f"p{number}"] = value
+        return params
+
+    def _is_plain_text(self, value: str) -> bool:
+        if any(ch.isdigit() for ch in value):
+            return False
+        lowered = value.lower()
+        words = set(re.findall(r"[a-zäöüéèà'-]+", lowered))
+        if words & (_FILTER_WORDS | _NON_LITERAL_WORDS) or "," in value or "/" in value or "&" in value:
+            return False
+        return not any(phrase in lowered for phrase in self.filter_words)
+
+    def display_sql(self, params: dict) -> str:
+        """
+        Renders the SQL with literal values, for display only.
+        """
+        def literal(m):
+            value = params.get(f"p{m.group(1)}")
+            if isinstance(value, str):
+                return "'" + value.replace("'", "''") + "'"
+            return str(value)
+        return _PLACEHOLDER_RE.sub(literal, self.parameterized_sql) + ";"
+
+
+class TemplateMatcher:
+    """
+    Loads the context file templates and picks the most specific confident match.
+    """
+
+    def __init__(self, enabled: bool = TEMPLATE_FAST_PATH_ENABLED):
+        self.enabled = enabled
+        self.templates: List[QueryTemplate] = []
+        self.matches = 0
+        self.fallbacks = 0
+        self.errors = 0
+        self.empty_results = 0
+
+    def load(self, path: Optional[str] = None):
+        if not self.enabled:
+            return
+
+        candidates = [path] if path else [p for p in CONTEXT_FILE_CANDIDATES if p]
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                break
+        else:
+            logger.warning("Data agent context file not found; template fast path disabled.")
+            self.enabled = False
+            return
+
+        with open(candidate, "r") as f:
+            context = json.load(f)
+
+        # Fragment intents ("cheap", "luxury", ...) are filters, so they may not hide in free text
+        filter_words = {
+            fragment.get("intent", "").lower()
+            for fragment in context.get("fragments", [])
+            if fragment.get("intent")
+        }
+
+        self.templates = []
+        for index, template in enumerate(context.get("templates", [])):
+            parameterized = template.get("parameterized") or {}
+            if not parameterized.get("parameterized_intent") or not parameterized.get("parameterized_sql"):
+                continue
+            self.templates.append(QueryTemplate(
+                template_id=index + 1,
+                intent=template.get("intent", ""),
+                parameterized_intent=parameterized["parameterized_intent"],
+                parameterized_sql=parameterized["parameterized_sql"],
+                filter_words=filter_words,
+            ))
+
+        # Most specific templates (more literal words) are tried first
+        self.templates.sort(key=lambda t: t.literal_words, reverse=True)
+        logger.info(f"Loaded {len(self.templates)} query templates from {candidate}.")
+
+    def match(self, prompt: str) -> Optional[tuple]:
+        """
+        Returns (template, params) for the best confident match, or None.
+        """
+        if not self.enabled:
+            return None
+        for template in self.templates:
+            params = template.match(prompt)
+            if params is not None:
+                self.matches += 1
+                return template, params
+        self.fallbacks += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "templates": len(self.templates),
+            "matches": self.matches,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+            "empty_results": self.empty_results,
+        }
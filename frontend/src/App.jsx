@@ -34,13 +34,30 @@ const SearchExamples = ({ onSelectQuery }) => {
     );
 };
 
+// Card-sized WebP derivative served (and cached) by the backend image proxy
+const thumbnailUrl = (proxyUrl) => (proxyUrl ? `${proxyUrl}&w=480&fmt=webp` : null);
+
 const PropertyCard = ({ listing }) => {
+    // The backend sends a pre-signed `image_url` only when derivatives are disabled;
+    // otherwise the small derivative is used. The plain image proxy is the fallback.
+    const sources = [listing.image_url || thumbnailUrl(listing.image_gcs_uri), listing.image_gcs_uri].filter(Boolean);
+    const [sourceIndex, setSourceIndex] = useState(0);
+
+    useEffect(() => {
+        setSourceIndex(0);
+    }, [listing.image_url, listing.image_gcs_uri]);
+
+    const imageSrc = sources[sourceIndex];
+
     return (
         <div className="bg-white dark:bg-slate-800 rounded-xl overflow-hidden shadow-sm hover:shadow-md transition-all border border-slate-100 dark:border-slate-700 group">
             <div className="relative h-48 overflow-hidden bg-slate-100 dark:bg-slate-900">
-                {listing.image_gcs_uri ? (
+                {imageSrc ? (
                     <img
-                        src={listing.image_gcs_uri}
+                        src={imageSrc}
+                        onError={() => {
+                            if (sourceIndex < sources.length - 1) setSourceIndex(sourceIndex + 1);
+                        }}
                         alt={listing.title}
                         className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
                         loading="lazy"
@@ -109,25 +126,64 @@ function App() {
         setIsOutputExpanded(false); // Reset expansion on new search
 
         try {
-            // Call the backend API
+            // Call the streaming backend API
             // Note: We use a relative URL because Vite proxies /api to the backend
-            const response = await fetch('/api/search', {
+            // The response is newline-delimited JSON: listings arrive first, the answer later.
+            const response = await fetch('/api/search/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ query }),
             });
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error(`API Error: ${response.statusText}`);
             }
 
-            const data = await response.json();
-            setResults(data.listings || []);
-            setGeneratedSql(data.sql || '');
-            setNlAnswer(data.nl_answer || '');
-            setSystemDetails(data.details || {});
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let finalData = null;
+
+            const handleEvent = (data) => {
+                if (data.event === 'listings') {
+                    // Show cards as soon as rows are available; the answer keeps loading
+                    setResults(data.listings || []);
+                    if (data.details) {
+                        setSystemDetails(data.details);
+                    }
+                    setLoading(false);
+                } else if (data.event === 'answer') {
+                    finalData = data;
+                    setResults(data.listings || []);
+                    setGeneratedSql(data.sql || '');
+                    setNlAnswer(data.nl_answer || '');
+                    setSystemDetails(data.details || {});
+                } else if (data.event === 'error') {
+                    finalData = data;
+                    setGeneratedSql(data.sql || '');
+                    setNlAnswer(data.nl_answer || '');
+                    if (data.status === 504) {
+                        setError("The search took too long. Please try again.");
+                    }
+                }
+            };
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let newlineIndex;
+                while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+                    const line = buffer.slice(0, newlineIndex).trim();
+                    buffer = buffer.slice(newlineIndex + 1);
+                    if (line) {
+                        handleEvent(JSON.parse(line));
+                    }
+                }
+            }
 
-            if (data.listings?.length === 0 && !data.sql) {
+            if (!finalData || (finalData.listings?.length === 0 && !finalData.sql)) {
                 setError("No results found. Try a different query.");
             }
         } catch (err) {
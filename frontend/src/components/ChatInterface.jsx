@@ -2,12 +2,26 @@ import React, { useState, useRef, useEffect } from 'react';
 import { Send, Bot, User, Loader2, Sparkles, X } from 'lucide-react';
 
 
+// Transform gs:// and https://storage.googleapis.com/ URIs to /api/image URLs
+const toProxiedImage = (prop) => {
+    if (prop.image_gcs_uri && (prop.image_gcs_uri.startsWith('gs://') || prop.image_gcs_uri.startsWith('https://storage.googleapis.com/'))) {
+        return {
+            ...prop,
+            image_gcs_uri: `/api/image?gcs_uri=${encodeURIComponent(prop.image_gcs_uri)}`
+        };
+    }
+    return prop;
+};
+
 const ChatInterface = ({ onClose, onResultsFound }) => {
     const [messages, setMessages] = useState([
         { role: 'model', text: "Hello! I'm your AI real estate assistant. I can help you find properties using natural language. Try asking 'Find me a modern apartment in Zurich' or 'Show me 3 bedroom houses near the lake'." }
     ]);
     const [input, setInput] = useState('');
     const [isLoading, setIsLoading] = useState(false);
+    // True once the model's answer has started to arrive
+    const [isStreaming, setIsStreaming] = useState(false);
+    const [status, setStatus] = useState('Thinking...');
     const [sessionId, setSessionId] = useState('');
     const messagesEndRef = useRef(null);
 
@@ -32,65 +46,89 @@ const ChatInterface = ({ onClose, onResultsFound }) => {
         setInput('');
         setIsLoading(true);
 
+        // Appends streamed text to the bot message of this turn (created on the first chunk)
+        let hasBotMessage = false;
+        const appendText = (delta) => {
+            if (!hasBotMessage) {
+                hasBotMessage = true;
+                setIsStreaming(true);
+                setMessages(prev => [...prev, { role: 'model', text: delta }]);
+            } else {
+                setMessages(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], text: prev[prev.length - 1].text + delta }]);
+            }
+        };
+
         try {
-            const response = await fetch('/agent/chat', {
+            // Server-Sent Events: text chunks, tool progress and the listings as they happen
+            const response = await fetch('/agent/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ message: userMessage.text, session_id: sessionId }),
             });
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error(`Error: ${response.statusText}`);
             }
 
-            const data = await response.json();
-            let responseText = data.response;
-            let properties = [];
-
-            // Parse JSON properties block
-            const jsonRegex = /```json_properties\n([\s\S]*?)\n```/;
-            const match = responseText.match(jsonRegex);
-
-            if (match) {
-                try {
-                    properties = JSON.parse(match[1]);
-                    // Transform gs:// and https://storage.googleapis.com/ URIs to /api/image URLs
-                    properties = properties.map(prop => {
-                        if (prop.image_gcs_uri) {
-                            if (prop.image_gcs_uri.startsWith('gs://') || prop.image_gcs_uri.startsWith('https://storage.googleapis.com/')) {
-                                return {
-                                    ...prop,
-                                    image_gcs_uri: `/api/image?gcs_uri=${encodeURIComponent(prop.image_gcs_uri)}`
-                                };
-                            }
-                        }
-                        return prop;
-                    });
-
-                    // Remove the JSON block from the text to display
-                    responseText = responseText.replace(match[0], '').trim();
-                } catch (e) {
-                    console.error("Failed to parse properties JSON:", e);
+            const handleEvent = (name, data) => {
+                if (name === 'text') {
+                    appendText(data.delta);
+                } else if (name === 'tool_start') {
+                    setStatus('Searching properties...');
+                } else if (name === 'tool_end') {
+                    setStatus(data.row_count ? `Found ${data.row_count} properties` : 'Thinking...');
+                } else if (name === 'listings') {
+                    // Listings are built by the agent service from the tool's result rows,
+                    // so the model only writes the short summary
+                    const properties = (data.listings || []).map(toProxiedImage);
+                    if (onResultsFound) {
+                        onResultsFound(
+                            properties,
+                            data.used_prompt || userMessage.text, // Use the actual prompt sent to tool if available
+                            data.tool_details // Pass the raw tool output (SQL, explanation, etc.)
+                        );
+                    }
+                } else if (name === 'done') {
+                    if (!hasBotMessage) {
+                        appendText(data.response || "Agent executed (no text response)");
+                    }
+                } else if (name === 'error') {
+                    appendText(hasBotMessage ? `\n\n${data.message}` : data.message);
+                }
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // Events are separated by a blank line: "event: <name>\ndata: <json>"
+                let separatorIndex;
+                while ((separatorIndex = buffer.indexOf('\n\n')) >= 0) {
+                    const block = buffer.slice(0, separatorIndex);
+                    buffer = buffer.slice(separatorIndex + 2);
+                    let name = 'message';
+                    let data = '';
+                    for (const line of block.split('\n')) {
+                        if (line.startsWith('event:')) name = line.slice(6).trim();
+                        else if (line.startsWith('data:')) data += line.slice(5).trim();
+                    }
+                    if (data) {
+                        handleEvent(name, JSON.parse(data));
+                    }
                 }
-            }
-
-            const botMessage = { role: 'model', text: responseText, properties };
-            setMessages(prev => [...prev, botMessage]);
-
-            // Notify parent component about found properties AND system details
-            if (onResultsFound) {
-                // We pass properties (if any), the user message (or better, the USED prompt), and tool details
-                onResultsFound(
-                    properties,
-                    data.used_prompt || userMessage.text, // Use the actual prompt sent to tool if available
-                    data.tool_details // Pass the raw tool output (SQL, explanation, etc.)
-                );
             }
         } catch (error) {
             console.error("Chat error:", error);
             setMessages(prev => [...prev, { role: 'model', text: "Sorry, I encountered an error processing your request. Please try again." }]);
         } finally {
             setIsLoading(false);
+            setIsStreaming(false);
+            setStatus('Thinking...');
         }
     };
 
@@ -136,7 +174,7 @@ const ChatInterface = ({ onClose, onResultsFound }) => {
 
                     </div>
                 ))}
-                {isLoading && (
+                {isLoading && !isStreaming && (
                     <div className="flex justify-start">
                         <div className="flex max-w-[80%] gap-3">
                             <div className="w-8 h-8 rounded-full bg-teal-500 text-white flex items-center justify-center flex-shrink-0">
@@ -144,7 +182,7 @@ const ChatInterface = ({ onClose, onResultsFound }) => {
                             </div>
                             <div className="bg-white dark:bg-slate-800 p-4 rounded-2xl rounded-tl-none border border-slate-100 dark:border-slate-700 flex items-center gap-2">
                                 <Loader2 className="w-4 h-4 animate-spin text-slate-400" />
-                                <span className="text-sm text-slate-400">Thinking...</span>
+                                <span className="text-sm text-slate-400">{status}</span>
                             </div>
                         </div>
                     </div>
@@ -10,17 +10,25 @@ const formatCurrency = (number) => {
 };
 
 const ListingCard = ({ listing }) => {
-    const [imageUrl, setImageUrl] = useState(listing.image_gcs_uri || null);
+    // The backend sends a pre-signed `image_url` only when derivatives are disabled;
+    // otherwise the small WebP derivative is used. The plain image proxy is the fallback.
+    const sources = [
+        listing.image_url || (listing.image_gcs_uri ? `${listing.image_gcs_uri}&w=480&fmt=webp` : null),
+        listing.image_gcs_uri,
+    ].filter(Boolean);
+    const [sourceIndex, setSourceIndex] = useState(0);
 
     React.useEffect(() => {
-        setImageUrl(listing.image_gcs_uri || null);
-    }, [listing.image_gcs_uri]);
+        setSourceIndex(0);
+    }, [listing.image_url, listing.image_gcs_uri]);
+
+    const imageUrl = sources[sourceIndex] || null;
 
     return (
         <div className="bg-white/80 dark:bg-slate-800/60 backdrop-blur-md rounded-2xl shadow-sm border border-white/40 dark:border-slate-700/50 overflow-hidden hover:shadow-xl hover:-translate-y-1 transition-all duration-300 flex flex-col group">
             <div className="h-48 bg-slate-100 relative overflow-hidden group">
                 {imageUrl ? (
-                    <img src={imageUrl} alt="Property" className="w-full h-full object-cover hover:scale-105 transition-transform duration-700" />
+                    <img src={imageUrl} onError={() => sourceIndex < sources.length - 1 && setSourceIndex(sourceIndex + 1)} alt="Property" className="w-full h-full object-cover hover:scale-105 transition-transform duration-700" />
                 ) : (
                     <div className="w-full h-full flex flex-col items-center justify-center text-slate-400 dark:text-slate-500 bg-slate-50 dark:bg-slate-900/50">
                         <span className="text-4xl mb-2">🏠</span>
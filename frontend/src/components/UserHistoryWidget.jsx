@@ -1,5 +1,5 @@
-import React, { useState, useEffect } from 'react';
-import { X, Database, Filter, RefreshCw, Loader2 } from 'lucide-react';
+import React, { useState, useEffect, useRef } from 'react';
+import { X, Database, Filter, RefreshCw, Loader2, Search } from 'lucide-react';
 
 const UserHistoryWidget = ({ isOpen, onClose }) => {
     const [history, setHistory] = useState([]);
@@ -7,13 +7,25 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
     const [whereClause, setWhereClause] = useState('');
     const [error, setError] = useState(null);
     const [expandedRows, setExpandedRows] = useState(new Set());
+    const [nextCursor, setNextCursor] = useState(null);
+    const [latestCursor, setLatestCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    const [searchQuery, setSearchQuery] = useState('');
+    const [searchMode, setSearchMode] = useState('text');
+    // While search results are shown, paging and polling of the plain history pause
+    const [searchActive, setSearchActive] = useState(false);
+    // Filters of the last executed query; pagination and polling must keep using them
+    const appliedFilters = useRef([]);
 
-    const toggleRow = (index) => {
+    const PAGE_SIZE = 100;
+    const POLL_INTERVAL_MS = 15000;
+
+    const toggleRow = (id) => {
         const newExpanded = new Set(expandedRows);
-        if (newExpanded.has(index)) {
-            newExpanded.delete(index);
+        if (newExpanded.has(id)) {
+            newExpanded.delete(id);
         } else {
-            newExpanded.add(index);
+            newExpanded.add(id);
         }
         setExpandedRows(newExpanded);
     };
@@ -27,6 +39,12 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
         { value: 'query_explanation', label: 'Explanation' }
     ];
 
+    const searchModes = [
+        { value: 'text', label: 'Full text' },
+        { value: 'substring', label: 'Contains' },
+        { value: 'semantic', label: 'Similar prompts' },
+    ];
+
     const operators = [
         { value: 'ILIKE', label: 'contains' },
         { value: '=', label: 'equals' },
@@ -72,6 +90,16 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
         fetchHistory(clause);
     };
 
+    const postHistory = async (body) => {
+        const response = await fetch('/api/history', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filters: appliedFilters.current, limit: PAGE_SIZE, ...body }),
+        });
+        if (!response.ok) throw new Error('Failed to fetch history');
+        return response.json();
+    };
+
     // Update fetchHistory to accept an optional clause argument
     const fetchHistory = async (clauseOverride) => {
         setLoading(true);
@@ -79,16 +107,43 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
         try {
             // Send structured filters instead of raw SQL
             // Filter out empty values
-            const activeFilters = filters.filter(f => f.value && f.value.trim() !== '');
+            appliedFilters.current = filters.filter(f => f.value && f.value.trim() !== '');
 
-            const response = await fetch('/api/history', {
+            const data = await postHistory({});
+            setSearchActive(false);
+            setHistory(data.rows || []);
+            setNextCursor(data.next_cursor);
+            setLatestCursor(data.latest_cursor);
+            setExpandedRows(new Set());
+        } catch (err) {
+            setError(err.message);
+        } finally {
+            setLoading(false);
+        }
+    };
+
+    const runSearch = async () => {
+        if (!searchQuery.trim()) {
+            fetchHistory();
+            return;
+        }
+        setLoading(true);
+        setError(null);
+        try {
+            const response = await fetch('/api/history/search', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ filters: activeFilters }),
+                body: JSON.stringify({ query: searchQuery, mode: searchMode }),
             });
-            if (!response.ok) throw new Error('Failed to fetch history');
+            if (!response.ok) {
+                const detail = await response.json().catch(() => ({}));
+                throw new Error(detail.detail || 'Failed to search history');
+            }
             const data = await response.json();
+            setSearchActive(true);
             setHistory(data.rows || []);
+            setNextCursor(null);
+            setExpandedRows(new Set());
         } catch (err) {
             setError(err.message);
         } finally {
@@ -96,12 +151,48 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
         }
     };
 
+    // Older rows: the next keyset page after the last row shown
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const data = await postHistory({ cursor: nextCursor });
+            setHistory(prev => [...prev, ...(data.rows || [])]);
+            setNextCursor(data.next_cursor);
+        } catch (err) {
+            setError(err.message);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         if (isOpen) {
             fetchHistory();
         }
     }, [isOpen]);
 
+    // Newer rows: only what was added since the newest row shown
+    useEffect(() => {
+        if (!isOpen || loading || searchActive) return;
+        const timer = setInterval(async () => {
+            try {
+                const data = await postHistory(latestCursor ? { since: latestCursor } : {});
+                if (!latestCursor) {
+                    // The list was empty so far; this is a first page
+                    setHistory(data.rows || []);
+                    setNextCursor(data.next_cursor);
+                } else if (data.rows && data.rows.length) {
+                    setHistory(prev => [...data.rows, ...prev]);
+                }
+                setLatestCursor(data.latest_cursor);
+            } catch (err) {
+                // Polling is best effort; the next tick retries
+            }
+        }, POLL_INTERVAL_MS);
+        return () => clearInterval(timer);
+    }, [isOpen, loading, latestCursor, searchActive]);
+
     if (!isOpen) return null;
 
     return (
@@ -126,6 +217,35 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
 
                 {/* Controls */}
                 <div className="p-4 border-b border-slate-100 dark:border-slate-800 bg-white dark:bg-slate-900 flex flex-col gap-3">
+                    <div className="flex items-center gap-2 flex-wrap">
+                        <span className="text-xs font-bold text-slate-400 w-[50px]">SEARCH</span>
+                        <select
+                            value={searchMode}
+                            onChange={(e) => setSearchMode(e.target.value)}
+                            className="bg-slate-50 dark:bg-slate-800 border border-slate-200 dark:border-slate-700 rounded px-3 py-2 text-sm text-slate-700 dark:text-slate-200 outline-none focus:ring-2 focus:ring-indigo-500/50"
+                        >
+                            {searchModes.map(mode => (
+                                <option key={mode.value} value={mode.value}>{mode.label}</option>
+                            ))}
+                        </select>
+                        <input
+                            type="text"
+                            value={searchQuery}
+                            onChange={(e) => setSearchQuery(e.target.value)}
+                            placeholder={searchMode === 'semantic' ? 'Describe a prompt...' : 'Search prompts and explanations...'}
+                            className="flex-1 bg-slate-50 dark:bg-slate-800 border border-slate-200 dark:border-slate-700 rounded px-3 py-2 text-sm text-slate-700 dark:text-slate-200 outline-none focus:ring-2 focus:ring-indigo-500/50 min-w-[150px]"
+                            onKeyDown={(e) => e.key === 'Enter' && runSearch()}
+                        />
+                        <button
+                            onClick={runSearch}
+                            disabled={loading}
+                            className="px-4 py-2 bg-slate-100 dark:bg-slate-800 hover:bg-slate-200 dark:hover:bg-slate-700 text-slate-700 dark:text-slate-200 rounded-lg text-sm font-medium transition-colors flex items-center gap-2 disabled:opacity-50"
+                        >
+                            <Search className="w-4 h-4" />
+                            Search
+                        </button>
+                    </div>
+
                     <div className="flex flex-col gap-2">
                         {filters.map((filter, index) => (
                             <div key={index} className="flex items-center gap-2 flex-wrap">
@@ -214,12 +334,12 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
                             </tr>
                         </thead>
                         <tbody className="divide-y divide-slate-200 dark:divide-slate-800">
-                            {history.map((row, i) => {
-                                const isExpanded = expandedRows.has(i);
+                            {history.map((row) => {
+                                const isExpanded = expandedRows.has(row.id);
                                 return (
                                     <tr
-                                        key={i}
-                                        onClick={() => toggleRow(i)}
+                                        key={row.id}
+                                        onClick={() => toggleRow(row.id)}
                                         className={`hover:bg-white dark:hover:bg-slate-900 transition-colors cursor-pointer ${isExpanded ? 'bg-white dark:bg-slate-900' : ''}`}
                                     >
                                         <td className={`px-4 py-3 text-slate-700 dark:text-slate-300 align-top ${isExpanded ? 'whitespace-pre-wrap break-words' : 'max-w-xs truncate'}`} title={!isExpanded ? row.user_prompt : ''}>
@@ -248,8 +368,22 @@ const UserHistoryWidget = ({ isOpen, onClose }) => {
                     </table>
                 </div>
 
-                <div className="p-2 border-t border-slate-100 dark:border-slate-800 bg-white dark:bg-slate-900 text-xs text-slate-500 text-center">
-                    Showing up to 1000 rows
+                <div className="p-2 border-t border-slate-100 dark:border-slate-800 bg-white dark:bg-slate-900 text-xs text-slate-500 flex items-center justify-center gap-3">
+                    <span>
+                        {searchActive
+                            ? `Showing ${history.length} best matches`
+                            : `Showing ${history.length} rows, newest first`}
+                    </span>
+                    {nextCursor && (
+                        <button
+                            onClick={loadMore}
+                            disabled={loadingMore}
+                            className="font-medium text-indigo-500 hover:text-indigo-600 flex items-center gap-1 disabled:opacity-50"
+                        >
+                            {loadingMore && <Loader2 className="w-3 h-3 animate-spin" />}
+                            Load older
+                        </button>
+                    )}
                 </div>
             </div>
         </div>
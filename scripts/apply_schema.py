@@ -1,7 +1,9 @@
 import os
+import argparse
 import asyncio
 import asyncpg
 from dotenv import load_dotenv
+from load_listings import load as load_listings
 
 # Load environment variables
 backend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
@@ -78,7 +80,7 @@ async def create_database_if_not_exists():
     except Exception as e:
         print(f"Error checking/creating database: {e}")
 
-async def main():
+async def main(data_path=None):
     if not DB_PASSWORD:
         print("Error: DB_PASSWORD not found in environment.")
         return
@@ -100,14 +102,22 @@ async def main():
         await apply_sql_file(conn, setup_file)
 
         # 2. Apply Data
-        data_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alloydb artefacts', '100 _sample records.sql')
-        await apply_sql_file(conn, data_file)
+        if data_path:
+            # Bulk COPY loader with client-side batched embeddings and resumable checkpoints
+            await load_listings(data_path, batch_size=1000, embed_batch_size=1, embed_concurrency=16)
+        else:
+            data_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alloydb artefacts', 'DML_sample records.sql')
+            await apply_sql_file(conn, data_file)
         
         # 3. Apply Indexes
         index_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alloydb artefacts', 'create_indexes.sql')
         await apply_sql_file(conn, index_file)
+
+        # 4. Apply Search Functions (two-stage hybrid search over the ScaNN indexes)
+        hybrid_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alloydb artefacts', 'hybrid_search.sql')
+        await apply_sql_file(conn, hybrid_file)
         
-        # 4. Verify
+        # 5. Verify
         count = await conn.fetchval("SELECT count(*) FROM property_listings")
         print(f"Total records in property_listings: {count}")
         
@@ -118,4 +128,7 @@ async def main():
         await conn.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Create the schema, load listings and build indexes.")
+    parser.add_argument("--data", help="Listings file (.csv, .jsonl, .parquet) to bulk-load instead of the sample DML")
+    args = parser.parse_args()
+    asyncio.run(main(args.data))
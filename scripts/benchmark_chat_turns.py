@@ -0,0 +1,117 @@
+"""
+Chat latency by turn number, for measuring the effect of tool history compaction.
+
+Runs the same multi-turn refinement conversation in several fresh sessions
+against the agent service's /chat endpoint and reports, per turn number, the
+p50/p95 latency and the prompt/output tokens the model calls used. Without
+compaction, prompt tokens (and latency) grow with every turn because all
+earlier tool results are resent.
+
+Usage:
+    python scripts/benchmark_chat_turns.py                              # agent on 127.0.0.1:8083
+    python scripts/benchmark_chat_turns.py --url https://agent-xyz.run.app --sessions 5
+    python scripts/benchmark_chat_turns.py --prompts my_conversation.txt   # one prompt per line
+
+To compare, run it once against an agent started with AGENT_COMPACTION_ENABLED=false
+and once with compaction enabled (the default).
+"""
+import time
+import uuid
+import argparse
+import asyncio
+import statistics
+from typing import List
+
+import httpx
+
+DEFAULT_CONVERSATION = [
+    "Show me apartments in Zurich",
+    "Only the ones with at least 2 bedrooms",
+    "Under 4000 CHF please",
+    "What about the same in Geneva?",
+    "Something with a lake view instead",
+    "Go back to Zurich, 3 bedrooms, any price",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_session(client: httpx.AsyncClient, url: str, prompts: List[str], results: list):
+    session_id = f"bench-{uuid.uuid4().hex[:12]}"
+    for turn, prompt in enumerate(prompts, start=1):
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/chat", json={"message": prompt, "session_id": session_id})
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            print(f"  {session_id} turn {turn} failed: {e}")
+            results.append({"turn": turn, "error": True})
+            return
+        usage = data.get("usage") or {}
+        results.append({
+            "turn": turn,
+            "error": False,
+            "latency": time.perf_counter() - started,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "listings": len(data.get("listings") or []),
+        })
+
+
+def report(results: list, turns: int):
+    print(f"\n{'turn':>4}  {'ok':>3}  {'p50 s':>7}  {'p95 s':>7}  {'prompt tok':>10}  {'output tok':>10}  {'listings':>8}")
+    for turn in range(1, turns + 1):
+        ok = [r for r in results if r["turn"] == turn and not r["error"]]
+        if not ok:
+            print(f"{turn:>4}  {0:>3}")
+            continue
+        latencies = [r["latency"] for r in ok]
+        prompt_tokens = [r["prompt_tokens"] for r in ok if r["prompt_tokens"] is not None]
+        output_tokens = [r["output_tokens"] for r in ok if r["output_tokens"] is not None]
+        print(
+            f"{turn:>4}  {len(ok):>3}  {percentile(latencies, 50):>7.2f}  {percentile(latencies, 95):>7.2f}  "
+            f"{statistics.mean(prompt_tokens) if prompt_tokens else 0:>10.0f}  "
+            f"{statistics.mean(output_tokens) if output_tokens else 0:>10.0f}  "
+            f"{statistics.mean(r['listings'] for r in ok):>8.1f}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure agent chat latency and tokens by turn number.")
+    parser.add_argument("--url", default="http://127.0.0.1:8083", help="Agent service base URL")
+    parser.add_argument("--sessions", type=int, default=3, help="Conversations to run (default: 3)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Conversations run in parallel (default: 1)")
+    parser.add_argument("--prompts", help="File with one prompt per line (default: built-in refinement dialogue)")
+    parser.add_argument("--timeout", type=float, default=180, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    prompts = DEFAULT_CONVERSATION
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    print(f"Running {args.sessions} conversations of {len(prompts)} turns against {args.url}/chat ...")
+    results = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        async def bounded():
+            async with semaphore:
+                await run_session(client, args.url, prompts, results)
+
+        await asyncio.gather(*(bounded() for _ in range(args.sessions)))
+        report(results, len(prompts))
+
+        try:
+            stats = (await client.get(f"{args.url}/sessions/stats")).json()
+            print(f"\nCompaction: {stats.get('compaction')}")
+        except Exception as e:
+            print(f"\nCould not read /sessions/stats: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -49,6 +49,7 @@ docker rm -f search-backend search-frontend agent-service toolbox-service alloyd
 
 # --- BUILD LOCALLY ---
 echo "🔨 Building images locally..."
+cp "alloydb artefacts/data_agent_context_file.json" backend/data_agent_context_file.json
 docker build -t local-search-backend backend/
 docker build -t local-search-frontend frontend/
 
@@ -176,6 +176,8 @@ handle_build_error() {
 PIDS="$PIDS $!"
 
 # --- BACKEND ---
+# The backend answers template-matching prompts locally from the GDA context file
+cp "alloydb artefacts/data_agent_context_file.json" backend/data_agent_context_file.json
 (
     echo "📦 [Backend] Building..."
     gcloud builds submit ./backend --tag "${BACKEND_IMAGE}:${TAG}" --quiet > /dev/null 2>&1 || handle_build_error "Backend"
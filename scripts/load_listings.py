@@ -0,0 +1,314 @@
+"""
+Bulk, resumable loader for property listings.
+
+Reads listings from CSV, JSONL or Parquet, computes description embeddings in
+concurrent batches on the client (Vertex AI), COPYs each batch into a staging
+table and moves it into property_listings with a single INSERT ... SELECT.
+A per-source checkpoint is committed in the same transaction as every batch,
+so an interrupted load resumes exactly where it stopped.
+
+Expected columns: title, description, price, bedrooms, city, country, canton
+(optional: id, image_gcs_uri).
+
+Usage:
+    python scripts/load_listings.py listings.csv
+    python scripts/load_listings.py listings.parquet --batch-size 2000 --embed-concurrency 32
+    python scripts/load_listings.py listings.jsonl --db-embeddings   # let AlloyDB embed (slower)
+    python scripts/load_listings.py listings.csv --restart           # ignore the checkpoint
+"""
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import asyncio
+from decimal import Decimal
+from typing import Iterator, List, Optional
+
+import asyncpg
+from dotenv import load_dotenv
+
+# Load environment variables
+backend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+dotenv_path = os.path.join(backend_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
+DB_USER = os.environ.get("DB_USER", "postgres")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "Welcome01")
+DB_NAME = os.environ.get("DB_NAME", "search")
+PROJECT_ID = os.getenv("GCP_PROJECT_ID") or os.environ.get("GOOGLE_CLOUD_PROJECT")
+LOCATION = os.getenv("GCP_LOCATION", "europe-west1")
+
+# Must match the model and dimensionality used by the database (cached_embedding / trigger)
+EMBEDDING_MODEL = "gemini-embedding-001"
+EMBEDDING_DIMENSIONS = 3072
+EMBED_MAX_RETRIES = 6
+
+COLUMNS = ["id", "title", "description", "price", "bedrooms", "city", "country", "canton", "image_gcs_uri"]
+STAGING_TABLE = "listing_load_staging"
+
+STAGING_DDL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+        id integer,
+        title text,
+        description text,
+        price numeric,
+        bedrooms integer,
+        city text,
+        country text,
+        canton text,
+        image_gcs_uri text,
+        description_embedding text
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Rows with an explicit id that already exists are skipped, so re-running a load is harmless
+MOVE_SQL = f"""
+    INSERT INTO property_listings
+        (id, title, description, price, bedrooms, city, country, canton, image_gcs_uri, description_embedding)
+    SELECT COALESCE(id, nextval(pg_get_serial_sequence('property_listings', 'id'))),
+           title, description, price, bedrooms, city,
+           COALESCE(country, 'Switzerland'), canton, image_gcs_uri,
+           description_embedding::vector
+    FROM {STAGING_TABLE}
+    ON CONFLICT (id) DO NOTHING
+"""
+
+CHECKPOINT_SQL = """
+    INSERT INTO listing_load_checkpoints (source, rows_loaded, updated_at)
+    VALUES ($1, $2, CURRENT_TIMESTAMP)
+    ON CONFLICT (source) DO UPDATE SET rows_loaded = EXCLUDED.rows_loaded, updated_at = EXCLUDED.updated_at
+"""
+
+
+# --- SOURCE READERS ---
+
+def read_csv(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_parquet(path: str) -> Iterator[dict]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Reading Parquet requires pyarrow: pip install pyarrow")
+    parquet_file = pq.ParquetFile(path)
+    for record_batch in parquet_file.iter_batches(batch_size=10000):
+        yield from record_batch.to_pylist()
+
+
+READERS = {".csv": read_csv, ".jsonl": read_jsonl, ".ndjson": read_jsonl, ".parquet": read_parquet}
+
+
+def read_source(path: str) -> Iterator[dict]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise SystemExit(f"Unsupported file type '{extension}'. Use one of: {', '.join(READERS)}")
+    return READERS[extension](path)
+
+
+def batches(rows: Iterator[dict], size: int, skip: int) -> Iterator[List[dict]]:
+    batch = []
+    for index, row in enumerate(rows):
+        if index < skip:
+            continue
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _empty_to_none(value):
+    if value is None:
+        return None
+    if isinstance(value, str) and value.strip() == "":
+        return None
+    return value
+
+
+def to_record(row: dict) -> tuple:
+    """
+    Normalizes one source row into the staging column order (without the embedding).
+    """
+    values = {column: _empty_to_none(row.get(column)) for column in COLUMNS}
+    if not values["title"] or values["price"] is None:
+        raise ValueError(f"Listing is missing title or price: {row}")
+    return (
+        int(values["id"]) if values["id"] is not None else None,
+        str(values["title"]),
+        values["description"],
+        Decimal(str(values["price"])),
+        int(values["bedrooms"]) if values["bedrooms"] is not None else None,
+        values["city"],
+        values["country"],
+        values["canton"],
+        values["image_gcs_uri"],
+    )
+
+
+# --- EMBEDDINGS ---
+
+class EmbeddingClient:
+    """
+    Computes description embeddings in concurrent requests with retry and backoff.
+    """
+
+    def __init__(self, batch_size: int, concurrency: int):
+        import vertexai
+        from vertexai.language_models import TextEmbeddingModel
+
+        vertexai.init(project=PROJECT_ID, location=LOCATION)
+        self._model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+        self.batch_size = batch_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.retries = 0
+
+    def _embed_blocking(self, texts: List[str]) -> List[str]:
+        embeddings = self._model.get_embeddings(texts, output_dimensionality=EMBEDDING_DIMENSIONS)
+        return ["[" + ",".join(repr(v) for v in e.values) + "]" for e in embeddings]
+
+    async def _embed_chunk(self, texts: List[str]) -> List[str]:
+        async with self._semaphore:
+            for attempt in range(EMBED_MAX_RETRIES):
+                try:
+                    self.requests += 1
+                    return await asyncio.to_thread(self._embed_blocking, texts)
+                except Exception as e:
+                    if attempt == EMBED_MAX_RETRIES - 1:
+                        raise
+                    self.retries += 1
+                    # Exponential backoff with jitter (quota errors are the usual cause)
+                    delay = min(30.0, 2 ** attempt) * (0.5 + random.random())
+                    print(f"  Embedding request failed ({e}); retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def embed(self, texts: List[Optional[str]]) -> List[Optional[str]]:
+        """
+        Returns pgvector text literals in input order (None for empty descriptions).
+        """
+        positions = [i for i, t in enumerate(texts) if t]
+        chunks = [positions[i:i + self.batch_size] for i in range(0, len(positions), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_chunk([texts[i] for i in chunk]) for chunk in chunks))
+
+        vectors: List[Optional[str]] = [None] * len(texts)
+        for chunk, chunk_vectors in zip(chunks, results):
+            for position, vector in zip(chunk, chunk_vectors):
+                vectors[position] = vector
+        return vectors
+
+
+# --- LOADER ---
+
+async def load_batch(conn, source: str, records: List[tuple], vectors: List[Optional[str]], rows_loaded: int) -> int:
+    """
+    COPYs one batch into staging and moves it into property_listings together
+    with the checkpoint, in one transaction. Returns the number of rows inserted.
+    """
+    async with conn.transaction():
+        await conn.copy_records_to_table(
+            STAGING_TABLE,
+            records=[record + (vector,) for record, vector in zip(records, vectors)],
+            columns=COLUMNS + ["description_embedding"],
+        )
+        status = await conn.execute(MOVE_SQL)
+        await conn.execute(CHECKPOINT_SQL, source, rows_loaded)
+    return int(status.split()[-1])
+
+
+async def load(path: str, batch_size: int, embed_batch_size: int, embed_concurrency: int,
+               db_embeddings: bool = False, restart: bool = False):
+    source = os.path.abspath(path)
+
+    print(f"Connecting to {DB_HOST}/{DB_NAME} as {DB_USER}...")
+    conn = await asyncpg.connect(user=DB_USER, password=DB_PASSWORD, database=DB_NAME, host=DB_HOST)
+    try:
+        await conn.execute(STAGING_DDL)
+        if restart:
+            await conn.execute("DELETE FROM listing_load_checkpoints WHERE source = $1", source)
+        done = await conn.fetchval("SELECT rows_loaded FROM listing_load_checkpoints WHERE source = $1", source) or 0
+        if done:
+            print(f"Resuming {path} after {done} rows (use --restart to load from the beginning).")
+
+        embedder = None if db_embeddings else EmbeddingClient(embed_batch_size, embed_concurrency)
+        started = time.perf_counter()
+        processed = inserted = 0
+
+        rows = read_source(path)
+        # Embeddings for the next batch are computed while the current one is written
+        pending = None
+        try:
+            for batch in batches(rows, batch_size, skip=done):
+                records = [to_record(row) for row in batch]
+                embed_task = asyncio.create_task(
+                    embedder.embed([r[2] for r in records]) if embedder
+                    else asyncio.sleep(0, result=[None] * len(records))
+                )
+                if pending:
+                    inserted += await load_batch(conn, source, pending[0], await pending[1],
+                                                 done + processed + len(pending[0]))
+                    processed += len(pending[0])
+                    report(processed, inserted, done, started, embedder)
+                pending = (records, embed_task)
+
+            if pending:
+                inserted += await load_batch(conn, source, pending[0], await pending[1],
+                                             done + processed + len(pending[0]))
+                processed += len(pending[0])
+                report(processed, inserted, done, started, embedder)
+        finally:
+            # On failure, do not leave the look-ahead embedding batch running
+            if pending and not pending[1].done():
+                pending[1].cancel()
+
+        # Explicit ids bypass the SERIAL sequence; move it past the highest id
+        await conn.execute(
+            "SELECT setval(pg_get_serial_sequence('property_listings', 'id'), "
+            "GREATEST((SELECT COALESCE(max(id), 0) FROM property_listings), 1))"
+        )
+        elapsed = time.perf_counter() - started
+        print(f"Done: {processed} rows read, {inserted} inserted in {elapsed:.1f}s "
+              f"({processed / elapsed if elapsed else 0:.0f} rows/s).")
+    finally:
+        await conn.close()
+
+
+def report(processed: int, inserted: int, done: int, started: float, embedder: Optional[EmbeddingClient]):
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed else 0.0
+    line = f"  {done + processed} rows loaded ({inserted} new this run), {rate:.0f} rows/s"
+    if embedder:
+        line += f", {embedder.requests} embedding requests ({embedder.retries} retries)"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load property listings from CSV, JSONL or Parquet.")
+    parser.add_argument("path", help="Listings file (.csv, .jsonl, .parquet)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per COPY/commit (default: 1000)")
+    parser.add_argument("--embed-batch-size", type=int, default=1,
+                        help="Texts per embedding request (default: 1; gemini-embedding-001 takes one input per request)")
+    parser.add_argument("--embed-concurrency", type=int, default=16, help="Parallel embedding requests (default: 16)")
+    parser.add_argument("--db-embeddings", action="store_true",
+                        help="Skip client-side embeddings and let the database trigger compute them row by row")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint for this file")
+    args = parser.parse_args()
+
+    asyncio.run(load(args.path, args.batch_size, args.embed_batch_size, args.embed_concurrency,
+                     args.db_embeddings, args.restart))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+ScaNN index lifecycle tool: sizes, (re)builds and benchmarks the vector indexes.
+
+create_indexes.sql builds every ScaNN index with num_leaves = 1, which is only
+sensible for a few hundred rows. This script looks at the actual row counts and
+picks index parameters accordingly, rebuilds indexes, and measures each
+configuration against exact (brute-force) search: recall@k and p50/p99 latency.
+
+Usage:
+    python scripts/tune_scann_indexes.py inspect
+    python scripts/tune_scann_indexes.py rebuild [--index description] [--dry-run]
+    python scripts/tune_scann_indexes.py benchmark [--index image] [--leaves-to-search 1,5,20]
+    python scripts/tune_scann_indexes.py tune [--index description] [--target-recall 0.95]
+"""
+import os
+import math
+import time
+import argparse
+import asyncio
+import statistics
+from dataclasses import dataclass
+from typing import List, Optional
+
+import asyncpg
+from dotenv import load_dotenv
+
+# Load environment variables
+backend_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+dotenv_path = os.path.join(backend_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
+DB_USER = os.environ.get("DB_USER", "postgres")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "Welcome01")
+DB_NAME = os.environ.get("DB_NAME", "search")
+
+# AUTO mode needs enough rows to train the partitioning on
+AUTO_MODE_MIN_ROWS = 10000
+# Below this a single partition (no partitioning) is as fast as anything else
+SINGLE_LEAF_MAX_ROWS = 1000
+
+
+@dataclass
+class IndexSpec:
+    name: str
+    table: str
+    column: str
+    index_name: str
+
+
+INDEXES = {
+    "description": IndexSpec("description", "property_listings", "description_embedding", "idx_scann_property_desc"),
+    "image": IndexSpec("image", "property_listings", "image_embedding", "idx_scann_image_search"),
+    "prompt_history": IndexSpec("prompt_history", "user_prompt_history", "prompt_embedded", "idx_scann_prompt_history"),
+}
+
+
+@dataclass
+class IndexConfig:
+    mode: str = "MANUAL"
+    num_leaves: Optional[int] = None
+    quantizer: str = "SQ8"
+
+    def with_clause(self) -> str:
+        if self.mode == "AUTO":
+            return "mode = 'AUTO'"
+        return f"mode = 'MANUAL', num_leaves = {self.num_leaves}, quantizer = '{self.quantizer}'"
+
+    def label(self) -> str:
+        if self.mode == "AUTO":
+            return "AUTO"
+        return f"MANUAL leaves={self.num_leaves} {self.quantizer}"
+
+
+def recommend_config(rows: int) -> IndexConfig:
+    """
+    AUTO once there is enough data to train on; otherwise MANUAL with
+    num_leaves ~ sqrt(rows), the usual ScaNN starting point.
+    """
+    if rows >= AUTO_MODE_MIN_ROWS:
+        return IndexConfig(mode="AUTO")
+    if rows <= SINGLE_LEAF_MAX_ROWS:
+        return IndexConfig(num_leaves=1)
+    return IndexConfig(num_leaves=max(1, round(math.sqrt(rows))))
+
+
+def candidate_configs(rows: int) -> List[IndexConfig]:
+    """
+    Configurations compared by `tune`: the recommendation plus coarser and finer partitionings.
+    """
+    if rows <= SINGLE_LEAF_MAX_ROWS:
+        return [IndexConfig(num_leaves=1)]
+    base_leaves = max(1, round(math.sqrt(rows)))
+    configs = [
+        IndexConfig(num_leaves=leaves)
+        for leaves in sorted({max(1, base_leaves // 2), base_leaves, base_leaves * 2})
+    ]
+    if rows >= AUTO_MODE_MIN_ROWS:
+        configs.append(IndexConfig(mode="AUTO"))
+    return configs
+
+
+def default_leaves_to_search(config: IndexConfig, rows: int) -> List[Optional[int]]:
+    """
+    Values of scann.num_leaves_to_search to benchmark (None = server default).
+    """
+    leaves = config.num_leaves or max(1, round(math.sqrt(max(rows, 1))))
+    if leaves <= 1:
+        return [None]
+    return sorted({max(1, leaves // 20), max(1, leaves // 10), max(1, leaves // 4)}) + [None]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def count_rows(conn, spec: IndexSpec) -> int:
+    return await conn.fetchval(f"SELECT count(*) FROM {spec.table} WHERE {spec.column} IS NOT NULL")
+
+
+async def current_definition(conn, spec: IndexSpec) -> Optional[str]:
+    return await conn.fetchval("SELECT indexdef FROM pg_indexes WHERE indexname = $1", spec.index_name)
+
+
+async def rebuild_index(conn, spec: IndexSpec, config: IndexConfig, maintenance_work_mem: Optional[str] = None,
+                        dry_run: bool = False):
+    statements = [
+        f"DROP INDEX IF EXISTS {spec.index_name}",
+        f"CREATE INDEX {spec.index_name} ON {spec.table} USING scann ({spec.column} cosine) "
+        f"WITH ({config.with_clause()})",
+    ]
+    if dry_run:
+        for statement in statements:
+            print(f"  [dry-run] {statement};")
+        return
+
+    started = time.perf_counter()
+    async with conn.transaction():
+        if maintenance_work_mem:
+            await conn.execute(f"SET LOCAL maintenance_work_mem = '{maintenance_work_mem}'")
+        for statement in statements:
+            await conn.execute(statement)
+    print(f"  Built {spec.index_name} ({config.label()}) in {time.perf_counter() - started:.1f}s")
+
+
+async def sample_queries(conn, spec: IndexSpec, rows: int, queries: int) -> List[tuple]:
+    """
+    Uses stored vectors of random rows as query vectors: (id, vector_text).
+    """
+    # Sample a few times more rows than needed so TABLESAMPLE does not come up short
+    percent = min(100.0, 100.0 * queries * 5 / max(rows, 1))
+    records = await conn.fetch(
+        f"SELECT id, {spec.column}::text AS v FROM {spec.table} TABLESAMPLE BERNOULLI ({percent}) "
+        f"WHERE {spec.column} IS NOT NULL LIMIT {queries}"
+    )
+    return [(r["id"], r["v"]) for r in records]
+
+
+async def top_k(conn, spec: IndexSpec, query_id: int, vector: str, k: int, exact: bool,
+                leaves_to_search: Optional[int] = None) -> tuple:
+    """
+    Returns (ids, seconds). Exact search disables index scans so the planner
+    has to compute every distance.
+    """
+    sql = (
+        f"SELECT id FROM {spec.table} WHERE {spec.column} IS NOT NULL AND id <> $2 "
+        f"ORDER BY {spec.column} <=> $1::vector LIMIT $3"
+    )
+    async with conn.transaction():
+        if exact:
+            await conn.execute("SET LOCAL enable_indexscan = off")
+            await conn.execute("SET LOCAL enable_bitmapscan = off")
+        elif leaves_to_search:
+            await conn.execute(f"SET LOCAL scann.num_leaves_to_search = {int(leaves_to_search)}")
+        started = time.perf_counter()
+        records = await conn.fetch(sql, vector, query_id, k)
+        elapsed = time.perf_counter() - started
+    return [r["id"] for r in records], elapsed
+
+
+async def benchmark(conn, spec: IndexSpec, k: int, queries: int,
+                    leaves_to_search_values: List[Optional[int]], label: str) -> List[dict]:
+    rows = await count_rows(conn, spec)
+    if rows == 0:
+        print(f"  {spec.table}.{spec.column} has no vectors; nothing to benchmark.")
+        return []
+
+    samples = await sample_queries(conn, spec, rows, queries)
+    # Ground truth once per query; it does not depend on the index configuration
+    exact_results, exact_latencies = [], []
+    for query_id, vector in samples:
+        ids, elapsed = await top_k(conn, spec, query_id, vector, k, exact=True)
+        exact_results.append(set(ids))
+        exact_latencies.append(elapsed)
+
+    results = []
+    for leaves_to_search in leaves_to_search_values:
+        recalls, latencies = [], []
+        for (query_id, vector), truth in zip(samples, exact_results):
+            ids, elapsed = await top_k(conn, spec, query_id, vector, k, exact=False,
+                                       leaves_to_search=leaves_to_search)
+            latencies.append(elapsed)
+            if truth:
+                recalls.append(len(truth.intersection(ids)) / len(truth))
+        results.append({
+            "config": label,
+            "leaves_to_search": leaves_to_search or "default",
+            "recall": statistics.mean(recalls) if recalls else 0.0,
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p99_ms": 1000 * percentile(latencies, 99),
+            "exact_p50_ms": 1000 * percentile(exact_latencies, 50),
+            "exact_p99_ms": 1000 * percentile(exact_latencies, 99),
+            "queries": len(samples),
+        })
+    return results
+
+
+def print_results(spec: IndexSpec, k: int, results: List[dict]):
+    if not results:
+        return
+    print(f"\n  {spec.index_name}: recall@{k} vs exact search")
+    print(f"  {'config':<28} {'leaves_to_search':>16} {'recall':>8} {'p50 ms':>9} {'p99 ms':>9} {'exact p50':>10} {'exact p99':>10}")
+    for r in results:
+        print(
+            f"  {r['config']:<28} {str(r['leaves_to_search']):>16} {r['recall']:>8.3f} "
+            f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['exact_p50_ms']:>10.2f} {r['exact_p99_ms']:>10.2f}"
+        )
+
+
+async def cmd_inspect(conn, specs: List[IndexSpec], args):
+    for spec in specs:
+        rows = await count_rows(conn, spec)
+        definition = await current_definition(conn, spec)
+        print(f"\n[{spec.name}] {spec.table}.{spec.column}")
+        print(f"  Rows with vectors: {rows}")
+        print(f"  Current index:     {definition or '(missing)'}")
+        print(f"  Recommended:       {recommend_config(rows).label()}")
+
+
+async def cmd_rebuild(conn, specs: List[IndexSpec], args):
+    for spec in specs:
+        rows = await count_rows(conn, spec)
+        config = recommend_config(rows)
+        if args.mode:
+            config.mode = args.mode.upper()
+        if args.num_leaves:
+            config.mode, config.num_leaves = "MANUAL", args.num_leaves
+        if args.quantizer:
+            config.quantizer = args.quantizer.upper()
+        if config.mode == "MANUAL" and not config.num_leaves:
+            config.num_leaves = max(1, round(math.sqrt(max(rows, 1))))
+        print(f"\n[{spec.name}] {rows} rows -> {config.label()}")
+        await rebuild_index(conn, spec, config, args.maintenance_work_mem, args.dry_run)
+
+
+async def cmd_benchmark(conn, specs: List[IndexSpec], args):
+    for spec in specs:
+        rows = await count_rows(conn, spec)
+        definition = await current_definition(conn, spec)
+        if not definition:
+            print(f"\n[{spec.name}] {spec.index_name} does not exist; run 'rebuild' first.")
+            continue
+        leaves = args.leaves_to_search or default_leaves_to_search(recommend_config(rows), rows)
+        results = await benchmark(conn, spec, args.k, args.queries, leaves, "current")
+        print_results(spec, args.k, results)
+
+
+async def cmd_tune(conn, specs: List[IndexSpec], args):
+    for spec in specs:
+        rows = await count_rows(conn, spec)
+        print(f"\n[{spec.name}] {rows} rows; comparing configurations...")
+        all_results = []
+        for config in candidate_configs(rows):
+            await rebuild_index(conn, spec, config, args.maintenance_work_mem)
+            leaves = args.leaves_to_search or default_leaves_to_search(config, rows)
+            results = await benchmark(conn, spec, args.k, args.queries, leaves, config.label())
+            for r in results:
+                r["index_config"] = config
+            all_results.extend(results)
+        print_results(spec, args.k, all_results)
+
+        # Fastest configuration that meets the recall target (else the most accurate one)
+        good = [r for r in all_results if r["recall"] >= args.target_recall]
+        if not all_results:
+            continue
+        best = min(good, key=lambda r: r["p50_ms"]) if good else max(all_results, key=lambda r: r["recall"])
+        print(
+            f"\n  Selected {best['config']} (leaves_to_search={best['leaves_to_search']}): "
+            f"recall@{args.k}={best['recall']:.3f}, p50={best['p50_ms']:.2f} ms, p99={best['p99_ms']:.2f} ms"
+        )
+        if best["leaves_to_search"] != "default":
+            print(f"  Set scann.num_leaves_to_search = {best['leaves_to_search']} for query sessions.")
+        if args.dry_run:
+            print("  [dry-run] Leaving the last benchmarked configuration in place.")
+        else:
+            await rebuild_index(conn, spec, best["index_config"], args.maintenance_work_mem)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Size, rebuild and benchmark the ScaNN indexes.")
+    parser.add_argument("command", choices=["inspect", "rebuild", "benchmark", "tune"])
+    parser.add_argument("--index", choices=sorted(INDEXES), action="append",
+                        help="Index to work on (repeatable; default: all)")
+    parser.add_argument("--mode", choices=["auto", "manual"], help="rebuild: force the index mode")
+    parser.add_argument("--num-leaves", type=int, help="rebuild: force num_leaves (implies manual mode)")
+    parser.add_argument("--quantizer", choices=["sq8", "ah", "flat"], help="rebuild: force the quantizer")
+    parser.add_argument("--maintenance-work-mem", help="Memory for index builds, e.g. '2GB'")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query for recall@k (default: 10)")
+    parser.add_argument("--queries", type=int, default=100, help="Benchmark queries (default: 100)")
+    parser.add_argument("--leaves-to-search", type=lambda v: [int(x) for x in v.split(",")],
+                        help="Comma-separated scann.num_leaves_to_search values to benchmark")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="tune: minimum recall@k (default: 0.95)")
+    parser.add_argument("--dry-run", action="store_true", help="Print DDL instead of executing the final rebuild")
+    args = parser.parse_args()
+
+    specs = [INDEXES[name] for name in (args.index or INDEXES)]
+
+    print(f"Connecting to {DB_HOST}/{DB_NAME} as {DB_USER}...")
+    try:
+        conn = await asyncpg.connect(user=DB_USER, password=DB_PASSWORD, database=DB_NAME, host=DB_HOST)
+    except Exception as e:
+        print(f"Failed to connect to database '{DB_NAME}': {e}")
+        print("Please ensure the AlloyDB Auth Proxy is running and the database exists.")
+        return
+
+    try:
+        commands = {
+            "inspect": cmd_inspect,
+            "rebuild": cmd_rebuild,
+            "benchmark": cmd_benchmark,
+            "tune": cmd_tune,
+        }
+        await commands[args.command](conn, specs, args)
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())